@@ -0,0 +1,227 @@
+import argparse
+import json
+import random
+
+from retrieval import CHUNK_CHARS, chunk_page, is_not_found
+
+PERSONAS_FILE = "personas.json"
+CONTENT_FILE = "scraped_domain_content.json"
+INDEX_FILE = "combined_index.json"
+COMBINED_FILE = "combined_data.json"
+
+STRATEGIES = ["uniform", "per_url", "per_persona"]
+
+class Combiner:
+    """Persona x context-chunk pairs for QuestionGeneration, produced on demand.
+
+    Personas and contexts are stored once; a pair is only materialised when it is
+    yielded, so memory and disk grow with personas + contexts instead of their
+    product. Pairs are addressed by index (persona-major), which lets the sampling
+    strategies pick pairs without building the full cross product:
+
+    - uniform: pairs drawn uniformly from the whole product
+    - per_url: the same number of pairs for every URL (stratified by URL)
+    - per_persona: the same number of pairs for every persona
+    """
+
+    def __init__(self, personas, contexts, chunk_size=CHUNK_CHARS, skip_not_found=True, urls=None):
+        self.personas = list(personas)
+        # Only these pages when given, e.g. the new and changed URLs of a re-scrape
+        urls = set(urls) if urls is not None else None
+        # (url, chunk) for every chunk of every usable page
+        self.chunks = []
+        self.skipped = []
+        for page in contexts:
+            if urls is not None and page["url"] not in urls:
+                continue
+            if skip_not_found and is_not_found(page["content"]):
+                self.skipped.append(page["url"])
+                continue
+            self.chunks.extend((page["url"], chunk) for chunk in chunk_page(page["content"], chunk_size))
+        self.urls = sorted({url for url, _ in self.chunks})
+
+    @classmethod
+    def from_files(cls, personas_file=PERSONAS_FILE, content_file=CONTENT_FILE, **options):
+        with open(personas_file) as file:
+            personas = [persona["bio"] for persona in json.load(file)]
+        with open(content_file) as file:
+            contexts = json.load(file)
+        return cls(personas, contexts, **options)
+
+    def __len__(self):
+        return len(self.personas) * len(self.chunks)
+
+    def pair(self, index):
+        persona, chunk = divmod(index, len(self.chunks))
+        url, context = self.chunks[chunk]
+        return {"persona_bio": self.personas[persona], "context": context, "url": url}
+
+    def __getitem__(self, index):
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return self.pair(index)
+
+    def __iter__(self):
+        return (self.pair(index) for index in range(len(self)))
+
+    def sample_indices(self, count, strategy="uniform", seed=0):
+        """Indices of count pairs picked by strategy, in a stable order for a seed"""
+        rng = random.Random(seed)
+        if strategy == "uniform":
+            return sorted(rng.sample(range(len(self)), min(count, len(self))))
+
+        # Groups of candidate pair indices, one group per URL or per persona
+        width = len(self.chunks)
+        if strategy == "per_url":
+            groups = [
+                [persona * width + chunk
+                 for persona in range(len(self.personas))
+                 for chunk, (chunk_url, _) in enumerate(self.chunks) if chunk_url == url]
+                for url in self.urls
+            ]
+        elif strategy == "per_persona":
+            groups = [range(persona * width, (persona + 1) * width) for persona in range(len(self.personas))]
+        else:
+            raise ValueError(f"Unknown sampling strategy {strategy!r}, expected one of {', '.join(STRATEGIES)}")
+
+        # Spread count evenly over the groups; the first ones take the remainder
+        indices = []
+        for position, group in enumerate(groups):
+            share = count // len(groups) + (position < count % len(groups))
+            indices.extend(rng.sample(group, min(share, len(group))))
+        return sorted(indices)
+
+    def sample(self, count, strategy="uniform", seed=0):
+        """Lazily yield count pairs picked by strategy"""
+        return (self.pair(index) for index in self.sample_indices(count, strategy, seed))
+
+    def instructions(self, indices=None):
+        """QuestionGeneration inputs (persona_bio, context) for the given or all pairs"""
+        pairs = self if indices is None else (self.pair(index) for index in indices)
+        for pair in pairs:
+            yield {"persona_bio": pair["persona_bio"], "context": pair["context"]}
+
+    def batch_instructions(self, size, indices=None):
+        """BatchQuestionGeneration inputs: up to size personas per context, so a
+        shared context is sent once per batch instead of once per persona"""
+        if indices is None:
+            indices = range(len(self))
+        by_chunk = {}
+        for index in indices:
+            persona, chunk = divmod(index, len(self.chunks))
+            by_chunk.setdefault(chunk, []).append(self.personas[persona])
+        for chunk, personas in by_chunk.items():
+            for batch in batches(personas, size):
+                yield {"personas": batch, "context": self.chunks[chunk][1]}
+
+    def save(self, path=INDEX_FILE, indices=None):
+        """Store personas, chunks and the selected pair indices instead of every pair"""
+        with open(path, 'w') as file:
+            json.dump({
+                "personas": self.personas,
+                "chunks": [{"url": url, "context": context} for url, context in self.chunks],
+                "pairs": indices,
+            }, file)
+
+    @classmethod
+    def load(cls, path=INDEX_FILE):
+        """Return (combiner, pair indices or None for all pairs) from a saved index"""
+        with open(path) as file:
+            data = json.load(file)
+        combiner = cls(data["personas"], [], skip_not_found=False)
+        combiner.chunks = [(chunk["url"], chunk["context"]) for chunk in data["chunks"]]
+        combiner.urls = sorted({url for url, _ in combiner.chunks})
+        return combiner, data["pairs"]
+
+def batches(items, size):
+    """Group any iterable into lists of at most size items, e.g. instructions per executor run"""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def answer_batches(questions, size):
+    """BatchAnswerGeneration inputs from QuestionGeneration outputs: questions that
+    share a context go out together, up to size per batch"""
+    pending = {}
+    for question in questions:
+        batch = pending.setdefault(question["context"], {"personas": [], "questions": [], "context": question["context"]})
+        batch["personas"].append(question["persona"])
+        batch["questions"].append(question["question"])
+        if len(batch["questions"]) == size:
+            yield pending.pop(question["context"])
+    yield from pending.values()
+
+def retry_batches(inputs, outputs, size=1):
+    """Batch inputs for the items that got no output, at most size per batch.
+
+    BatchQuestionGeneration and BatchAnswerGeneration reject a reply whose ids don't
+    match its items as a whole, so its items come back here to be resubmitted in
+    smaller batches, down to one item per workflow.
+    """
+    outputs = list(outputs)
+    asked = {(output["persona"], output["context"]) for output in outputs}
+    answered = {(output["persona"], output["question"], output["context"]) for output in outputs}
+    for batch in inputs:
+        if "questions" in batch:
+            items = [
+                (persona, question)
+                for persona, question in zip(batch["personas"], batch["questions"])
+                if (persona, question, batch["context"]) not in answered
+            ]
+            for part in batches(items, size):
+                yield {"personas": [persona for persona, _ in part], "questions": [question for _, question in part],
+                       "context": batch["context"]}
+        else:
+            personas = [persona for persona in batch["personas"] if (persona, batch["context"]) not in asked]
+            for part in batches(personas, size):
+                yield {"personas": part, "context": batch["context"]}
+
+def write_combined(pairs, path=COMBINED_FILE):
+    """Write pairs in the old fully materialised combined_data.json format, one at a time"""
+    count = 0
+    with open(path, 'w') as file:
+        file.write("[")
+        for pair in pairs:
+            file.write(("," if count else "") + "\n  " + json.dumps(pair))
+            count += 1
+        file.write("\n]" if count else "]")
+    return count
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Combine personas with scraped contexts lazily")
+    parser.add_argument("--personas", default=PERSONAS_FILE, help="Personas JSON file")
+    parser.add_argument("--content", default=CONTENT_FILE, help="Scraped content JSON file")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_CHARS,
+                        help="Split contexts into chunks of at most this many characters, 0 for whole pages")
+    parser.add_argument("--keep-not-found", action="store_true", help="Keep pages scraped from 404 responses")
+    parser.add_argument("--only", metavar="FILE", help="JSON list of URLs to combine, e.g. changed_urls.json from scraper.py")
+    parser.add_argument("--sample", type=int, help="Number of pairs to pick instead of all of them")
+    parser.add_argument("--strategy", choices=STRATEGIES, default="uniform", help="How sampled pairs are spread")
+    parser.add_argument("--seed", type=int, default=0, help="Sampling seed")
+    parser.add_argument("--output", default=INDEX_FILE, help="Index file with personas, chunks and pair indices")
+    parser.add_argument("--expand", metavar="FILE", help="Also write the pairs out in full, like combined_data.json")
+    args = parser.parse_args()
+
+    urls = None
+    if args.only:
+        with open(args.only) as file:
+            urls = json.load(file)
+    combiner = Combiner.from_files(args.personas, args.content, chunk_size=args.chunk_size,
+                                   skip_not_found=not args.keep_not_found, urls=urls)
+    indices = combiner.sample_indices(args.sample, args.strategy, args.seed) if args.sample else None
+    combiner.save(args.output, indices)
+
+    selected = len(indices) if indices is not None else len(combiner)
+    print(
+        f"{len(combiner.personas)} personas x {len(combiner.chunks)} chunks from {len(combiner.urls)} URLs "
+        f"= {len(combiner)} pairs, {selected} selected; skipped {len(combiner.skipped)} not-found pages"
+    )
+    print(f"Index written to {args.output}")
+    if args.expand:
+        pairs = combiner if indices is None else (combiner.pair(index) for index in indices)
+        print(f"Wrote {write_combined(pairs, args.expand)} pairs to {args.expand}")
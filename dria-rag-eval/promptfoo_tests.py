@@ -0,0 +1,268 @@
+import argparse
+import hashlib
+import json
+import os
+import re
+from collections import defaultdict
+
+TESTS_DIR = "promptfoo_tests"
+RETRY_FILE = "promptfoo_tests/retry.jsonl"
+SHARD_SIZE = 100
+READ_BYTES = 1 << 20
+
+# Where the array of result rows starts in `promptfoo eval -o results.json`
+RESULTS_ARRAY = re.compile(r'"results"\s*:\s*\[')
+
+def iter_json_array(path, start=None):
+    """Yield the elements of a JSON array one at a time without loading the file.
+
+    The array is the top-level value, or with start a regex, the first array the
+    regex ends in. Each element is decoded from a buffer that is refilled as needed,
+    so memory stays at one element plus READ_BYTES.
+    """
+    decoder = json.JSONDecoder()
+    with open(path, encoding="utf-8") as file:
+        buffer = file.read(READ_BYTES)
+        pattern = start or re.compile(r"\s*\[")
+        while True:
+            match = pattern.search(buffer) if start else pattern.match(buffer)
+            chunk = file.read(READ_BYTES) if not match else ""
+            if match or not chunk:
+                break
+            buffer += chunk
+        if not match:
+            raise ValueError(f"No JSON array found in {path}")
+        buffer = buffer[match.end():]
+
+        while True:
+            buffer = buffer.lstrip(" \t\r\n,")
+            if buffer.startswith("]"):
+                return
+            try:
+                item, end = decoder.raw_decode(buffer)
+                # A number cut by the end of the buffer ("3" or "3." of 3.5) decodes too
+                # early; an element is only whole once a separator follows it
+                complete = buffer[end:end + 1] in (" ", "\t", "\r", "\n", ",", "]")
+            except json.JSONDecodeError:
+                complete = False
+            if not complete:
+                chunk = file.read(READ_BYTES)
+                if chunk:
+                    buffer += chunk
+                    continue
+                # At the end of the file: what decoded is whole, anything else is truncated
+                item, end = decoder.raw_decode(buffer)
+            yield item
+            buffer = buffer[end:]
+
+def iter_records(path, start=None):
+    """Records of a JSONL file or, for any other file, of a (possibly nested) JSON array"""
+    if path.endswith(".jsonl"):
+        with open(path, encoding="utf-8") as file:
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
+    else:
+        yield from iter_json_array(path, start)
+
+def case_id(record):
+    """Stable id of a QA pair, to match results and retries back to it"""
+    text = f"{record.get('persona', '')}\n{record['question']}"
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:12]
+
+def to_test(record, with_context=False, assertion="factuality"):
+    """promptfoo test case for a QuestionOutput or AnswerOutput record"""
+    test = {
+        "description": record["question"][:80],
+        "vars": {"question": record["question"], "persona": record.get("persona", "")},
+        "metadata": {"case_id": case_id(record)},
+    }
+    if with_context:
+        test["vars"]["context"] = record["context"]
+    if record.get("answer"):
+        test["assert"] = [{"type": assertion, "value": record["answer"]}]
+    return test
+
+class ShardWriter:
+    """Write test cases to tests-00000.jsonl, tests-00001.jsonl, ... of shard_size each"""
+
+    def __init__(self, directory=TESTS_DIR, shard_size=SHARD_SIZE, prefix="tests"):
+        self.directory = directory
+        self.shard_size = shard_size
+        self.prefix = prefix
+        self.paths = []
+        self.file = None
+        self.count = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def write(self, test):
+        if self.count % self.shard_size == 0:
+            self.close()
+            path = os.path.join(self.directory, f"{self.prefix}-{len(self.paths):05d}.jsonl")
+            self.paths.append(path)
+            self.file = open(path, 'w', encoding="utf-8")
+        self.file.write(json.dumps(test, ensure_ascii=False) + "\n")
+        self.count += 1
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+def export_tests(input_file, directory=TESTS_DIR, shard_size=SHARD_SIZE, with_context=False, assertion="factuality"):
+    """Stream QA records into sharded promptfoo test files, skipping repeated pairs"""
+    writer = ShardWriter(directory, shard_size)
+    seen = set()
+    duplicates = 0
+    for record in iter_records(input_file):
+        test = to_test(record, with_context, assertion)
+        if test["metadata"]["case_id"] in seen:
+            duplicates += 1
+            continue
+        seen.add(test["metadata"]["case_id"])
+        writer.write(test)
+    writer.close()
+
+    print(f"✅ Exported {writer.count} test cases to {len(writer.paths)} shards in {directory} ({duplicates} duplicates skipped)")
+    print("Add them to promptfooconfig.yaml:")
+    print("tests:")
+    for path in writer.paths:
+        print(f"  - file://{path}")
+    return writer.paths
+
+def result_error(result):
+    """Why a result row didn't produce a gradable response, or None.
+
+    Covers provider errors (e.g. "Error parsing response as JSON" when the agent
+    answers with an empty body) and empty outputs that promptfoo didn't flag.
+    """
+    # failureReason 2 is promptfoo's ERROR, as opposed to a failed assertion
+    if result.get("error") and (result.get("failureReason") == 2 or not result.get("gradingResult")):
+        return (str(result["error"]).strip().splitlines() or ["error"])[0]
+    response = result.get("response") or {}
+    if response.get("error"):
+        return (str(response["error"]).strip().splitlines() or ["error"])[0]
+    output = response.get("output")
+    if output is None or (isinstance(output, str) and not output.strip()):
+        return "empty response"
+    return None
+
+def provider_of(result):
+    provider = result.get("provider") or {}
+    if isinstance(provider, str):
+        return provider
+    return provider.get("label") or provider.get("id") or "unknown"
+
+def ingest_results(result_files, retry_file=RETRY_FILE, retry_failures=False):
+    """Aggregate promptfoo results per provider and collect the cases to rerun.
+
+    Result files are read one row at a time, in order, so a later file (e.g. the
+    run of a retry file) replaces earlier results of the same case and provider.
+    Only a compact outcome per case and provider is kept in memory. Cases that
+    errored, and with retry_failures also those that failed their assertions, are
+    written to retry_file as test cases ready for another `promptfoo eval`.
+    """
+    outcomes = {}
+    tests = {}
+    rows = 0
+    for path in result_files:
+        for result in iter_records(path, RESULTS_ARRAY):
+            rows += 1
+            test = result.get("testCase") or {"vars": result.get("vars", {})}
+            key = (test.get("metadata", {}).get("case_id") or case_id(test["vars"]), provider_of(result))
+            error = result_error(result)
+            outcomes[key] = {
+                "error": error,
+                "success": bool(result.get("success")) and error is None,
+                "score": result.get("score", 0) or 0,
+                "latency": result.get("latencyMs", 0) or 0,
+                "tokens": ((result.get("response") or {}).get("tokenUsage") or {}).get("total", 0) or 0,
+                "named": result.get("namedScores") or {},
+            }
+            # Only cases that may need a rerun keep their test case
+            if not outcomes[key]["success"]:
+                tests[key[0]] = test
+
+    totals = defaultdict(lambda: {"cases": 0, "passed": 0, "failed": 0, "errors": 0, "score": 0.0,
+                                  "latency": 0, "tokens": 0, "named": defaultdict(float), "error_kinds": defaultdict(int)})
+    retry = {}
+    for (case, provider), outcome in outcomes.items():
+        total = totals[provider]
+        total["cases"] += 1
+        total["latency"] += outcome["latency"]
+        total["tokens"] += outcome["tokens"]
+        if outcome["error"] is not None:
+            total["errors"] += 1
+            total["error_kinds"][outcome["error"][:60]] += 1
+            retry[case] = tests[case]
+            continue
+        total["score"] += outcome["score"]
+        for name, value in outcome["named"].items():
+            total["named"][name] += value
+        if outcome["success"]:
+            total["passed"] += 1
+        else:
+            total["failed"] += 1
+            if retry_failures:
+                retry[case] = tests[case]
+
+    print(f"{rows} result rows, {len(outcomes)} case x provider outcomes")
+    print(f"{'Provider':<40} {'cases':>6} {'pass':>6} {'fail':>6} {'error':>6} {'pass%':>6} {'score':>6} {'ms':>7} {'tokens':>8}")
+    summary = {}
+    for provider, total in sorted(totals.items()):
+        graded = total["cases"] - total["errors"]
+        summary[provider] = {
+            "cases": total["cases"],
+            "passed": total["passed"],
+            "failed": total["failed"],
+            "errors": total["errors"],
+            "pass_rate": total["passed"] / graded if graded else 0.0,
+            "mean_score": total["score"] / graded if graded else 0.0,
+            "mean_latency_ms": total["latency"] / total["cases"],
+            "tokens": total["tokens"],
+            "named_scores": {name: value / graded for name, value in total["named"].items()} if graded else {},
+            "error_kinds": dict(total["error_kinds"]),
+        }
+        row = summary[provider]
+        print(
+            f"{provider[:40]:<40} {row['cases']:>6} {row['passed']:>6} {row['failed']:>6} {row['errors']:>6} "
+            f"{row['pass_rate']:>6.1%} {row['mean_score']:>6.2f} {row['mean_latency_ms']:>7.0f} {row['tokens']:>8}"
+        )
+        for kind, count in sorted(row["error_kinds"].items(), key=lambda item: -item[1]):
+            print(f"    {count} x {kind}")
+
+    if retry:
+        os.makedirs(os.path.dirname(retry_file) or ".", exist_ok=True)
+        with open(retry_file, 'w', encoding="utf-8") as file:
+            for test in retry.values():
+                file.write(json.dumps(test, ensure_ascii=False) + "\n")
+        print(f"❌ {len(retry)} cases to rerun written to {retry_file}")
+    else:
+        print("✅ Nothing to rerun")
+    return summary
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export QA pairs as promptfoo tests and ingest promptfoo results")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export = commands.add_parser("export", help="Write QA records as sharded promptfoo test files")
+    export.add_argument("input", help="QuestionOutput/AnswerOutput records, as JSONL or a JSON array")
+    export.add_argument("--output-dir", default=TESTS_DIR, help="Directory for the test shards")
+    export.add_argument("--shard-size", type=int, default=SHARD_SIZE, help="Test cases per shard")
+    export.add_argument("--with-context", action="store_true", help="Pass the context to the provider as a var")
+    export.add_argument("--assertion", default="factuality", help="promptfoo assertion type checked against the answer")
+
+    ingest = commands.add_parser("ingest", help="Aggregate promptfoo result files and collect cases to rerun")
+    ingest.add_argument("results", nargs="+", help="promptfoo output files (results.json or .jsonl), oldest first")
+    ingest.add_argument("--retry-file", default=RETRY_FILE, help="Where to write the test cases to rerun")
+    ingest.add_argument("--retry-failures", action="store_true", help="Also rerun cases that failed their assertions")
+    ingest.add_argument("--summary", help="Write the per-provider summary to this JSON file")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        export_tests(args.input, args.output_dir, args.shard_size, args.with_context, args.assertion)
+    else:
+        summary = ingest_results(args.results, args.retry_file, args.retry_failures)
+        if args.summary:
+            with open(args.summary, 'w') as file:
+                json.dump(summary, file, indent=2)
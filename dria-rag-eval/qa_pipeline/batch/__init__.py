@@ -0,0 +1,2 @@
+from .task import BatchQuestionGeneration, BatchAnswerGeneration
+__all__ = ["BatchQuestionGeneration", "BatchAnswerGeneration"]
\ No newline at end of file
@@ -0,0 +1,109 @@
+import logging
+import re
+from typing import List
+
+from dria import SingletonTemplate
+from dria.models import TaskResult
+from pydantic import Field
+
+from dria_workflows import *
+from dria.factory.utilities import get_abs_path
+
+from ..question.task import QuestionOutput
+from ..answer.task import AnswerOutput
+
+logger = logging.getLogger(__name__)
+
+# Generation budget per persona or question in a batch
+TOKENS_PER_ITEM = 800
+
+def numbered(items, tag):
+    """Items wrapped in <tag id="N"> tags, numbered from 1, for the reply to refer to"""
+    return "\n\n".join(f'<{tag} id="{index}">{item}</{tag}>' for index, item in enumerate(items, 1))
+
+def tagged(text, tag, count):
+    """Contents of the <tag id="N"> tags in a reply by id, or None unless ids 1..count
+    each appear exactly once, e.g. when the model skipped or merged an item"""
+    found = re.findall(rf'<{tag}\s+id="?(\d+)"?\s*>(.*?)</{tag}>', text, re.S)
+    if sorted(int(index) for index, _ in found) != list(range(1, count + 1)):
+        return None
+    return {int(index): content.strip() for index, content in found}
+
+def build_workflow(prompt, items, **inputs):
+    builder = WorkflowBuilder(**inputs)
+    builder.set_max_tokens(TOKENS_PER_ITEM * len(items))
+    builder.set_max_time(65)
+    builder.set_max_steps(3)
+
+    builder.generative_step(
+        path=get_abs_path(prompt),
+        operator=Operator.GENERATION,
+        outputs=[Write.new("output")],
+    )
+
+    flow = [Edge(source="0", target="_end")]
+
+    builder.flow(flow)
+    builder.set_return_value("output")
+    return builder.build()
+
+class BatchQuestionGeneration(SingletonTemplate):
+    """QuestionGeneration for several personas sharing one context, in one workflow"""
+
+    personas: List[str] = Field(...,description="Personas")
+    context: str = Field(...,description="Context")
+
+    OutputSchema=QuestionOutput
+
+    def workflow(self):
+        return build_workflow("question.md", self.personas, personas=numbered(self.personas, "persona"),
+                              context=self.context)
+
+    def callback(self, result: List[TaskResult]) -> List[QuestionOutput]:
+        results = []
+        for r in result:
+            # Questions are matched to personas by id; a reply that doesn't match is rejected whole
+            questions = tagged(r.result, "question", len(self.personas))
+            if questions is None:
+                logger.warning(f"Rejected a reply that doesn't have one question per persona ({len(self.personas)})")
+                continue
+            for index, persona in enumerate(self.personas, 1):
+                results.append(
+                        QuestionOutput(
+                            question=questions[index],
+                            persona=persona,
+                            context=self.context
+                        )
+                    )
+        return results
+
+class BatchAnswerGeneration(SingletonTemplate):
+    """AnswerGeneration for several questions sharing one context, in one workflow"""
+
+    personas: List[str] = Field(...,description="Persona of each question")
+    questions: List[str] = Field(...,description="Questions")
+    context: str = Field(...,description="Context")
+
+    OutputSchema=AnswerOutput
+
+    def workflow(self):
+        return build_workflow("answer.md", self.questions, questions=numbered(self.questions, "question"),
+                              context=self.context)
+
+    def callback(self, result: List[TaskResult]) -> List[AnswerOutput]:
+        results = []
+        for r in result:
+            answers = tagged(r.result, "answer", len(self.questions))
+            if answers is None:
+                logger.warning(f"Rejected a reply that doesn't have one answer per question ({len(self.questions)})")
+                continue
+            for index, (persona, question) in enumerate(zip(self.personas, self.questions), 1):
+                results.append(
+                        AnswerOutput(
+                            answer=answers[index],
+                            persona=persona,
+                            context=self.context,
+                            question=question
+                        )
+                    )
+        return results
@@ -0,0 +1,2 @@
+from .task import QAGeneration
+__all__ = ["QAGeneration"]
\ No newline at end of file
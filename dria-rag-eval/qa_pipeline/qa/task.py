@@ -0,0 +1,86 @@
+import json
+import logging
+from typing import List
+
+from dria import SingletonTemplate
+from dria.models import TaskResult
+from pydantic import BaseModel, Field
+
+from dria_workflows import *
+from dria.factory.utilities import get_abs_path
+
+logger = logging.getLogger(__name__)
+
+class QAOutput(BaseModel):
+    persona: str = Field(...,description="Persona")
+    question: str = Field(...,description="Question")
+    context: str = Field(...,description="Context")
+    answer: str = Field(...,description="Answer")
+
+class QAGeneration(SingletonTemplate):
+    """QuestionGeneration and AnswerGeneration in one task: the question is kept in
+    workflow memory and answered in a second step, so each pair costs one submission.
+
+    Both steps push their output to "pair", so the result holds the question exactly
+    as generated next to its answer. The context is still sent to both steps.
+    """
+
+    persona_bio: str = Field(...,description="Persona")
+    context: str = Field(...,description="Context")
+
+    OutputSchema=QAOutput
+
+    def workflow(self):
+        builder = WorkflowBuilder(persona_bio=self.persona_bio,context=self.context)
+        builder.set_max_tokens(800)
+        builder.set_max_time(65)
+        builder.set_max_steps(4)
+
+        builder.generative_step(
+            id="question",
+            path=get_abs_path("question.md"),
+            operator=Operator.GENERATION,
+            outputs=[Write.new("question"), Push.new("pair")],
+        )
+
+        builder.generative_step(
+            id="answer",
+            path=get_abs_path("answer.md"),
+            operator=Operator.GENERATION,
+            inputs=[Read.new("question", required=True)],
+            outputs=[Push.new("pair")],
+        )
+
+        flow = [
+            Edge(source="question", target="answer"),
+            Edge(source="answer", target="_end"),
+        ]
+
+        builder.flow(flow)
+        builder.set_return_value("pair")
+        return builder.build()
+
+    def callback(self, result: List[TaskResult]) -> List[QAOutput]:
+        results = []
+        for r in result:
+            if r.result == "":
+                continue
+            try:
+                pair = json.loads(r.result)
+            except ValueError as e:
+                logger.warning(f"Skipped a question/answer pair that isn't valid JSON: {e}")
+                continue
+            if (not isinstance(pair, list) or len(pair) != 2
+                    or not all(isinstance(text, str) and text.strip() for text in pair)):
+                logger.warning("Skipped a reply that isn't one question and one answer")
+                continue
+            question, answer = pair
+            results.append(
+                    QAOutput(
+                        persona=self.persona_bio,
+                        question=question.strip(),
+                        context=self.context,
+                        answer=answer.strip()
+                    )
+                )
+        return results
@@ -0,0 +1,171 @@
+import argparse
+import heapq
+import json
+import math
+import re
+from collections import Counter, defaultdict
+
+CONTENT_FILE = "scraped_domain_content.json"
+CHUNKS_FILE = "chunks.json"
+
+# Characters per chunk; a few paragraphs of a docs page, well inside the
+# 800-token budget of the QA workflows together with the prompt
+CHUNK_CHARS = 2000
+TOP_K = 3
+
+HEADER = re.compile(r"\ATitle:\s*(.*?)\n(?:.*?\n)?Markdown Content:\n", re.S)
+TOKEN = re.compile(r"\w+")
+STOPWORDS = set(
+    "a an and are as at be by can do does for from how i if in is it its of on or that the this "
+    "to was what when where which who why will with you your".split()
+)
+
+def is_not_found(content):
+    """Pages the scraper saved from a 404 response"""
+    return bool(re.match(r"Title:\s*404", content))
+
+def split_page(content):
+    """(title, body) of a scraped page; pages without the usual header are all body"""
+    match = HEADER.match(content)
+    if not match:
+        return "", content
+    return match.group(1).strip(), content[match.end():]
+
+def chunk_text(text, max_chars=None):
+    """Split text into chunks of at most max_chars, on paragraph boundaries where possible"""
+    if not max_chars or len(text) <= max_chars:
+        return [text]
+    chunks, current = [], ""
+    for paragraph in text.split("\n\n"):
+        while len(paragraph) > max_chars:
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(paragraph[:max_chars])
+            paragraph = paragraph[max_chars:]
+        if current and len(current) + 2 + len(paragraph) > max_chars:
+            chunks.append(current)
+            current = ""
+        current = f"{current}\n\n{paragraph}" if current else paragraph
+    if current:
+        chunks.append(current)
+    return chunks
+
+def chunk_page(content, max_chars=CHUNK_CHARS):
+    """Chunks of a scraped page, each headed by the page title so it reads on its own"""
+    if not max_chars or len(content) <= max_chars:
+        return [content]
+    title, body = split_page(content)
+    heading = f"Title: {title}\n\n" if title else ""
+    return [heading + chunk for chunk in chunk_text(body, max(max_chars - len(heading), 1)) if chunk.strip()]
+
+def chunk_pages(pages, max_chars=CHUNK_CHARS, skip_not_found=True):
+    """Chunk records {id, url, text} for every usable page"""
+    chunks = []
+    for page in pages:
+        if skip_not_found and is_not_found(page["content"]):
+            continue
+        for text in chunk_page(page["content"], max_chars):
+            chunks.append({"id": len(chunks), "url": page["url"], "text": text})
+    return chunks
+
+def tokenize(text):
+    return [token for token in TOKEN.findall(text.lower()) if token not in STOPWORDS]
+
+class BM25Index:
+    """Okapi BM25 over chunks, in memory and CPU-only.
+
+    Postings map each term to (chunk, term frequency) pairs, so a query only
+    touches the chunks sharing a term with it. Building the index for the
+    scraped docs takes a fraction of a second, so only the chunks are saved and
+    the index is rebuilt on load.
+    """
+
+    def __init__(self, chunks, k1=1.5, b=0.75):
+        self.chunks = list(chunks)
+        self.k1 = k1
+        self.b = b
+        self.postings = defaultdict(list)
+        self.lengths = []
+        for position, chunk in enumerate(self.chunks):
+            terms = Counter(tokenize(chunk["text"]))
+            self.lengths.append(sum(terms.values()))
+            for term, frequency in terms.items():
+                self.postings[term].append((position, frequency))
+        self.average_length = sum(self.lengths) / len(self.lengths) if self.lengths else 0
+        count = len(self.chunks)
+        self.idf = {
+            term: math.log(1 + (count - len(docs) + 0.5) / (len(docs) + 0.5))
+            for term, docs in self.postings.items()
+        }
+
+    def __len__(self):
+        return len(self.chunks)
+
+    def scores(self, query):
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for position, frequency in self.postings[term]:
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[position] / self.average_length)
+                scores[position] += idf * frequency * (self.k1 + 1) / (frequency + norm)
+        return scores
+
+    def search(self, query, k=TOP_K):
+        """The k best chunks for query as (score, chunk), best first"""
+        best = heapq.nlargest(k, self.scores(query).items(), key=lambda item: item[1])
+        return [(score, self.chunks[position]) for position, score in best]
+
+    def context(self, query, k=TOP_K, separator="\n\n---\n\n"):
+        """Text of the k best chunks, joined, as the context of an answer"""
+        return separator.join(chunk["text"] for _, chunk in self.search(query, k))
+
+    def save(self, path=CHUNKS_FILE):
+        with open(path, 'w') as file:
+            json.dump(self.chunks, file)
+
+    @classmethod
+    def load(cls, path=CHUNKS_FILE):
+        with open(path) as file:
+            return cls(json.load(file))
+
+    @classmethod
+    def from_pages(cls, content_file=CONTENT_FILE, max_chars=CHUNK_CHARS, skip_not_found=True):
+        with open(content_file) as file:
+            return cls(chunk_pages(json.load(file), max_chars, skip_not_found))
+
+def answer_instructions(questions, index, k=TOP_K):
+    """AnswerGeneration inputs for QuestionGeneration outputs, with the top-k chunks
+    retrieved for each question as context instead of the page it was asked about"""
+    for question in questions:
+        yield {
+            "persona": question["persona"],
+            "question": question["question"],
+            "context": index.context(question["question"], k),
+        }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Chunk scraped pages and search them with BM25")
+    parser.add_argument("--content", default=CONTENT_FILE, help="Scraped content JSON file")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_CHARS, help="Maximum characters per chunk")
+    parser.add_argument("--keep-not-found", action="store_true", help="Keep pages scraped from 404 responses")
+    parser.add_argument("--output", default=CHUNKS_FILE, help="Chunks JSON file")
+    parser.add_argument("--query", help="Search the chunks instead of building them")
+    parser.add_argument("-k", type=int, default=TOP_K, help="Number of chunks a query returns")
+    args = parser.parse_args()
+
+    if args.query:
+        index = BM25Index.load(args.output)
+        for score, chunk in index.search(args.query, args.k):
+            preview = " ".join(chunk["text"].split())[:120]
+            print(f"{score:6.2f}  #{chunk['id']:<4} {chunk['url']}\n        {preview}")
+    else:
+        index = BM25Index.from_pages(args.content, args.chunk_size, not args.keep_not_found)
+        index.save(args.output)
+        sizes = [len(chunk["text"]) for chunk in index.chunks]
+        print(
+            f"✅ {len(index)} chunks from {len({chunk['url'] for chunk in index.chunks})} pages "
+            f"(avg {sum(sizes) // max(len(sizes), 1)} chars, max {max(sizes, default=0)}) written to {args.output}"
+        )
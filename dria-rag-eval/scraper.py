@@ -0,0 +1,190 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import time
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from urllib.parse import urlparse
+
+import aiohttp
+
+CONTENT_FILE = "scraped_domain_content.json"
+CACHE_FILE = "scrape_cache.json"
+CHANGED_FILE = "changed_urls.json"
+
+# Jina Reader returns pages as "Title: ... URL Source: ... Markdown Content: ...",
+# the format of scraped_domain_content.json; use "" to fetch pages directly
+READER = "https://r.jina.ai/"
+
+CONCURRENCY = 16
+PER_HOST = 4
+RETRIES = 3
+TIMEOUT = 60
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+def content_hash(content):
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+def load_json(path, default):
+    if not os.path.exists(path):
+        return default
+    with open(path) as file:
+        return json.load(file)
+
+def write_json(path, data):
+    """Write JSON through a temporary file so an interrupted run keeps the old file"""
+    temp_file = f"{path}.tmp"
+    with open(temp_file, 'w') as file:
+        json.dump(data, file, indent=2)
+    os.replace(temp_file, path)
+
+class Scraper:
+    """Incremental scraper for scraped_domain_content.json.
+
+    Pages are fetched concurrently over one pooled aiohttp session, at most
+    concurrency at a time and per_host per target host. The per-host limit is keyed
+    on the scraped URL rather than the reader every request goes through, and the
+    timeout applies to each request once it holds its slots, not to time spent
+    waiting for one. Each page's ETag, Last-Modified
+    and content hash are cached; re-scrapes send them as If-None-Match and
+    If-Modified-Since, so unchanged pages come back as 304 without a body, and a
+    200 whose content hashes the same still counts as unchanged. Only new and
+    changed URLs are reported, so question generation can be rerun for just
+    those contexts. A page that fails keeps its previous content.
+    """
+
+    def __init__(self, reader=READER, cache_file=CACHE_FILE, concurrency=CONCURRENCY, per_host=PER_HOST,
+                 retries=RETRIES, timeout=TIMEOUT):
+        self.reader = reader
+        self.cache_file = cache_file
+        self.cache = load_json(cache_file, {})
+        self.concurrency = concurrency
+        self.per_host = per_host
+        self.retries = retries
+        self.timeout = timeout
+        self.request_timeout = aiohttp.ClientTimeout(total=timeout)
+        self.counts = {"new": 0, "changed": 0, "unchanged": 0, "not_modified": 0, "failed": 0}
+        self.slots = None
+        self.hosts = None
+
+    @asynccontextmanager
+    async def slot(self, url):
+        """Hold a global and a per-host request slot for url"""
+        async with self.hosts[urlparse(url).netloc], self.slots:
+            yield
+
+    def headers(self, url):
+        entry = self.cache.get(url, {})
+        headers = {}
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    async def fetch(self, session, url, previous):
+        """Return (status, content) for url: new, changed, unchanged, not_modified or failed"""
+        headers = self.headers(url) if previous is not None else {}
+        for attempt in range(self.retries + 1):
+            # Backoff happens outside the slots, so other pages use them meanwhile
+            delay = 2 ** attempt
+            try:
+                async with self.slot(url), session.get(self.reader + url, headers=headers,
+                                                        timeout=self.request_timeout) as response:
+                    if response.status == 304 and previous is not None:
+                        return "not_modified", previous
+                    if response.status in RETRY_STATUSES and attempt < self.retries:
+                        retry_after = response.headers.get("Retry-After", "")
+                        delay = float(retry_after) if retry_after.isdigit() else delay
+                    elif response.status >= 400:
+                        print(f"❌ {url}: HTTP {response.status}")
+                        return "failed", previous
+                    else:
+                        content = await response.text()
+                        self.cache[url] = {
+                            "etag": response.headers.get("ETag"),
+                            "last_modified": response.headers.get("Last-Modified"),
+                            "hash": content_hash(content),
+                            "fetched_at": time.time(),
+                        }
+                        if previous is None:
+                            return "new", content
+                        return ("unchanged" if content_hash(previous) == self.cache[url]["hash"] else "changed"), content
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if attempt == self.retries:
+                    print(f"❌ {url}: {e}")
+                    return "failed", previous
+            await asyncio.sleep(delay)
+        return "failed", previous
+
+    async def scrape(self, urls, previous_pages=()):
+        """Scrape urls, returning (pages in url order, new and changed urls)"""
+        previous = {page["url"]: page["content"] for page in previous_pages}
+        self.slots = asyncio.Semaphore(self.concurrency)
+        self.hosts = defaultdict(lambda: asyncio.Semaphore(self.per_host))
+        # The slots do the limiting, so a request that holds them never queues for a
+        # connection and its timeout only covers the request itself
+        connector = aiohttp.TCPConnector(limit=self.concurrency, limit_per_host=0)
+        async with aiohttp.ClientSession(connector=connector) as session:
+            results = await asyncio.gather(*(self.fetch(session, url, previous.get(url)) for url in urls))
+
+        pages, changed = [], []
+        for url, (status, content) in zip(urls, results):
+            self.counts[status] += 1
+            if status in ("new", "changed"):
+                changed.append(url)
+            if content is not None:
+                pages.append({"url": url, "content": content})
+        write_json(self.cache_file, self.cache)
+        return pages, changed
+
+def run(urls=None, output_file=CONTENT_FILE, changed_file=CHANGED_FILE, prune=False, **options):
+    """Scrape urls (by default the URLs already in output_file) into output_file.
+
+    Scraped pages are merged into output_file by URL, so pages that weren't scraped
+    this time are kept unless prune is set.
+    """
+    previous_pages = load_json(output_file, [])
+    if not urls:
+        urls = [page["url"] for page in previous_pages]
+    scraper = Scraper(**options)
+
+    start = time.perf_counter()
+    pages, changed = asyncio.run(scraper.scrape(list(dict.fromkeys(urls)), previous_pages))
+    elapsed = time.perf_counter() - start
+
+    merged = {} if prune else {page["url"]: page for page in previous_pages}
+    merged.update((page["url"], page) for page in pages)
+    removed = sum(page["url"] not in merged for page in previous_pages)
+
+    write_json(output_file, list(merged.values()))
+    write_json(changed_file, changed)
+    counts = ", ".join(f"{count} {status.replace('_', ' ')}" for status, count in scraper.counts.items() if count)
+    print(f"✅ Scraped {len(urls)} URLs in {elapsed:.1f}s: {counts}")
+    print(f"{len(merged)} pages written to {output_file} ({removed} removed), "
+          f"{len(changed)} new or changed URLs to {changed_file}")
+    return changed
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Scrape pages into scraped_domain_content.json, refetching only what changed")
+    parser.add_argument("urls", nargs="*", help="URLs to scrape (default: the URLs already in the output file)")
+    parser.add_argument("--urls-file", help="File with one URL per line")
+    parser.add_argument("--output", default=CONTENT_FILE, help="Scraped content JSON file")
+    parser.add_argument("--cache", default=CACHE_FILE, help="ETag/Last-Modified/hash cache file")
+    parser.add_argument("--changed", default=CHANGED_FILE, help="File listing new and changed URLs")
+    parser.add_argument("--reader", default=READER, help="Prefix for each URL; empty to fetch pages directly")
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY, help="Maximum requests in flight")
+    parser.add_argument("--per-host", type=int, default=PER_HOST, help="Maximum requests in flight per scraped host")
+    parser.add_argument("--retries", type=int, default=RETRIES, help="Retries for failed or rate-limited requests")
+    parser.add_argument("--prune", action="store_true", help="Remove pages from the output file that weren't scraped")
+    args = parser.parse_args()
+
+    urls = list(args.urls)
+    if args.urls_file:
+        with open(args.urls_file) as file:
+            urls.extend(line.strip() for line in file if line.strip())
+
+    run(urls, args.output, args.changed, args.prune, reader=args.reader, cache_file=args.cache,
+        concurrency=args.concurrency, per_host=args.per_host, retries=args.retries)
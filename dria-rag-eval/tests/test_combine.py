@@ -0,0 +1,45 @@
+from collections import Counter
+
+import pytest
+
+from combine import Combiner
+
+PERSONAS = ["chemist", "teacher", "student"]
+# Page "a" is split into three chunks, "b" and "c" are one chunk each
+PAGES = [
+    {"url": "a", "content": "\n\n".join(["alpha " * 10] * 3)},
+    {"url": "b", "content": "bravo page"},
+    {"url": "c", "content": "charlie page"},
+    {"url": "gone", "content": "Title: 404 Not Found"},
+]
+
+@pytest.fixture
+def combiner():
+    return Combiner(PERSONAS, PAGES, chunk_size=70)
+
+def test_not_found_pages_are_skipped(combiner):
+    assert combiner.skipped == ["gone"]
+    assert combiner.urls == ["a", "b", "c"]
+    assert len(combiner) == 3 * 5
+
+def test_per_url_gives_every_url_an_equal_share(combiner):
+    indices = combiner.sample_indices(6, "per_url", seed=1)
+    assert Counter(combiner.pair(index)["url"] for index in indices) == {"a": 2, "b": 2, "c": 2}
+
+def test_per_url_is_capped_by_the_pairs_a_url_has(combiner):
+    # b and c have one chunk, so three pairs each; a takes its share of four
+    indices = combiner.sample_indices(12, "per_url", seed=1)
+    assert Counter(combiner.pair(index)["url"] for index in indices) == {"a": 4, "b": 3, "c": 3}
+    assert len(set(indices)) == len(indices)
+
+def test_per_persona_spreads_the_remainder_over_the_first_personas(combiner):
+    indices = combiner.sample_indices(8, "per_persona", seed=1)
+    assert Counter(combiner.pair(index)["persona_bio"] for index in indices) == {"chemist": 3, "teacher": 3, "student": 2}
+
+def test_samples_are_stable_for_a_seed(combiner):
+    assert combiner.sample_indices(5, "uniform", seed=3) == combiner.sample_indices(5, "uniform", seed=3)
+    assert combiner.sample_indices(5, "uniform", seed=3) == sorted(combiner.sample_indices(5, "uniform", seed=3))
+
+def test_unknown_strategy(combiner):
+    with pytest.raises(ValueError, match="Unknown sampling strategy"):
+        combiner.sample_indices(5, "per_topic")
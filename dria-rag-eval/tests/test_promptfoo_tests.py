@@ -0,0 +1,64 @@
+import json
+
+import pytest
+
+import promptfoo_tests
+from promptfoo_tests import RESULTS_ARRAY, case_id, ingest_results, iter_json_array, to_test
+
+ITEMS = [{"question": "Qué es Dria?", "tags": ["a", "]"]}, [1, 2, {"nested": "[x]"}], "text, with comma", 3.5, None]
+
+@pytest.fixture(params=[1, 7, 1 << 20])
+def read_bytes(request, monkeypatch):
+    # Elements and the array's opening bracket straddle the buffer refills
+    monkeypatch.setattr(promptfoo_tests, "READ_BYTES", request.param)
+    return request.param
+
+def test_iter_json_array_across_buffer_boundaries(tmp_path, read_bytes):
+    path = tmp_path / "items.json"
+    path.write_text("  \n" + json.dumps(ITEMS, indent=2, ensure_ascii=False), encoding="utf-8")
+    assert list(iter_json_array(str(path))) == ITEMS
+
+def test_iter_json_array_finds_a_nested_array(tmp_path, read_bytes):
+    path = tmp_path / "results.json"
+    path.write_text(json.dumps({"evalId": "e1", "results": {"version": 3, "results": ITEMS}, "config": {}}))
+    assert list(iter_json_array(str(path), RESULTS_ARRAY)) == ITEMS
+
+def test_iter_json_array_reports_truncated_files(tmp_path, read_bytes):
+    path = tmp_path / "truncated.json"
+    path.write_text('[{"a": 1}, {"b": ')
+    with pytest.raises(json.JSONDecodeError):
+        list(iter_json_array(str(path)))
+    path.write_text('{"no": "array"}')
+    with pytest.raises(ValueError, match="No JSON array"):
+        list(iter_json_array(str(path)))
+
+def result(record, provider, success=True, error=None, output="an answer"):
+    return {"testCase": to_test(record), "provider": {"id": provider}, "success": success, "score": float(success),
+            "error": error, "failureReason": 2 if error else (1 if not success else 0),
+            "gradingResult": None if error else {"pass": success}, "response": {"output": output}}
+
+def test_ingest_results_writes_the_cases_to_rerun_and_lets_reruns_replace_them(tmp_path, capsys):
+    passed, failed, errored = ({"persona": "p", "question": f"Question {n}?", "answer": "a"} for n in range(3))
+    first = tmp_path / "results.json"
+    first.write_text(json.dumps({"results": {"results": [
+        result(passed, "agent"), result(failed, "agent", success=False),
+        result(errored, "agent", success=False, error="Error parsing response as JSON\ntrace", output=""),
+    ]}}))
+    retry_file = tmp_path / "retry.jsonl"
+
+    summary = ingest_results([str(first)], str(retry_file))
+    agent = summary["agent"]
+    assert (agent["cases"], agent["passed"], agent["failed"], agent["errors"]) == (3, 1, 1, 1)
+    # Errors aren't graded, so they don't count against the pass rate
+    assert agent["pass_rate"] == 0.5
+    assert agent["error_kinds"] == {"Error parsing response as JSON": 1}
+    retried = [json.loads(line) for line in retry_file.read_text().splitlines()]
+    assert [test["metadata"]["case_id"] for test in retried] == [case_id(errored)]
+
+    # The rerun of the retry file is a later result file and replaces the error
+    rerun = tmp_path / "rerun.jsonl"
+    rerun.write_text(json.dumps(result(errored, "agent")) + "\n")
+    summary = ingest_results([str(first), str(rerun)], str(tmp_path / "retry2.jsonl"), retry_failures=True)
+    assert (summary["agent"]["passed"], summary["agent"]["errors"]) == (2, 0)
+    retried = [json.loads(line) for line in (tmp_path / "retry2.jsonl").read_text().splitlines()]
+    assert [test["metadata"]["case_id"] for test in retried] == [case_id(failed)]
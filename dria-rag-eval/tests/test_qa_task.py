@@ -0,0 +1,21 @@
+import json
+
+import pytest
+
+pytest.importorskip("dria")
+
+from qa_pipeline.qa.task import QAGeneration
+
+class Result:
+    def __init__(self, result):
+        self.result = result
+
+def test_callback_skips_replies_that_are_not_a_question_and_answer(caplog):
+    task = QAGeneration.model_construct(persona_bio="A chemist", context="Water boils at 100C.")
+    replies = [json.dumps(["When does water boil?", "At 100C."]), "not json", json.dumps({"question": "?"}),
+               json.dumps(["Only a question", " "]), ""]
+
+    outputs = task.callback([Result(reply) for reply in replies])
+
+    assert [(output.question, output.answer) for output in outputs] == [("When does water boil?", "At 100C.")]
+    assert "isn't valid JSON" in caplog.text
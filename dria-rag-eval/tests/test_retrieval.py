@@ -0,0 +1,49 @@
+import math
+
+import pytest
+
+from retrieval import BM25Index, chunk_page, chunk_text
+
+def index_of(*texts):
+    return BM25Index([{"id": position, "url": f"u{position}", "text": text} for position, text in enumerate(texts)])
+
+def test_rare_terms_outrank_common_ones():
+    index = index_of(
+        "Nodes run models and earn rewards.",
+        "Validators check the rewards of nodes.",
+        "Batch workflows cut the cost of models.",
+    )
+    # "batch" is in one chunk, "rewards" in two; of those two the shorter ranks first
+    assert [chunk["id"] for _, chunk in index.search("batch rewards", k=3)] == [2, 1, 0]
+    assert len(index.search("batch rewards", k=2)) == 2
+
+def test_shorter_chunks_win_on_equal_term_frequency():
+    index = index_of("workflow steps", "workflow steps memory operators tools functions schemas")
+    scores = index.scores("workflow")
+    assert scores[0] > scores[1] > 0
+
+def test_score_matches_the_okapi_formula():
+    index = index_of("dria network", "dria dria nodes and models", "unrelated text here")
+    # The second chunk has 4 tokens ("and" is a stopword) with "dria" twice; 9 tokens in all
+    idf = math.log(1 + (3 - 2 + 0.5) / (2 + 0.5))
+    norm = 1.5 * (1 - 0.75 + 0.75 * 4 / 3)
+    assert index.scores("dria")[1] == pytest.approx(idf * 2 * 2.5 / (2 + norm))
+
+def test_stopwords_and_unknown_terms_match_nothing():
+    index = index_of("what is the network")
+    assert index.search("what is the") == []
+    assert index.search("kubernetes") == []
+
+def test_save_and_load_rebuild_the_same_ranking(tmp_path):
+    index = index_of("alpha beta", "beta gamma", "gamma delta")
+    index.save(tmp_path / "chunks.json")
+    loaded = BM25Index.load(tmp_path / "chunks.json")
+    assert loaded.search("gamma", k=2) == index.search("gamma", k=2)
+
+def test_chunks_stay_within_the_limit_and_keep_the_title():
+    body = "\n\n".join(f"Paragraph {n} " + "word " * 30 for n in range(6))
+    page = "Title: Docs\nURL Source: https://docs.example\nMarkdown Content:\n" + body
+    chunks = chunk_page(page, 400)
+    assert len(chunks) > 1
+    assert all(len(chunk) <= 400 and chunk.startswith("Title: Docs\n\n") for chunk in chunks)
+    assert chunk_text("x" * 25, 10) == ["x" * 10, "x" * 10, "x" * 5]
@@ -0,0 +1,132 @@
+import hashlib
+import json
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+pytest.importorskip("aiohttp")
+
+import scraper
+
+class FixtureServer:
+    """Local HTTP server with editable pages, optionally answering conditional requests.
+
+    Every response takes delay seconds; peak records the most requests in flight per
+    Host header at once.
+    """
+
+    def __init__(self, etags=True, delay=0.0):
+        self.pages = {}
+        self.etags = etags
+        self.delay = delay
+        self.responses = []
+        self.in_flight = Counter()
+        self.peak = Counter()
+        self.lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                host = self.headers.get("Host", "").split(":")[0]
+                with server.lock:
+                    server.in_flight[host] += 1
+                    server.peak[host] = max(server.peak[host], server.in_flight[host])
+                try:
+                    time.sleep(server.delay)
+                    self.respond()
+                finally:
+                    with server.lock:
+                        server.in_flight[host] -= 1
+
+            def respond(self):
+                body = server.pages.get(self.path)
+                if body is None:
+                    return self.answer(404)
+                etag = '"' + hashlib.sha1(body.encode("utf-8")).hexdigest() + '"'
+                if server.etags and self.headers.get("If-None-Match") == etag:
+                    return self.answer(304)
+                self.answer(200, body, {"ETag": etag} if server.etags else {})
+
+            def answer(self, status, body="", headers=None):
+                server.responses.append((self.path, status))
+                data = body.encode("utf-8")
+                self.send_response(status)
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def url(self, path, host="127.0.0.1"):
+        return f"http://{host}:{self.httpd.server_port}{path}"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+def scrape(tmp_path, urls, prune=False, **options):
+    changed = scraper.run(urls, str(tmp_path / "content.json"), str(tmp_path / "changed.json"), prune,
+                          reader="", cache_file=str(tmp_path / "cache.json"), retries=0, **options)
+    with open(tmp_path / "content.json") as file:
+        return {page["url"]: page["content"] for page in json.load(file)}, changed
+
+def test_adding_pages_keeps_earlier_ones(tmp_path):
+    with FixtureServer() as server:
+        server.pages = {"/a.html": "page a", "/b.html": "page b"}
+        scrape(tmp_path, [server.url("/a.html")])
+        pages, changed = scrape(tmp_path, [server.url("/b.html")])
+    assert pages == {server.url("/a.html"): "page a", server.url("/b.html"): "page b"}
+    assert changed == [server.url("/b.html")]
+
+def test_prune_removes_pages_not_scraped(tmp_path):
+    with FixtureServer() as server:
+        server.pages = {"/a.html": "page a", "/b.html": "page b"}
+        scrape(tmp_path, [server.url("/a.html")])
+        pages, _ = scrape(tmp_path, [server.url("/b.html")], prune=True)
+    assert pages == {server.url("/b.html"): "page b"}
+
+def test_not_modified_keeps_previous_content(tmp_path):
+    with FixtureServer() as server:
+        server.pages = {"/a.html": "page a"}
+        scrape(tmp_path, [server.url("/a.html")])
+        pages, changed = scrape(tmp_path, [])
+    assert server.responses == [("/a.html", 200), ("/a.html", 304)]
+    assert pages == {server.url("/a.html"): "page a"}
+    assert changed == []
+
+def test_same_content_without_validators_is_unchanged(tmp_path):
+    with FixtureServer(etags=False) as server:
+        server.pages = {"/a.html": "page a", "/b.html": "page b"}
+        scrape(tmp_path, [server.url("/a.html"), server.url("/b.html")])
+        server.pages["/b.html"] = "page b, edited"
+        pages, changed = scrape(tmp_path, [])
+    assert sorted(server.responses[-2:]) == [("/a.html", 200), ("/b.html", 200)]
+    assert changed == [server.url("/b.html")]
+    assert pages[server.url("/b.html")] == "page b, edited"
+
+def test_per_host_limit_applies_per_target_host_and_queued_pages_dont_time_out(tmp_path):
+    with FixtureServer(delay=0.3) as server:
+        server.pages = {f"/{n}.html": f"page {n}" for n in range(8)}
+        # Two target hosts on the same server, 8 pages each
+        urls = [server.url(f"/{n}.html", host) for host in ("127.0.0.1", "localhost") for n in range(8)]
+        start = time.perf_counter()
+        pages, changed = scrape(tmp_path, urls, concurrency=16, per_host=2, timeout=1)
+        elapsed = time.perf_counter() - start
+    # Pages wait up to 4 x 0.3s for a slot, longer than the timeout, and still arrive
+    assert len(pages) == 16 and len(changed) == 16
+    assert server.peak == {"127.0.0.1": 2, "localhost": 2}
+    # Both hosts are scraped side by side
+    assert elapsed < 8 * 0.3 * 2
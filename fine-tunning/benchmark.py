@@ -0,0 +1,449 @@
+import argparse
+import asyncio
+import importlib
+import json
+import os
+import random
+import re
+import shutil
+import subprocess
+import tempfile
+import time
+import typing
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from functools import partial
+from pathlib import Path
+
+import generation
+from generation import render_prompt
+from jsonl_io import read_jsonl
+from scheduler import RateLimitError
+from stub_model_server import DEFAULT_PROFILES, StubModelClient, StubModelServer
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+DATASETS_DIR = Path(__file__).parent / "datasets"
+
+# Used for models without a profile in stub_model_server.DEFAULT_PROFILES
+FALLBACK_PROFILE = {"latency": 0.5, "rate_limit": 0.02, "error": 0.01, "max_concurrency": 8}
+
+def model_id(model):
+    return str(getattr(model, "value", model))
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    # ru_maxrss is in KB on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if os.uname().sysname == "Darwin" else 1024), 1)
+
+def count_records(path):
+    path = Path(path)
+    if not path.exists():
+        return 0
+    if path.is_dir():
+        return sum(count_records(shard) for shard in path.glob("*.jsonl"))
+    if path.suffix == ".json":
+        with open(path) as file:
+            return len(json.load(file))
+    return sum(1 for _ in read_jsonl(path))
+
+class CannedOutputs:
+    """Model outputs built from the values in the existing datasets/*.jsonl files.
+
+    Values are pooled by field name (sub_category_1 counts as sub_category), keeping
+    their frequencies, so a mocked stage returns records shaped like the real ones
+    and e.g. validations pass the filter about as often. Long texts have their
+    sentences shuffled so that near-duplicate removal doesn't collapse the run.
+    """
+
+    def __init__(self, directory=DATASETS_DIR, seed=0):
+        self.pools = defaultdict(list)
+        for path in sorted(Path(directory).glob("*.jsonl")):
+            for record in read_jsonl(path):
+                for key, value in record.items():
+                    if isinstance(value, str) and value.strip():
+                        self.pools[re.sub(r"_\d+$", "", key)].append(value)
+        self.rng = random.Random(seed)
+        self.serial = 0
+
+    def vary(self, text):
+        sentences = re.split(r"(?<=[.!?])\s+", text)
+        # JSON values (extracted_info, validation_result) must stay parseable
+        if len(text) < 200 or len(sentences) < 3 or text.lstrip()[:1] in ("{", "["):
+            return text
+        self.rng.shuffle(sentences)
+        return " ".join(sentences)
+
+    def value(self, field, annotation, instruction, prompt):
+        if field in instruction:
+            return instruction[field]
+        if typing.get_origin(annotation) is list:
+            item = typing.get_args(annotation)[0]
+            match = re.search(r"Generate (\d+)", prompt)
+            count = int(match.group(1)) if match else 1
+            return [self.record(item, instruction, prompt) for _ in range(count)]
+        if annotation is float:
+            return round(self.rng.uniform(0.5, 1.0), 3)
+        if annotation is int:
+            return self.rng.randint(0, 100)
+        if field in self.pools:
+            return self.vary(self.rng.choice(self.pools[field]))
+        self.serial += 1
+        return f"{field} {self.serial}"
+
+    def record(self, schema, instruction, prompt):
+        return {
+            field: self.value(field, info.annotation, instruction, prompt)
+            for field, info in schema.model_fields.items()
+        }
+
+class MockPrompt:
+    def __init__(self, prompt, schema):
+        self.prompt = prompt
+        self.schema = schema
+
+class MockDataset:
+    def __init__(self, name, description, schema):
+        self.name = name
+        self.description = description
+        self.schema = schema
+        self.entries = []
+
+    def reset(self):
+        self.entries = []
+        return self
+
+    def get_entries(self, data_only=False):
+        return list(self.entries)
+
+class MockDatasetGenerator:
+    """Stands in for dria's DatasetGenerator: one stub server request per instruction"""
+
+    def __init__(self, dataset, backend):
+        self.dataset = dataset
+        self.backend = backend
+
+    async def generate(self, instructions, singletons, models):
+        # StageGenerator numbers its pooled datasets; their requests count for one stage
+        stage = re.sub(r"_\d+$", "", self.dataset.name)
+
+        async def generate_one(instruction):
+            prompt = render_prompt(singletons.prompt, instruction)
+            model = model_id(self.backend.rng.choice(models))
+            if await self.backend.call(stage, model, prompt):
+                return self.backend.canned.record(singletons.schema, instruction, prompt)
+            return None
+
+        records = await asyncio.gather(*(generate_one(instruction) for instruction in instructions))
+        # Failed instructions produce no record, like the SDK
+        self.dataset.entries.extend(record for record in records if record is not None)
+
+class MockBackend:
+    """Sends mocked generation through a StubModelServer and measures it.
+
+    Requests run through one semaphore of concurrency slots and are retried with
+    exponential backoff on 429/500. Latency is recorded per stage for successful
+    requests; utilisation is the time-averaged share of slots in use.
+    """
+
+    def __init__(self, server, canned, concurrency=64, max_attempts=5, backoff=0.05, seed=0):
+        self.client = StubModelClient(server.host, server.port)
+        self.canned = canned
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.rng = random.Random(seed)
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.reset()
+
+    def reset(self):
+        self.latencies = defaultdict(list)
+        self.counts = Counter()
+        self.in_flight = 0
+        self.busy_time = 0.0
+        self.started = self.last_change = time.perf_counter()
+
+    def track(self, change):
+        now = time.perf_counter()
+        self.busy_time += self.in_flight * (now - self.last_change)
+        self.last_change = now
+        self.in_flight += change
+
+    async def call(self, stage, model, prompt):
+        async with self.semaphore:
+            self.track(1)
+            try:
+                for attempt in range(self.max_attempts):
+                    self.counts["requests"] += 1
+                    start = time.perf_counter()
+                    try:
+                        await self.client.generate(model, prompt)
+                    except RateLimitError:
+                        self.counts["rate_limited"] += 1
+                    except (RuntimeError, OSError):
+                        self.counts["errors"] += 1
+                    else:
+                        self.latencies[stage].append(time.perf_counter() - start)
+                        return True
+                    await asyncio.sleep(self.backoff * 2 ** attempt)
+                self.counts["failed"] += 1
+                return False
+            finally:
+                self.track(-1)
+
+    def stats(self):
+        self.track(0)
+        elapsed = time.perf_counter() - self.started
+        latencies = [latency for values in self.latencies.values() for latency in values]
+        return {
+            "requests": self.counts["requests"],
+            "rate_limited": self.counts["rate_limited"],
+            "errors": self.counts["errors"],
+            "failed_instructions": self.counts["failed"],
+            "latency_p50": percentile(latencies, 0.5),
+            "latency_p95": percentile(latencies, 0.95),
+            "latency_by_stage": {
+                stage: {"p50": percentile(values, 0.5), "p95": percentile(values, 0.95), "requests": len(values)}
+                for stage, values in sorted(self.latencies.items())
+            },
+            "utilisation": round(self.busy_time / (self.concurrency * elapsed), 3) if elapsed > 0 else None,
+        }
+
+@contextmanager
+def mocked_sdk(backend, modules):
+    """Swap dria's DatasetGenerator, DriaDataset and Prompt for the mocks"""
+    targets = [
+        (generation, "DatasetGenerator", partial(MockDatasetGenerator, backend=backend)),
+        (generation, "DriaDataset", MockDataset),
+        (generation, "Prompt", MockPrompt),
+        *((module, "DriaDataset", MockDataset) for module in modules),
+    ]
+    saved = [(target, name, getattr(target, name)) for target, name, _ in targets]
+    for target, name, replacement in targets:
+        setattr(target, name, replacement)
+    try:
+        yield
+    finally:
+        for target, name, original in saved:
+            setattr(target, name, original)
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=Path(__file__).parent, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+class Benchmark:
+    """Runs the whole Pipeline and then every stage on its own against the mock backend.
+
+    Everything happens in a scratch directory seeded with the first categories of
+    datasets/categories.jsonl, without cache or checkpoints, so every instruction
+    reaches the mock server.
+    """
+
+    def __init__(self, categories=10, profiles=None, latency_scale=1.0, error_rate=None, rate_limit=None,
+                 concurrency=64, pipeline_options=None, seed=0):
+        self.categories = categories
+        self.profiles = profiles or DEFAULT_PROFILES
+        self.latency_scale = latency_scale
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.concurrency = concurrency
+        self.pipeline_options = pipeline_options or {}
+        self.seed = seed
+
+    def server_profiles(self, stages):
+        profiles = {}
+        for stage in stages:
+            if not stage.get("generative"):
+                continue
+            for model in importlib.import_module(stage["module"]).MODELS:
+                profile = dict(self.profiles.get(model_id(model), FALLBACK_PROFILE))
+                profile["latency"] *= self.latency_scale
+                if self.error_rate is not None:
+                    profile["error"] = self.error_rate
+                if self.rate_limit is not None:
+                    profile["rate_limit"] = self.rate_limit
+                profiles[model_id(model)] = profile
+        return profiles
+
+    def prepare(self, workdir):
+        datasets = Path(workdir) / "datasets"
+        datasets.mkdir(parents=True)
+        with open(DATASETS_DIR / "categories.jsonl") as source, open(datasets / "categories.jsonl", 'w') as target:
+            for index, line in enumerate(source):
+                if index >= self.categories:
+                    break
+                target.write(line)
+
+    async def run_pipeline(self, pipeline, backend):
+        backend.reset()
+        start = time.perf_counter()
+        success = await pipeline.execute()
+        elapsed = time.perf_counter() - start
+        stages = {}
+        for stage in pipeline.stages:
+            seconds = pipeline.timings.get(stage["name"])
+            records = count_records(stage["outputs"][0])
+            stages[stage["name"]] = {
+                "records": records,
+                "seconds": round(seconds, 3) if seconds is not None else None,
+                "records_per_sec": round(records / seconds, 1) if seconds else None,
+            }
+        records = stages[pipeline.stages[-1]["name"]]["records"]
+        return {
+            "success": success,
+            "seconds": round(elapsed, 3),
+            "records": records,
+            "records_per_sec": round(records / elapsed, 1) if elapsed else None,
+            "stages": stages,
+            **backend.stats(),
+            "peak_rss_mb": peak_rss_mb(),
+        }
+
+    async def run_stage(self, stage, backend):
+        """Rerun one stage on the pipeline's inputs into bench/, timing it alone"""
+        output = Path("bench") / Path(stage["outputs"][0]).name
+        if output.is_dir():
+            shutil.rmtree(output)
+        run = importlib.import_module(stage["module"]).run
+        kwargs = dict(stage.get("options", {}))
+        if stage.get("generative"):
+            kwargs.update({"use_cache": False, "resume": False})
+
+        backend.reset()
+        start = time.perf_counter()
+        if asyncio.iscoroutinefunction(run):
+            await run(*stage["inputs"], str(output), **kwargs)
+        else:
+            await asyncio.to_thread(run, *stage["inputs"], str(output), **kwargs)
+        elapsed = time.perf_counter() - start
+
+        records_in = count_records(stage["inputs"][0])
+        records_out = count_records(output)
+        result = {
+            "records_in": records_in,
+            "records_out": records_out,
+            "seconds": round(elapsed, 3),
+            "records_per_sec": round(records_in / elapsed, 1) if elapsed else None,
+        }
+        if stage.get("generative"):
+            result.update(backend.stats())
+        result["peak_rss_mb"] = peak_rss_mb()
+        return result
+
+    async def run_all(self, workdir):
+        from run_pipeline import Pipeline
+
+        random.seed(self.seed)
+        pipeline = Pipeline(use_cache=False, force=True, **self.pipeline_options)
+        modules = [importlib.import_module(stage["module"]) for stage in pipeline.stages if stage.get("generative")]
+        async with StubModelServer(self.server_profiles(pipeline.stages)) as server:
+            backend = MockBackend(server, CannedOutputs(seed=self.seed), self.concurrency, seed=self.seed)
+            with mocked_sdk(backend, modules):
+                results = {"pipeline": await self.run_pipeline(pipeline, backend), "stages": {}}
+                Path("bench").mkdir(exist_ok=True)
+                for stage in pipeline.stages:
+                    results["stages"][stage["name"]] = await self.run_stage(stage, backend)
+        return results
+
+    def run(self):
+        previous = os.getcwd()
+        workdir = tempfile.mkdtemp(prefix="pipeline-bench-")
+        try:
+            self.prepare(workdir)
+            os.chdir(workdir)
+            results = asyncio.run(self.run_all(workdir))
+        finally:
+            os.chdir(previous)
+            shutil.rmtree(workdir, ignore_errors=True)
+        return {
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "config": {
+                "categories": self.categories,
+                "latency_scale": self.latency_scale,
+                "error_rate": self.error_rate,
+                "rate_limit": self.rate_limit,
+                "concurrency": self.concurrency,
+                "pipeline": self.pipeline_options,
+                "seed": self.seed,
+            },
+            **results,
+        }
+
+def print_summary(results):
+    pipeline = results["pipeline"]
+    print(f"\n{'='*50}")
+    print("Benchmark")
+    print(f"{'='*50}")
+    print(
+        f"Pipeline: {pipeline['records']} records in {pipeline['seconds']:.2f}s "
+        f"({pipeline['records_per_sec']} records/sec), p50 {pipeline['latency_p50'] or 0:.3f}s, "
+        f"p95 {pipeline['latency_p95'] or 0:.3f}s, utilisation {pipeline['utilisation']}, "
+        f"peak RSS {pipeline['peak_rss_mb']} MB"
+    )
+    print(f"{'Stage':<30} {'in':>7} {'out':>7} {'rec/s':>10} {'p50':>7} {'p95':>7} {'util':>6}")
+    for name, stage in results["stages"].items():
+        p50, p95 = (
+            f"{stage[key]:.3f}" if stage.get(key) is not None else "-"
+            for key in ("latency_p50", "latency_p95")
+        )
+        print(
+            f"{name:<30} {stage['records_in']:>7} {stage['records_out']:>7} {stage['records_per_sec'] or 0:>10.1f} "
+            f"{p50:>7} {p95:>7} {stage.get('utilisation', '-')!s:>6}"
+        )
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline against a local mock model backend")
+    parser.add_argument("--categories", type=int, default=10, help="Root categories to generate from")
+    parser.add_argument("--profiles", help="JSON file of per-model latency/rate_limit/error/max_concurrency profiles")
+    parser.add_argument("--latency-scale", type=float, default=0.1, help="Multiply every model's median latency")
+    parser.add_argument("--error-rate", type=float, help="Override the 500 rate of every model")
+    parser.add_argument("--rate-limit", type=float, help="Override the 429 rate of every model")
+    parser.add_argument("--concurrency", type=int, default=64, help="Concurrent mock requests")
+    parser.add_argument("--stream", action="store_true", help="Benchmark the streaming pipeline")
+    parser.add_argument("--batch-size", type=int, default=8, help="Streaming batch size")
+    parser.add_argument("--max-batches", type=int, default=8, help="Streaming batches in flight per stage")
+    parser.add_argument("--max-in-flight", type=int, help="Route batches through the adaptive scheduler")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for latencies, failures and canned outputs")
+    parser.add_argument("--output", help="Also write the results to this JSON file")
+    args = parser.parse_args()
+
+    profiles = None
+    if args.profiles:
+        with open(args.profiles) as file:
+            profiles = json.load(file)
+
+    benchmark = Benchmark(
+        categories=args.categories,
+        profiles=profiles,
+        latency_scale=args.latency_scale,
+        error_rate=args.error_rate,
+        rate_limit=args.rate_limit,
+        concurrency=args.concurrency,
+        pipeline_options={"stream": args.stream, "batch_size": args.batch_size, "max_batches": args.max_batches,
+                          "max_in_flight": args.max_in_flight},
+        seed=args.seed,
+    )
+    results = benchmark.run()
+    print_summary(results)
+    if args.output:
+        Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+        print(f"\nResults written to {args.output}")
+    else:
+        print(json.dumps(results, indent=2))
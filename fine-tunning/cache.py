@@ -0,0 +1,171 @@
+import argparse
+import hashlib
+import json
+import sqlite3
+import time
+from pathlib import Path
+
+CACHE_FILE = "datasets/.cache/responses.sqlite"
+MAX_CACHE_BYTES = 512 * 1024 * 1024
+# Eviction frees this share of max_bytes beyond the limit, so it runs once per that
+# much new data instead of on every put past the limit
+EVICT_HEADROOM = 0.1
+# Writes per transaction; a commit costs an fsync, far more than the write itself
+COMMIT_EVERY = 64
+
+class ResponseCache:
+    """On-disk, content-addressed cache of generated records.
+
+    Records are keyed by the rendered prompt, the instruction, the model list and the
+    output schema, so changing any of them is a miss. Entries are tagged with the stage
+    (dataset name) that produced them and evicted least-recently-used first once the
+    cache grows past max_bytes, down to max_bytes minus the headroom.
+
+    The total size is kept as a running count, so a put doesn't have to sum the table;
+    it is recounted only when the count says the cache is over the limit, which also
+    catches entries other processes added or removed in the meantime.
+
+    Puts and access-time updates are committed every commit_every writes and on
+    flush() or close(). A crash loses at most the uncommitted entries, which are
+    cache misses on the next run, never wrong records.
+    """
+
+    def __init__(self, path=CACHE_FILE, max_bytes=MAX_CACHE_BYTES, headroom=EVICT_HEADROOM,
+                 commit_every=COMMIT_EVERY):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.headroom = headroom
+        self.commit_every = commit_every
+        self.pending = 0
+        self.hits = 0
+        self.misses = 0
+
+        self.db = sqlite3.connect(path)
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                stage TEXT NOT NULL,
+                record TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                last_access REAL NOT NULL
+            )
+        """)
+        self.db.execute("CREATE INDEX IF NOT EXISTS responses_stage ON responses (stage)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+        self.db.commit()
+        self.total = self.size()
+
+    @staticmethod
+    def key(rendered_prompt, instruction, models, schema):
+        payload = json.dumps(
+            [rendered_prompt, instruction, [str(model) for model in models], schema.model_json_schema()],
+            sort_keys=True
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        row = self.db.execute("SELECT record FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.db.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+        self.written()
+        return json.loads(row[0])
+
+    def size(self):
+        return self.db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def put(self, key, stage, record):
+        data = json.dumps(record)
+        # A replaced entry no longer counts towards the total
+        row = self.db.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+        self.total += len(data) - (row[0] if row else 0)
+        self.db.execute(
+            "INSERT OR REPLACE INTO responses (key, stage, record, size, last_access) VALUES (?, ?, ?, ?, ?)",
+            (key, stage, data, len(data), time.time())
+        )
+        self.evict()
+        self.written()
+
+    def written(self):
+        """Count a write, committing once commit_every of them are pending"""
+        self.pending += 1
+        if self.pending >= self.commit_every:
+            self.flush()
+
+    def flush(self):
+        self.db.commit()
+        self.pending = 0
+
+    def evict(self):
+        """Drop least recently used entries once the cache grows past max_bytes"""
+        if self.total <= self.max_bytes:
+            return
+        self.total = self.size()
+        if self.total <= self.max_bytes:
+            return
+
+        # Walk the last_access index only as far as the entries that have to go
+        excess = self.total - self.max_bytes * (1 - self.headroom)
+        count = freed = 0
+        rows = self.db.execute("SELECT size FROM responses ORDER BY last_access ASC")
+        for (size,) in rows:
+            if freed >= excess:
+                break
+            count += 1
+            freed += size
+        rows.close()
+        self.db.execute(
+            "DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY last_access ASC LIMIT ?)",
+            (count,)
+        )
+        self.total = self.size()
+
+    def invalidate(self, stage):
+        removed = self.db.execute("DELETE FROM responses WHERE stage = ?", (stage,)).rowcount
+        self.flush()
+        self.total = self.size()
+        return removed
+
+    def clear(self):
+        removed = self.db.execute("DELETE FROM responses").rowcount
+        self.flush()
+        self.total = 0
+        return removed
+
+    def stats(self):
+        rows = self.db.execute(
+            "SELECT stage, COUNT(*), SUM(size) FROM responses GROUP BY stage ORDER BY stage"
+        ).fetchall()
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "stages": {stage: {"entries": count, "bytes": size} for stage, count, size in rows}
+        }
+
+    def close(self):
+        self.flush()
+        self.db.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect or invalidate the generation response cache")
+    parser.add_argument("--path", default=CACHE_FILE, help="Cache database file")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("stats", help="Show cached entries per stage")
+    invalidate = commands.add_parser("invalidate", help="Drop every cached response of a stage")
+    invalidate.add_argument("stage", help="Stage dataset name, e.g. contexts")
+    commands.add_parser("clear", help="Drop every cached response")
+    args = parser.parse_args()
+
+    cache = ResponseCache(args.path)
+    if args.command == "stats":
+        for stage, info in cache.stats()["stages"].items():
+            print(f"{stage:<30} {info['entries']:>8} entries {info['bytes']:>12} bytes")
+    elif args.command == "invalidate":
+        print(f"Removed {cache.invalidate(args.stage)} cached responses for {args.stage}")
+    else:
+        print(f"Removed {cache.clear()} cached responses")
+    cache.close()
@@ -0,0 +1,166 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+
+from jsonl_io import dumps, loads
+
+CHECKPOINT_DIR = "datasets/.checkpoints"
+STATE_FILE = f"{CHECKPOINT_DIR}/pipeline_state.json"
+
+def instruction_hash(instruction):
+    return hashlib.sha256(json.dumps(instruction, sort_keys=True).encode("utf-8")).hexdigest()
+
+def files_hash(paths):
+    """Hash the contents of several files, in order"""
+    digest = hashlib.sha256()
+    for path in paths:
+        digest.update(path.encode("utf-8"))
+        with open(path, 'rb') as file:
+            for block in iter(lambda: file.read(1 << 20), b""):
+                digest.update(block)
+    return digest.hexdigest()
+
+class CheckpointJournal:
+    """Append-only journal of the records a stage has completed.
+
+    Each line holds an instruction hash and one record generated for it, flushed as
+    soon as the record arrives. After a crash the stage reloads the journal and only
+    generates instructions whose hash is missing, i.e. new or changed upstream rows.
+
+    Only the byte offsets of the records are kept in memory; records are read back
+    from the journal when needed, so memory doesn't grow with the record sizes.
+    """
+
+    def __init__(self, stage, directory=CHECKPOINT_DIR):
+        Path(directory).mkdir(parents=True, exist_ok=True)
+        self.path = Path(directory) / f"{stage}.jsonl"
+        self.entries = {}
+        self.size = 0
+
+        if self.path.exists():
+            valid_end = 0
+            with open(self.path, 'rb') as file:
+                for line in file:
+                    offset = self.size
+                    self.size += len(line)
+                    try:
+                        entry = loads(line)
+                    except ValueError:
+                        # A torn line from an interrupted write
+                        continue
+                    if not line.endswith(b"\n"):
+                        continue
+                    valid_end = self.size
+                    # An entry without a hash has no instruction to resume
+                    if entry["hash"] is not None:
+                        self.entries.setdefault(entry["hash"], []).append(offset)
+            if valid_end < self.size:
+                # Drop a torn tail so new lines don't get glued onto it
+                os.truncate(self.path, valid_end)
+                self.size = valid_end
+
+        self.file = open(self.path, 'ab')
+        self.reader = open(self.path, 'rb')
+
+    def bind(self, fingerprint):
+        """Start over if the journal was written for a different prompt or schema.
+
+        Journaled records are keyed by instruction only, so a changed prompt (e.g. a
+        new fan-out) would otherwise resume records generated under the old one.
+        """
+        fingerprint_path = self.path.with_suffix(".fingerprint")
+        if fingerprint_path.exists() and fingerprint_path.read_text() == fingerprint:
+            return
+        if self.entries or self.size:
+            self.file.close()
+            os.truncate(self.path, 0)
+            self.file = open(self.path, 'ab')
+            self.entries, self.size = {}, 0
+        fingerprint_path.write_text(fingerprint)
+
+    def __contains__(self, instruction):
+        return instruction_hash(instruction) in self.entries
+
+    def read(self, offset):
+        self.reader.seek(offset)
+        return loads(self.reader.readline())["record"]
+
+    def get(self, instruction):
+        return [self.read(offset) for offset in self.entries[instruction_hash(instruction)]]
+
+    def append(self, instruction, record):
+        key = instruction_hash(instruction)
+        line = (dumps({"hash": key, "record": record}) + "\n").encode("utf-8")
+        self.file.write(line)
+        self.file.flush()
+        self.entries.setdefault(key, []).append(self.size)
+        self.size += len(line)
+
+    def records(self, keys):
+        """Lazily yield the journaled records of the given instruction hashes, in order"""
+        seen = set()
+        for key in keys:
+            if key not in seen:
+                seen.add(key)
+                for offset in self.entries.get(key, []):
+                    yield self.read(offset)
+
+    def compact(self, keys):
+        """Rewrite the journal with only the records of the current instruction hashes"""
+        current = set(keys)
+        entries, size = {}, 0
+        self.file.close()
+        tmp_path = self.path.with_suffix(".tmp")
+        with open(tmp_path, 'wb') as file:
+            for key, offsets in self.entries.items():
+                if key not in current:
+                    continue
+                for offset in offsets:
+                    self.reader.seek(offset)
+                    line = self.reader.readline()
+                    file.write(line)
+                    entries.setdefault(key, []).append(size)
+                    size += len(line)
+        self.reader.close()
+        os.replace(tmp_path, self.path)
+
+        self.entries, self.size = entries, size
+        self.file = open(self.path, 'ab')
+        self.reader = open(self.path, 'rb')
+
+    def close(self):
+        self.file.close()
+        self.reader.close()
+
+class PipelineState:
+    """Input hashes of the last successful run of every pipeline stage.
+
+    A stage's options (e.g. the validation mode) are part of the hash, so changing
+    them reruns the stage like a changed input file would.
+    """
+
+    def __init__(self, path=STATE_FILE):
+        self.path = Path(path)
+        self.stages = {}
+        if self.path.exists():
+            with open(self.path, 'r') as file:
+                self.stages = json.load(file)
+
+    @staticmethod
+    def stage_hash(stage):
+        options = json.dumps(stage.get("options", {}), sort_keys=True)
+        return hashlib.sha256((files_hash(stage["inputs"]) + options).encode("utf-8")).hexdigest()
+
+    def is_up_to_date(self, stage):
+        if not all(Path(output).exists() for output in stage["outputs"]):
+            return False
+        return self.stages.get(stage["name"]) == self.stage_hash(stage)
+
+    def mark_done(self, stage):
+        self.stages[stage["name"]] = self.stage_hash(stage)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(".tmp")
+        with open(tmp_path, 'w') as file:
+            json.dump(self.stages, file, indent=2)
+        os.replace(tmp_path, self.path)
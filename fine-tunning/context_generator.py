@@ -1,8 +1,16 @@
 import asyncio
-import json
-from dria import Prompt, DatasetGenerator, DriaDataset, Model
+from dria import DriaDataset, Model
 from pydantic import BaseModel, Field
 
+from cache import ResponseCache
+from checkpoint import CheckpointJournal
+from generation import StageGenerator
+from jsonl_io import read_jsonl
+
+INPUT_FILE = "datasets/subjects.jsonl"
+OUTPUT_FILE = "datasets/contexts.jsonl"
+MODELS = [Model.GPT4O_MINI, Model.GPT4O, Model.ANTHROPIC_SONNET_3_5_OR]
+
 # Define output schema
 class ContextOutput(BaseModel):
     subject: str = Field(..., description="Original subject name")
@@ -26,40 +34,62 @@ Requirements:
 6. Shape the context as a story, a conversation between two people, a financial report, a blog post, etc. based on the subject and extraction task
 """
 
-# Create dataset
-dataset = DriaDataset(
-    name="contexts",
-    description="A dataset of realistic contexts for information extraction",
-    schema=ContextOutput
-).reset()
-
-# Read subjects from JSONL file
-instructions = []
-with open('datasets/subjects.jsonl', 'r') as file:
-    for line in file:
-        subject_data = json.loads(line)
-        if all(key in subject_data and subject_data[key].strip() for key in ["subject", "description"]):
-            instructions.append({
-                "subject": subject_data["subject"],
-                "description": subject_data["description"]
-            })
-
-# Create prompt
-prompter = Prompt(prompt=PROMPT_TEMPLATE, schema=ContextOutput)
-
-generator = DatasetGenerator(dataset=dataset)
-
-# Run generation
-asyncio.run(
-    generator.generate(
-        instructions=instructions,
-        singletons=prompter,
-        models=[Model.GPT4O_MINI,Model.GPT4O,Model.ANTHROPIC_SONNET_3_5_OR]
+# Added when several contexts are generated per subject, so each variant differs
+VARIANT_TEMPLATE = """
+This is version {{variant}} of several contexts for this subject. Use a different format,
+setting and set of values than the other versions would.
+"""
+
+def create_dataset():
+    return DriaDataset(
+        name="contexts",
+        description="A dataset of realistic contexts for information extraction",
+        schema=ContextOutput
+    )
+
+def create_generator(cache=None, resume=True, scheduler=None, router=None, usage=None, fanout=1, limit=None):
+    return StageGenerator(
+        stage="contexts",
+        dataset=create_dataset(),
+        prompt_template=PROMPT_TEMPLATE + VARIANT_TEMPLATE if fanout > 1 else PROMPT_TEMPLATE,
+        schema=ContextOutput,
+        models=MODELS,
+        cache=cache,
+        journal=CheckpointJournal("contexts") if resume else None,
+        scheduler=scheduler,
+        router=router,
+        usage=usage,
+        variants=fanout,
+        limit=limit
     )
-)
 
-# Export results to JSON file
-dataset.to_jsonl("datasets/contexts.jsonl")
+def to_instructions(subject_data):
+    """Build the instructions for one SubjectOutput record"""
+    if all(key in subject_data and subject_data[key].strip() for key in ["subject", "description"]):
+        return [{
+            "subject": subject_data["subject"],
+            "description": subject_data["description"]
+        }]
+    return []
+
+def load_instructions(input_file=INPUT_FILE):
+    """Lazily read subjects from JSONL file"""
+    for subject_data in read_jsonl(input_file, fields=["subject", "description"]):
+        yield from to_instructions(subject_data)
+
+async def run(input_file=INPUT_FILE, output_file=OUTPUT_FILE, use_cache=True, resume=True,
+              scheduler=None, router=None, usage=None, fanout=1, limit=None):
+    # Create generator; journaled instructions are resumed and unchanged ones served from cache
+    generator = create_generator(ResponseCache() if use_cache else None, resume, scheduler, router, usage,
+                                 fanout, limit)
+
+    instructions = load_instructions(input_file)
+
+    # Run generation and export results to JSONL file
+    await generator.run(instructions, output_file)
+
+    # Print confirmation
+    print(f"Results have been exported to {output_file}")
 
-# Print confirmation
-print("Results have been exported to datasets/contexts.jsonl") 
\ No newline at end of file
+if __name__ == "__main__":
+    asyncio.run(run())
@@ -1,7 +1,30 @@
-import json
+import argparse
+import hashlib
 import os
+import time
 from pathlib import Path
 
+from jsonl_io import JsonArrayWriter, JsonlWriter, array_element, dumps, read_jsonl
+from parallel import map_ranges, report_throughput
+from telemetry import telemetry
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+INPUT_FILE = "datasets/filtered_validations.jsonl"
+OUTPUT_FILE = "datasets/conversation_format_dataset.json"
+SHARDS_DIR = "datasets/conversations"
+
+FIELDS = ["subject", "description", "context", "extracted_info"]
+FORMATS = ["json", "jsonl", "parquet"]
+
+# Same base model as Fine_Tuning.ipynb
+TOKENIZER = "unsloth/Llama-3.2-1B-Instruct"
+CONTEXT_MARKER = "Here is the context to extract information from: "
+
 def create_conversation(data):
     """Convert a single data entry into a conversation format"""
     return [
@@ -19,56 +42,411 @@ def create_conversation(data):
         }
     ]
 
-def convert_data():
+def convert_data(input_file=INPUT_FILE, output_file=OUTPUT_FILE, workers=1):
     """Convert the dataset into fine-tuning format"""
     try:
-        # Read the extractions data line by line (JSONL format)
-        data_array = []
-        with open('datasets/filtered_validations.jsonl', 'r', encoding='utf-8') as file:
-            for line in file:
-                line = line.strip()
-                if line:  # Skip empty lines
-                    data_array.append(json.loads(line))
-        
-        # Convert to fine-tuning format
-        conversations = []
+        # Stream the extractions (JSONL format) straight into the output array,
+        # parsing only the fields a conversation needs
+        fields = FIELDS
         processed_count = 0
+        rows = 0
+        start = time.perf_counter()
+
+        with JsonArrayWriter(output_file, indent=2) as out:
+            if workers > 1:
+                # Workers write finished array elements; parts are copied in input order
+                for part_file, counts in map_ranges(input_file, format_range, workers,
+                                                    output_dir=Path(output_file).parent):
+                    out.copy_from(part_file, counts["kept"])
+                    processed_count += counts["kept"]
+                    rows += counts["rows"]
+            else:
+                for entry in read_jsonl(input_file, fields=fields):
+                    rows += 1
+                    try:
+                        # Skip empty or invalid entries
+                        if not isinstance(entry, dict):
+                            continue
+
+                        # Check if all required fields exist
+                        if all(field in entry for field in fields):
+                            out.write(create_conversation(entry))
+                            processed_count += 1
+
+                    except Exception as e:
+                        print(f"Error processing entry: {str(e)}")
         
-        for entry in data_array:
-            try:
-                # Skip empty or invalid entries
-                if not isinstance(entry, dict):
-                    continue
-                
-                # Check if all required fields exist
-                if all(field in entry for field in ["subject", "description", "context", "extracted_info"]):
-                    conversation = create_conversation(entry)
-                    conversations.append(conversation)
-                    processed_count += 1
-                
-            except Exception as e:
-                print(f"Error processing entry: {str(e)}")
-        
-        # Save the conversations
-        with open('datasets/conversation_format_dataset.json', 'w', encoding='utf-8') as out:
-            json.dump(conversations, out, indent=2)
-        
-        print(f"\nSuccessfully processed and saved {processed_count} conversations to datasets/conversation_format_dataset.json")
+        print(f"\nSuccessfully processed and saved {processed_count} conversations to {output_file}")
+        report_throughput("Data conversion", rows, time.perf_counter() - start, workers)
+        telemetry.count("records_in_total", rows, stage="data_conversion")
+        telemetry.count("records_out_total", processed_count, stage="data_conversion")
         
     except Exception as e:
         print(f"Error: {str(e)}")
 
+def iter_conversations(input_file, counts=None, start=0, end=None):
+    """Lazily yield the conversations of the entries that have every required field.
+
+    counts, when given, tallies the rows read and the conversations yielded.
+    """
+    counts = counts if counts is not None else {"rows": 0, "kept": 0}
+    for entry in read_jsonl(input_file, fields=FIELDS, start=start, end=end):
+        counts["rows"] += 1
+        if isinstance(entry, dict) and all(field in entry for field in FIELDS):
+            counts["kept"] += 1
+            yield create_conversation(entry)
+
+def format_range(input_file, start, end, part_file):
+    """Worker: write the conversations of one byte range as JSON array elements"""
+    counts = {"rows": 0, "kept": 0}
+    with open(part_file, 'w') as out:
+        out.writelines(array_element(conversation, 2) for conversation in iter_conversations(input_file, counts, start, end))
+    return counts
+
+def conversation_range(input_file, start, end, part_file):
+    """Worker: write the conversations of one byte range as JSONL"""
+    counts = {"rows": 0, "kept": 0}
+    with open(part_file, 'w') as out:
+        out.writelines(dumps(conversation) + "\n" for conversation in iter_conversations(input_file, counts, start, end))
+    return counts
+
+def is_eval(conversation, eval_fraction):
+    """Stable split: the same conversation always lands on the same side"""
+    digest = hashlib.sha256(conversation[1]["content"].encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") / 2**64 < eval_fraction
+
+class JsonlShard:
+    def __init__(self, path):
+        self.writer = JsonlWriter(path)
+
+    def write(self, row):
+        self.writer.write(row)
+
+    def close(self):
+        self.writer.close()
+
+class ParquetShard:
+    """Parquet shard written in row groups, so only one group is held in memory.
+
+    The schema is inferred from the first row group, so plain conversation rows
+    and packed text rows are both stored natively.
+    """
+
+    def __init__(self, path, row_group_size=1000):
+        self.path = Path(path)
+        self.tmp_path = self.path.with_name(f".{self.path.name}.tmp")
+        self.writer = None
+        self.row_group_size = row_group_size
+        self.rows = []
+
+    def flush(self):
+        if not self.rows:
+            return
+        if self.writer is None:
+            table = pa.Table.from_pylist(self.rows)
+            self.writer = pq.ParquetWriter(self.tmp_path, table.schema, compression="zstd")
+        else:
+            table = pa.Table.from_pylist(self.rows, schema=self.writer.schema)
+        self.writer.write_table(table)
+        self.rows = []
+
+    def write(self, row):
+        self.rows.append(row)
+        if len(self.rows) >= self.row_group_size:
+            self.flush()
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+        os.replace(self.tmp_path, self.path)
+
+class TokenLengthShaper:
+    """Fits conversations to the training sequence length with the target chat template.
+
+    Conversations are tokenized locally with the model's tokenizer. Over-length ones
+    are dropped, or truncated by cutting the end of the context in the user message.
+    Every window of conversations is sorted by length, so batches hold similar
+    lengths and waste little padding; with pack, short conversations are also
+    combined first-fit-decreasing into rows of at most max_seq_length tokens.
+
+    Sorting happens per window rather than over the whole dataset to keep memory
+    bounded. Rows carry a "length" column for group_by_length, packed rows a
+    rendered "text" instead of "conversations".
+    """
+
+    def __init__(self, tokenizer, max_seq_length=2048, overlength="drop", pack=False, window=10000, batch_size=2):
+        self.tokenizer = tokenizer
+        self.max_seq_length = max_seq_length
+        self.overlength = overlength
+        self.pack = pack
+        self.window = window
+        self.batch_size = batch_size
+        self.pending = []
+        self.counts = {"kept": 0, "truncated": 0, "dropped": 0, "rows": 0}
+        # Padding tokens a batch_size batch would need, in input order and after shaping
+        self.padding = {"before": 0, "after": 0}
+        self.tokens = 0
+        self.unsorted = []
+
+    def length(self, conversation):
+        return len(self.tokenizer.apply_chat_template(conversation, tokenize=True))
+
+    def truncate(self, conversation, length):
+        """Cut the end of the context so the conversation fits, or return None"""
+        user = conversation[1]
+        prefix, marker, context = user["content"].partition(CONTEXT_MARKER)
+        tokens = self.tokenizer.encode(context, add_special_tokens=False)
+        keep = len(tokens) - (length - self.max_seq_length)
+        if not marker or keep <= 0:
+            return None
+        truncated = [conversation[0], {**user, "content": prefix + marker + self.tokenizer.decode(tokens[:keep])}, *conversation[2:]]
+        # Decoding and re-encoding can shift a token or two
+        length = self.length(truncated)
+        return (truncated, length) if length <= self.max_seq_length else None
+
+    def fit(self, conversation):
+        length = self.length(conversation)
+        if length <= self.max_seq_length:
+            return conversation, length
+        fitted = self.truncate(conversation, length) if self.overlength == "truncate" else None
+        self.counts["truncated" if fitted else "dropped"] += 1
+        return fitted
+
+    @staticmethod
+    def batch_padding(lengths, batch_size):
+        return sum(
+            max(batch) * len(batch) - sum(batch)
+            for batch in (lengths[i:i + batch_size] for i in range(0, len(lengths), batch_size))
+        )
+
+    def add(self, conversation):
+        """Queue one conversation; returns the rows of a window once it is full"""
+        fitted = self.fit(conversation)
+        if fitted is None:
+            return []
+        self.pending.append(fitted)
+        if len(self.pending) >= self.window:
+            return self.flush()
+        return []
+
+    def flush(self):
+        """Shape and return the rows of the queued conversations"""
+        window, self.pending = self.pending, []
+        if not window:
+            return []
+        self.counts["kept"] += len(window)
+        lengths = [length for _, length in window]
+        self.tokens += sum(lengths)
+        self.padding["before"] += self.batch_padding(lengths, self.batch_size)
+
+        window.sort(key=lambda item: item[1])
+        rows = self.pack_rows(window) if self.pack else [
+            {"conversations": conversation, "length": length} for conversation, length in window
+        ]
+        self.padding["after"] += self.batch_padding([row["length"] for row in rows], self.batch_size)
+        self.counts["rows"] += len(rows)
+        return rows
+
+    def pack_rows(self, window):
+        bins = []
+        for conversation, length in reversed(window):
+            for packed in bins:
+                if packed["length"] + length <= self.max_seq_length:
+                    break
+            else:
+                packed = {"conversations": [], "length": 0}
+                bins.append(packed)
+            packed["conversations"].append(conversation)
+            packed["length"] += length
+
+        rows = [
+            {
+                "text": "".join(
+                    self.tokenizer.apply_chat_template(conversation, tokenize=False)
+                    for conversation in packed["conversations"]
+                ),
+                "length": packed["length"],
+                "num_conversations": len(packed["conversations"])
+            }
+            for packed in bins
+        ]
+        rows.sort(key=lambda row: row["length"])
+        return rows
+
+    def report(self):
+        print(
+            f"Token lengths (max {self.max_seq_length}): {self.counts['kept']} conversations kept "
+            f"({self.counts['truncated']} truncated), {self.counts['dropped']} dropped, "
+            f"{self.counts['rows']} rows written"
+        )
+        if self.tokens:
+            print(
+                f"Padding at batch size {self.batch_size}: {self.padding['before'] / self.tokens:.1%} of tokens "
+                f"in input order, {self.padding['after'] / self.tokens:.1%} after "
+                f"{'packing' if self.pack else 'bucketing'}"
+            )
+
+def load_tokenizer(name):
+    try:
+        from transformers import AutoTokenizer
+    except ImportError:
+        raise ImportError("Token-length mode needs transformers: pip install transformers")
+    return AutoTokenizer.from_pretrained(name)
+
+class ShardedExporter:
+    """Writes conversations record by record into numbered train/eval shards.
+
+    Each split gets files named <split>-00000.<ext>, starting a new shard every
+    shard_size rows. Rows are {"conversations": [...messages]}, the layout the
+    fine-tuning notebook expects. With shaping options each split goes through its
+    own TokenLengthShaper first.
+    """
+
+    def __init__(self, output_dir=SHARDS_DIR, format="jsonl", shard_size=10000, eval_fraction=0.0, **shaping):
+        if format == "parquet" and pa is None:
+            raise ImportError("Parquet export needs pyarrow: pip install pyarrow")
+        self.output_dir = Path(output_dir)
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.format = format
+        self.extension = "parquet" if format == "parquet" else "jsonl"
+        self.shard_size = shard_size
+        self.eval_fraction = eval_fraction
+        self.shards = {}
+        self.counts = {"train": 0, "eval": 0}
+        self.written = []
+        self.shapers = {}
+        if shaping.get("tokenizer") is not None:
+            self.shapers = {split: TokenLengthShaper(**shaping) for split in self.counts}
+
+    def open_shard(self, split):
+        path = self.output_dir / f"{split}-{self.counts[split] // self.shard_size:05d}.{self.extension}"
+        self.written.append(path)
+        return ParquetShard(path) if self.format == "parquet" else JsonlShard(path)
+
+    def write_row(self, split, row):
+        if self.counts[split] % self.shard_size == 0:
+            if split in self.shards:
+                self.shards[split].close()
+            self.shards[split] = self.open_shard(split)
+        self.shards[split].write(row)
+        self.counts[split] += 1
+
+    def write(self, conversation):
+        split = "eval" if self.eval_fraction and is_eval(conversation, self.eval_fraction) else "train"
+        if self.shapers:
+            for row in self.shapers[split].add(conversation):
+                self.write_row(split, row)
+        else:
+            self.write_row(split, {"conversations": conversation})
+
+    def close(self):
+        for split, shaper in self.shapers.items():
+            for row in shaper.flush():
+                self.write_row(split, row)
+        for shard in self.shards.values():
+            shard.close()
+        # Shards left over from an earlier, larger export would be read as data
+        for path in self.output_dir.glob(f"*-[0-9][0-9][0-9][0-9][0-9].{self.extension}"):
+            if path not in self.written:
+                path.unlink()
+
+    def report(self):
+        for split, shaper in self.shapers.items():
+            if shaper.counts["kept"] or shaper.counts["dropped"]:
+                print(f"[{split}] ", end="")
+                shaper.report()
+
+def export_shards(input_file=INPUT_FILE, output_dir=SHARDS_DIR, format="jsonl", shard_size=10000, eval_fraction=0.0,
+                  workers=1, **shaping):
+    """Stream the dataset into JSONL or Parquet shards instead of one JSON array.
+
+    With workers > 1 the input is parsed and converted in a process pool; splitting,
+    shaping and sharding stay in this process, in input order.
+    """
+    start = time.perf_counter()
+    exporter = ShardedExporter(output_dir, format, shard_size, eval_fraction, **shaping)
+    counts = {"rows": 0, "kept": 0}
+    if workers > 1:
+        Path(output_dir).mkdir(parents=True, exist_ok=True)
+        for part_file, part_counts in map_ranges(input_file, conversation_range, workers, output_dir=output_dir):
+            for conversation in read_jsonl(part_file):
+                exporter.write(conversation)
+            counts["rows"] += part_counts["rows"]
+    else:
+        for conversation in iter_conversations(input_file, counts):
+            exporter.write(conversation)
+    exporter.close()
+
+    print(
+        f"\nSuccessfully exported {exporter.counts['train']} train and {exporter.counts['eval']} eval "
+        f"rows to {len(exporter.written)} {format} shards in {output_dir}"
+    )
+    exporter.report()
+    report_throughput("Data conversion", counts["rows"], time.perf_counter() - start, workers)
+    telemetry.count("records_in_total", counts["rows"], stage="data_conversion")
+    telemetry.count("records_out_total", exporter.counts["train"] + exporter.counts["eval"], stage="data_conversion")
+
+def run(input_file=INPUT_FILE, output_file=None, format="jsonl", shard_size=10000, eval_fraction=0.0,
+        tokenizer=None, max_seq_length=2048, overlength="drop", pack=False, workers=1):
+    """Pipeline entry point; output_file is the shard directory for jsonl/parquet.
+
+    With a tokenizer name the shards are length-shaped for training (see TokenLengthShaper).
+    """
+    output_file = output_file or (OUTPUT_FILE if format == "json" else SHARDS_DIR)
+    if format == "json":
+        if tokenizer is not None:
+            raise ValueError("Token-length shaping writes shards, use --format jsonl or parquet")
+        Path(output_file).parent.mkdir(parents=True, exist_ok=True)
+        convert_data(input_file, output_file, workers)
+        return
+
+    shaping = {}
+    if tokenizer is not None:
+        shaping = {
+            "tokenizer": load_tokenizer(tokenizer),
+            "max_seq_length": max_seq_length,
+            "overlength": overlength,
+            "pack": pack
+        }
+    export_shards(input_file, output_file, format, shard_size, eval_fraction, workers, **shaping)
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert filtered validations into the fine-tuning format")
+    parser.add_argument("--format", choices=FORMATS, default="jsonl",
+                        help="jsonl/parquet stream into shards, as loaded by Fine_Tuning.ipynb; json writes one array")
+    parser.add_argument("--output", help=f"Output file (json) or shard directory (default {SHARDS_DIR})")
+    parser.add_argument("--shard-size", type=int, default=10000, help="Conversations per shard")
+    parser.add_argument("--eval-fraction", type=float, default=0.0, help="Fraction of conversations held out for eval")
+    parser.add_argument("--tokenizer", nargs="?", const=TOKENIZER,
+                        help=f"Shape shards by token length using this model's chat template (default {TOKENIZER})")
+    parser.add_argument("--max-seq-length", type=int, default=2048, help="Training sequence length")
+    parser.add_argument("--overlength", choices=["drop", "truncate"], default="drop",
+                        help="Drop over-length conversations or cut the end of their context")
+    parser.add_argument("--pack", action="store_true", help="Pack short conversations into rows of up to max-seq-length tokens")
+    parser.add_argument("--workers", type=int, default=1, help="Parse and convert byte ranges of the input in this many processes")
+    args = parser.parse_args()
+
     try:
         # Create datasets directory if it doesn't exist
         Path("datasets").mkdir(parents=True, exist_ok=True)
         
         # Define input and output paths
-        input_file = "datasets/filtered_validations.jsonl"
-        output_file = "datasets/conversation_format_dataset.json"  # Changed to match pipeline
+        input_file = INPUT_FILE
+        output_file = args.output or (OUTPUT_FILE if args.format == "json" else SHARDS_DIR)
         
         print(f"Starting conversion from {input_file} to {output_file}")
-        convert_data()
+        run(
+            input_file,
+            output_file,
+            args.format,
+            args.shard_size,
+            args.eval_fraction,
+            args.tokenizer,
+            args.max_seq_length,
+            args.overlength,
+            args.pack,
+            args.workers
+        )
         
     except Exception as e:
         print(f"Failed to convert data: {e}")
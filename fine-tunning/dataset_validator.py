@@ -1,9 +1,19 @@
+import argparse
 import asyncio
-import json
-from dria import Prompt, DatasetGenerator, DriaDataset, Model
+from dria import DriaDataset, Model
 from pydantic import BaseModel, Field
 from typing import List
 
+from cache import ResponseCache
+from checkpoint import CheckpointJournal
+from generation import StageGenerator
+from jsonl_io import read_jsonl, write_jsonl
+from local_scorer import WEIGHTS_FILE, LocalScorer
+
+INPUT_FILE = "datasets/extractions.jsonl"
+OUTPUT_FILE = "datasets/validated_extractions_0.jsonl"
+MODELS = [Model.GPT4O_MINI, Model.GPT4O, Model.ANTHROPIC_SONNET_3_5_OR]
+
 # Define simplified output schema for scoring
 class EntryScore(BaseModel):
     subject: str = Field(..., description="Original subject")
@@ -29,43 +39,88 @@ Provide:
 Keep your response focused and concise.
 """
 
-# Create dataset
-dataset = DriaDataset(
-    name="validated_extractions",
-    description="Validated information extraction results",
-    schema=EntryScore
-).reset()
-
-# Read extractions from JSONL file
-instructions = []
-with open('datasets/extractions.jsonl', 'r') as f:
-    for line in f:
-        if line.strip():  # Skip empty lines
-            extraction = json.loads(line)
-            if extraction["subject"] and extraction["context"]:  # Skip empty entries
-                instructions.append({
-                    "subject": extraction["subject"],
-                    "context": extraction["context"],
-                    "extracted_info": extraction["extracted_info"]
-                })
-
-print(f"Loaded {len(instructions)} extractions for processing")
-
-# Create prompt and generator
-prompter = Prompt(prompt=PROMPT_TEMPLATE, schema=EntryScore)
-generator = DatasetGenerator(dataset=dataset)
-
-# Run validation
-asyncio.run(
-    generator.generate(
-        instructions=instructions,
-        singletons=prompter,
-        models=[Model.GPT4O_MINI, Model.GPT4O, Model.ANTHROPIC_SONNET_3_5_OR]
+def create_dataset():
+    return DriaDataset(
+        name="validated_extractions",
+        description="Validated information extraction results",
+        schema=EntryScore
+    )
+
+def create_generator(cache=None, resume=True, scheduler=None, router=None, usage=None, local=False,
+                     weights_file=WEIGHTS_FILE):
+    return StageGenerator(
+        stage="validated_extractions",
+        dataset=create_dataset(),
+        prompt_template=PROMPT_TEMPLATE,
+        schema=EntryScore,
+        models=MODELS,
+        cache=cache,
+        journal=CheckpointJournal("validated_extractions") if resume else None,
+        scheduler=scheduler,
+        router=router,
+        usage=usage,
+        # Confidently scored rows never reach the LLM; the rest are escalated to it
+        prefilter=LocalScorer(weights_file) if local else None
+    )
+
+def to_instructions(extraction):
+    """Build the instructions for one ExtractionOutput record"""
+    if extraction["subject"] and extraction["context"]:  # Skip empty entries
+        instruction = {
+            "subject": extraction["subject"],
+            "context": extraction["context"],
+            "extracted_info": extraction["extracted_info"]
+        }
+        # Only read when the local scorer needs it for key coverage
+        if "description" in extraction:
+            instruction["description"] = extraction["description"]
+        return [instruction]
+    return []
+
+def load_instructions(input_file=INPUT_FILE, local=False):
+    """Lazily read extractions from JSONL file"""
+    fields = ["subject", "context", "extracted_info"] + (["description"] if local else [])
+    for extraction in read_jsonl(input_file, fields=fields):
+        yield from to_instructions(extraction)
+
+def scores_from_validations(input_file, output_file=OUTPUT_FILE):
+    """Build EntryScore rows from validations generated with validate_extractions.py --mode combined.
+
+    The combined validation call already returns quality_score, so no LLM call is needed.
+    """
+    scores = (
+        EntryScore(**validation).model_dump()
+        for validation in read_jsonl(input_file)
+        if "quality_score" in validation
+    )
+    count = write_jsonl(scores, output_file)
+    print(f"Exported {count} scores from {input_file} to {output_file}")
+
+async def run(input_file=INPUT_FILE, output_file=OUTPUT_FILE, use_cache=True, resume=True,
+              scheduler=None, router=None, usage=None, local=False, weights_file=WEIGHTS_FILE):
+    # Create generator; journaled instructions are resumed and unchanged ones served from cache
+    generator = create_generator(
+        ResponseCache() if use_cache else None, resume, scheduler, router, usage, local, weights_file
     )
-)
 
-# Export results
-dataset.to_jsonl("datasets/validated_extractions_0.jsonl")
+    instructions = load_instructions(input_file, local)
+
+    # Run validation and export results
+    await generator.run(instructions, output_file)
+
+    # Print confirmation
+    print(f"Results have been exported to {output_file}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Score extractions")
+    parser.add_argument("--from-validations", metavar="FILE",
+                        help="Reuse the scores of a combined-mode validations file instead of calling the LLM")
+    parser.add_argument("--local", action="store_true",
+                        help="Experimental: score locally and only escalate low-confidence rows to the LLM")
+    parser.add_argument("--weights", default=WEIGHTS_FILE, help="Calibrated local scorer (see local_scorer.py calibrate)")
+    args = parser.parse_args()
 
-# Print confirmation
-print("Results have been exported to datasets/validated_extractions_0.jsonl") 
\ No newline at end of file
+    if args.from_validations:
+        scores_from_validations(args.from_validations)
+    else:
+        asyncio.run(run(local=args.local, weights_file=args.weights))
@@ -0,0 +1,224 @@
+import argparse
+import hashlib
+import re
+from array import array
+from functools import lru_cache
+
+from jsonl_io import JsonlWriter, read_jsonl, write_jsonl
+from telemetry import telemetry
+
+INPUT_FILE = "datasets/subjects.jsonl"
+OUTPUT_FILE = "datasets/unique_subjects.jsonl"
+
+# Fields compared for each kind of record
+FIELDS = {
+    "subjects": ["subject", "description"],
+    "contexts": ["context"],
+}
+
+MAX_HASH = 2**32
+MASK = 2**64 - 1
+# Characters of a record's text kept for the report and the clusters file
+PREVIEW = 80
+
+@lru_cache(maxsize=2**20)
+def word_hash(word):
+    return int.from_bytes(hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest(), "little")
+
+def shingle_hashes(text, size=3):
+    """64-bit hashes of the word n-grams of the lowercased text.
+
+    Words are hashed once (and cached across records) and each n-gram is the
+    tuple hash of its word hashes, which is much cheaper than hashing n-gram
+    strings. Tuples of ints hash the same in every process.
+    """
+    words = [word_hash(word) for word in re.findall(r"\w+", text.lower())] or [0]
+    size = min(size, len(words))
+    return {hash(gram) & MASK for gram in zip(*(words[i:] for i in range(size)))}
+
+def minhash(text, num_perm=128, size=3):
+    """One-permutation MinHash signature of a text.
+
+    Every shingle is hashed once and lands in one of num_perm bins, keeping the
+    smallest value per bin, so the cost is linear in the text length instead of
+    num_perm hashes per shingle. Empty bins borrow the next filled bin's value
+    (rotation densification) so short texts still get comparable signatures.
+    """
+    signature = array("I", [MAX_HASH - 1]) * num_perm
+    filled = [False] * num_perm
+    for value in shingle_hashes(text, size):
+        slot = value % num_perm
+        value = (value // num_perm) % MAX_HASH
+        if not filled[slot] or value < signature[slot]:
+            signature[slot] = value
+            filled[slot] = True
+
+    if not all(filled):
+        for slot in range(num_perm):
+            if not filled[slot]:
+                distance = 1
+                while not filled[(slot + distance) % num_perm]:
+                    distance += 1
+                # The offset keeps borrowed values from matching real ones by accident
+                signature[slot] = (signature[(slot + distance) % num_perm] + distance * 0x9E3779B1) % MAX_HASH
+    return signature
+
+def similarity(first, second):
+    """Estimated Jaccard similarity of two signatures"""
+    return sum(a == b for a, b in zip(first, second)) / len(first)
+
+def lsh_bands(threshold, num_perm):
+    """Pick (bands, rows) whose collision curve best separates pairs around threshold.
+
+    Weighs the probability of missing a pair above the threshold against the
+    probability of comparing one below it, integrated over similarity.
+    """
+    def probability(s, bands, rows):
+        return 1 - (1 - s ** rows) ** bands
+
+    steps = [i / 100 for i in range(101)]
+    best, best_error = None, float("inf")
+    for bands in range(1, num_perm + 1):
+        rows = num_perm // bands
+        false_positives = sum(probability(s, bands, rows) for s in steps if s < threshold)
+        false_negatives = sum(1 - probability(s, bands, rows) for s in steps if s >= threshold)
+        error = false_positives + false_negatives
+        if error < best_error:
+            best, best_error = (bands, rows), error
+    return best
+
+class Deduplicator:
+    """Drops records that are near-duplicates of an earlier record.
+
+    Records are signed with MinHash over the given fields and looked up in an LSH
+    index, so each record is only compared with the few earlier ones sharing a band
+    bucket. Candidates whose estimated similarity reaches the threshold make the
+    record a duplicate of that earlier record; everything else is kept and indexed.
+    Only kept records are indexed, so memory grows with the unique rows. Records are
+    not held on to: the clusters refer to them by their position in the input and
+    a preview of their text.
+    """
+
+    def __init__(self, fields, threshold=0.8, num_perm=128, shingle_size=3, label="dedup"):
+        self.fields = fields
+        self.label = label
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self.bands, self.rows = lsh_bands(threshold, num_perm)
+        self.buckets = [{} for _ in range(self.bands)]
+        self.signatures = []
+        # Input position and text preview of each kept record
+        self.positions = array("Q")
+        self.previews = []
+        # Index of a kept record -> (position, similarity, preview) of its dropped duplicates
+        self.clusters = {}
+        self.seen = 0
+
+    def text(self, record):
+        return "\n".join(str(record.get(field, "")) for field in self.fields)
+
+    def band_keys(self, signature):
+        for band in range(self.bands):
+            yield band, signature[band * self.rows:(band + 1) * self.rows].tobytes()
+
+    def find_duplicate(self, signature):
+        candidates = set()
+        for band, key in self.band_keys(signature):
+            candidates.update(self.buckets[band].get(key, ()))
+        best, best_similarity = None, self.threshold
+        for candidate in candidates:
+            score = similarity(signature, self.signatures[candidate])
+            if score >= best_similarity:
+                best, best_similarity = candidate, score
+        return best, best_similarity
+
+    def __call__(self, record):
+        """Return True when the record should be kept"""
+        position = self.seen
+        self.seen += 1
+        telemetry.count("records_in_total", stage=self.label)
+        text = self.text(record)
+        signature = minhash(text, self.num_perm, self.shingle_size)
+        duplicate, score = self.find_duplicate(signature)
+        if duplicate is not None:
+            self.clusters.setdefault(duplicate, []).append((position, score, text[:PREVIEW]))
+            telemetry.count("records_dropped_total", stage=self.label)
+            return False
+
+        index = len(self.signatures)
+        self.signatures.append(signature)
+        self.positions.append(position)
+        self.previews.append(text[:PREVIEW])
+        for band, key in self.band_keys(signature):
+            self.buckets[band].setdefault(key, []).append(index)
+        telemetry.count("records_out_total", stage=self.label)
+        return True
+
+    @property
+    def removed(self):
+        return sum(len(duplicates) for duplicates in self.clusters.values())
+
+    def report(self, examples=5):
+        print(
+            f"Dedup ({', '.join(self.fields)}): {self.seen} records, {self.removed} near-duplicates removed "
+            f"in {len(self.clusters)} clusters (threshold {self.threshold}, {self.bands} bands x {self.rows} rows)"
+        )
+        largest = sorted(self.clusters.items(), key=lambda item: len(item[1]), reverse=True)[:examples]
+        for index, duplicates in largest:
+            print(f"  {len(duplicates) + 1:>4} x {self.previews[index]!r}")
+
+    def write_clusters(self, output_file):
+        """Write every cluster removed: the record kept and the duplicates dropped, each
+        as its 0-based position among the input records and a preview of its text"""
+        write_jsonl(
+            (
+                {
+                    "kept": {"position": self.positions[index], "preview": self.previews[index]},
+                    "removed": [
+                        {"position": position, "similarity": round(score, 3), "preview": preview}
+                        for position, score, preview in duplicates
+                    ]
+                }
+                for index, duplicates in self.clusters.items()
+            ),
+            output_file
+        )
+
+def create_filter(kind="subjects", threshold=0.8, num_perm=128, shingle_size=3):
+    return Deduplicator(FIELDS[kind], threshold, num_perm, shingle_size, label=f"dedup_{kind}")
+
+def run(input_file=INPUT_FILE, output_file=OUTPUT_FILE, kind="subjects", threshold=0.8, num_perm=128,
+        shingle_size=3, clusters_file=None):
+    deduplicator = create_filter(kind, threshold, num_perm, shingle_size)
+    with JsonlWriter(output_file) as outfile:
+        for line, record in read_jsonl(input_file, raw=True):
+            if deduplicator(record):
+                outfile.write_line(line)
+
+    deduplicator.report()
+    if clusters_file is not None:
+        deduplicator.write_clusters(clusters_file)
+        print(f"Removed clusters written to {clusters_file}")
+    return deduplicator
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Remove near-duplicate subjects or contexts")
+    parser.add_argument("kind", choices=list(FIELDS), help="Which records the input holds")
+    parser.add_argument("--input", help="Input JSONL file (default datasets/<kind>.jsonl)")
+    parser.add_argument("--output", help="Output JSONL file (default datasets/unique_<kind>.jsonl)")
+    parser.add_argument("--threshold", type=float, default=0.8, help="Estimated Jaccard similarity counted as a duplicate")
+    parser.add_argument("--num-perm", type=int, default=128, help="MinHash signature length")
+    parser.add_argument("--shingle-size", type=int, default=3, help="Words per shingle")
+    parser.add_argument("--clusters", help="Also write the removed clusters to this JSONL file")
+    args = parser.parse_args()
+
+    run(
+        args.input or f"datasets/{args.kind}.jsonl",
+        args.output or f"datasets/unique_{args.kind}.jsonl",
+        kind=args.kind,
+        threshold=args.threshold,
+        num_perm=args.num_perm,
+        shingle_size=args.shingle_size,
+        clusters_file=args.clusters
+    )
@@ -1,8 +1,16 @@
 import asyncio
-import json
-from dria import Prompt, DatasetGenerator, DriaDataset, Model
+from dria import DriaDataset, Model
 from pydantic import BaseModel, Field
 
+from cache import ResponseCache
+from checkpoint import CheckpointJournal
+from generation import StageGenerator
+from jsonl_io import read_jsonl
+
+INPUT_FILE = "datasets/contexts.jsonl"
+OUTPUT_FILE = "datasets/extractions.jsonl"
+MODELS = [Model.GPT4O_MINI, Model.GPT4O, Model.ANTHROPIC_SONNET_3_5_OR]
+
 # Define output schema
 class ExtractionOutput(BaseModel):
     subject: str = Field(..., description="Original subject name")
@@ -25,41 +33,55 @@ Extracted_data: [data_label_1: data_value_1, data_label_2: data_value_2, ...]
 If the information is not present in the document, write "null" for the corresponding data_label.
 """
 
-# Create dataset
-dataset = DriaDataset(
-    name="extractions",
-    description="A dataset of extracted structured information from documents",
-    schema=ExtractionOutput
-).reset()
-
-# Read instructions from JSONL file
-instructions = []
-with open('datasets/contexts.jsonl', 'r') as file:
-    for line in file:
-        context_data = json.loads(line)
-        if all(key in context_data and context_data[key].strip() for key in ["subject", "description", "context"]):
-            instructions.append({
-                "subject": context_data["subject"],
-                "description": context_data["description"],
-                "context": context_data["context"]
-            })
-
-print(f"Loaded {len(instructions)} contexts for processing")
-
-# Create prompt and generator
-prompter = Prompt(prompt=PROMPT_TEMPLATE, schema=ExtractionOutput)
-generator = DatasetGenerator(dataset=dataset)
-
-# Run generation
-asyncio.run(
-    generator.generate(
-        instructions=instructions,
-        singletons=prompter,
-        models=[Model.GPT4O_MINI, Model.GPT4O, Model.ANTHROPIC_SONNET_3_5_OR]
+def create_dataset():
+    return DriaDataset(
+        name="extractions",
+        description="A dataset of extracted structured information from documents",
+        schema=ExtractionOutput
     )
-)
 
-# Export results to JSONL file
-dataset.to_jsonl("datasets/extractions.jsonl")
+def create_generator(cache=None, resume=True, scheduler=None, router=None, usage=None, limit=None):
+    return StageGenerator(
+        stage="extractions",
+        dataset=create_dataset(),
+        prompt_template=PROMPT_TEMPLATE,
+        schema=ExtractionOutput,
+        models=MODELS,
+        cache=cache,
+        journal=CheckpointJournal("extractions") if resume else None,
+        scheduler=scheduler,
+        router=router,
+        usage=usage,
+        limit=limit
+    )
+
+def to_instructions(context_data):
+    """Build the instructions for one ContextOutput record"""
+    if all(key in context_data and context_data[key].strip() for key in ["subject", "description", "context"]):
+        return [{
+            "subject": context_data["subject"],
+            "description": context_data["description"],
+            "context": context_data["context"]
+        }]
+    return []
+
+def load_instructions(input_file=INPUT_FILE):
+    """Lazily read contexts from JSONL file"""
+    for context_data in read_jsonl(input_file, fields=["subject", "description", "context"]):
+        yield from to_instructions(context_data)
+
+async def run(input_file=INPUT_FILE, output_file=OUTPUT_FILE, use_cache=True, resume=True,
+              scheduler=None, router=None, usage=None, limit=None):
+    # Create generator; journaled instructions are resumed and unchanged ones served from cache
+    generator = create_generator(ResponseCache() if use_cache else None, resume, scheduler, router, usage, limit)
+
+    instructions = load_instructions(input_file)
+
+    # Run generation and export results to JSONL file
+    await generator.run(instructions, output_file)
+
+    # Print confirmation
+    print(f"Results have been exported to {output_file}")
 
-print("Results have been exported to datasets/extractions.jsonl")
\ No newline at end of file
+if __name__ == "__main__":
+    asyncio.run(run())
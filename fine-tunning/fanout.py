@@ -0,0 +1,105 @@
+import argparse
+from itertools import product
+
+from jsonl_io import read_jsonl
+
+CATEGORIES_FILE = "datasets/categories.jsonl"
+
+# Children generated per parent at each level of the tree: sub-categories per
+# category and subjects per sub-category come back as a list from one call,
+# contexts per subject are separate calls
+DEFAULT_FANOUT = {"sub_categories": 3, "subjects": 1, "contexts": 1}
+
+# LLM calls made for every context further down the pipeline (extraction, validation)
+LEAF_STAGES = ["extractions", "validations"]
+
+def parse_fanout(text):
+    """Parse "sub_categories=5,subjects=2" into a fan-out dict over the defaults"""
+    fanout = dict(DEFAULT_FANOUT)
+    for item in filter(None, (part.strip() for part in (text or "").split(","))):
+        stage, _, value = item.partition("=")
+        if stage not in fanout:
+            raise ValueError(f"Unknown fan-out level {stage!r}, expected one of {', '.join(fanout)}")
+        fanout[stage] = int(value)
+        if fanout[stage] < 1:
+            raise ValueError(f"Fan-out of {stage} must be at least 1")
+    return fanout
+
+def count_roots(categories_file=CATEGORIES_FILE):
+    return sum(1 for record in read_jsonl(categories_file, fields=["main_category"])
+               if str(record.get("main_category", "")).strip())
+
+class FanoutPlan:
+    """Sizes the generation tree and keeps it within a total LLM call budget.
+
+    calls() projects the instructions each stage will send for the number of root
+    categories and the fan-out per level. With a budget, fit() picks the fan-outs,
+    each at most the requested one, that yield the most contexts without going
+    over; if even a fan-out of 1 everywhere is too much, fewer categories are used.
+    limits() gives each stage its instruction cap, which the stages enforce, so the
+    run stays under the budget even if models return more children than asked for.
+    """
+
+    def __init__(self, roots, fanout=None, budget=None):
+        self.roots = roots
+        self.fanout = dict(fanout or DEFAULT_FANOUT)
+        self.budget = budget
+        if budget is not None:
+            self.fit()
+
+    def calls(self, roots=None, fanout=None):
+        roots = self.roots if roots is None else roots
+        fanout = fanout or self.fanout
+        sub_categories = roots * fanout["sub_categories"]
+        subjects = sub_categories * fanout["subjects"]
+        contexts = subjects * fanout["contexts"]
+        calls = {
+            "sub_categories": roots,
+            "subjects": sub_categories,
+            "contexts": contexts,
+        }
+        for stage in LEAF_STAGES:
+            calls[stage] = contexts
+        return calls
+
+    def total(self, roots=None, fanout=None):
+        return sum(self.calls(roots, fanout).values())
+
+    def fit(self):
+        levels = list(self.fanout)
+        candidates = [
+            dict(zip(levels, values))
+            for values in product(*(range(1, self.fanout[level] + 1) for level in levels))
+        ]
+        fitting = [fanout for fanout in candidates if self.total(fanout=fanout) <= self.budget]
+        if fitting:
+            # Most contexts; on ties the most variety near the root
+            self.fanout = max(
+                fitting,
+                key=lambda fanout: (self.calls(fanout=fanout)["contexts"], tuple(fanout.values()))
+            )
+            return
+        self.fanout = {level: 1 for level in levels}
+        while self.roots > 0 and self.total() > self.budget:
+            self.roots -= 1
+
+    def limits(self):
+        return self.calls()
+
+    def report(self):
+        calls = self.calls()
+        fanout = ", ".join(f"{stage} x{value}" for stage, value in self.fanout.items())
+        print(f"Fan-out plan: {self.roots} categories, {fanout}")
+        for stage, count in calls.items():
+            print(f"  {stage:<16} {count:>8} calls")
+        budget = f" (budget {self.budget})" if self.budget is not None else ""
+        print(f"  {'Total':<16} {self.total():>8} calls{budget}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Project the LLM calls of a pipeline run for a fan-out and budget")
+    parser.add_argument("--fanout", help="e.g. sub_categories=5,subjects=2,contexts=1")
+    parser.add_argument("--budget", type=int, help="Maximum total LLM calls")
+    parser.add_argument("--categories", default=CATEGORIES_FILE, help="Root categories JSONL file")
+    args = parser.parse_args()
+
+    FanoutPlan(count_roots(args.categories), parse_fanout(args.fanout), args.budget).report()
@@ -1,32 +1,129 @@
-import json
+import argparse
+import time
+from functools import partial
+from pathlib import Path
 
-def should_keep_entry(validation_result):
-    # Skip empty validation results
+from jsonl_io import JsonlWriter, read_jsonl
+from parallel import map_ranges, report_throughput
+from predicates import DEFAULT_WHERE, Predicate, parse_json_lenient
+from prevalidate import ACCEPT
+from telemetry import telemetry
+
+INPUT_FILE = "datasets/validations.jsonl"
+OUTPUT_FILE = "datasets/filtered_validations.jsonl"
+
+COUNTERS = ["rows", "kept", "prevalidated", "recovered", "unparsable"]
+
+# Fields of validation_result, which rows accepted by pre-validation don't have
+VALIDATION_FIELDS = {"is_complete", "is_accurate", "format_valid", "missing_fields", "incorrect_fields"}
+
+def check_prevalidated(predicate):
+    """Reject a custom filter that pre-validated rows can't be checked against"""
+    if predicate.expression == DEFAULT_WHERE:
+        return
+    fields = sorted(VALIDATION_FIELDS.intersection(predicate.names))
+    if fields:
+        raise ValueError(
+            f"--where uses {', '.join(fields)}, which rows accepted by --prevalidate have no "
+            f"validation_result for; filter on row fields and prevalidation scores "
+            f"(grounding, key_coverage, null_ratio) only, or run without --prevalidate"
+        )
+
+def keep_prevalidated(entry, predicate):
+    """Pre-validated rows pass the default filter, which their local verdict stands in
+    for; a custom one is evaluated over the row's fields and its prevalidation scores"""
+    if predicate.expression == DEFAULT_WHERE:
+        return True
+    check_prevalidated(predicate)
+    return predicate({**entry, **entry["prevalidation"]})
+
+def parse_validation(validation_result, counts=None):
+    """Parse validation_result, recovering fenced or slightly malformed JSON"""
     if not validation_result:
+        return None
+    validation, recovered = parse_json_lenient(validation_result.strip())
+    if counts is not None:
+        if not isinstance(validation, dict):
+            counts["unparsable"] += 1
+        elif recovered:
+            counts["recovered"] += 1
+    return validation if isinstance(validation, dict) else None
+
+def should_keep_entry(validation_result, predicate=None, entry=None, counts=None):
+    # Skip empty or unparsable validation results
+    validation = parse_validation(validation_result, counts)
+    if validation is None:
         return False
-        
-    try:
-        # Parse the validation_result string into a dictionary
-        validation = json.loads(validation_result.strip())
-        return (validation["is_accurate"] == True and 
-                validation["format_valid"] == True and
-                len(validation["missing_fields"]) == 0 and
-                len(validation["incorrect_fields"]) == 0)
-    except json.JSONDecodeError:
-        # If we can't parse the JSON, skip this entry
-        return False
 
-def filter_validations(input_file, output_file):
-    with open(input_file, 'r') as infile, open(output_file, 'w') as outfile:
-        for line in infile:
-            entry = json.loads(line)
-            
-            # Skip entries that don't have validation_result
-            if "validation_result" not in entry:
-                continue
-                
-            if should_keep_entry(entry["validation_result"]):
-                outfile.write(line)
-
-# Run the filter
-filter_validations('datasets/validations.jsonl', 'datasets/filtered_validations.jsonl') 
\ No newline at end of file
+    # The predicate sees the validation's fields and the row's own (quality_score, ...)
+    fields = {**(entry or {}), **validation}
+    return (predicate or Predicate())(fields)
+
+def kept_lines(input_file, counts, start=0, end=None, where=DEFAULT_WHERE):
+    """Yield the lines worth keeping, counting every row read into counts"""
+    predicate = Predicate(where)
+    # Only the fields the predicate needs are parsed into the record; kept lines are copied as-is
+    fields = ["validation_result", "prevalidation", *predicate.names]
+    for line, entry in read_jsonl(input_file, fields=fields, raw=True, start=start, end=end):
+        counts["rows"] += 1
+        # Rows accepted by the local pre-validation carry its scores instead of a validation
+        if "validation_result" not in entry:
+            if (entry.get("prevalidation") or {}).get("verdict") == ACCEPT and keep_prevalidated(entry, predicate):
+                counts["prevalidated"] += 1
+                counts["kept"] += 1
+                yield line
+            continue
+
+        validation_result = entry.pop("validation_result")
+        if should_keep_entry(validation_result, predicate, entry, counts):
+            counts["kept"] += 1
+            yield line
+
+def filter_range(input_file, start, end, part_file, where=DEFAULT_WHERE):
+    """Worker: filter the lines in one byte range into part_file"""
+    counts = dict.fromkeys(COUNTERS, 0)
+    with open(part_file, 'wb') as outfile:
+        outfile.writelines(kept_lines(input_file, counts, start, end, where))
+    return counts
+
+def filter_validations(input_file, output_file, workers=1, where=DEFAULT_WHERE):
+    """Keep the entries matching where; with workers > 1 byte ranges are filtered in a process pool"""
+    Predicate(where)  # Fail on a bad expression before reading anything
+    start = time.perf_counter()
+    counts = dict.fromkeys(COUNTERS, 0)
+    with JsonlWriter(output_file) as outfile:
+        if workers > 1:
+            # Parts come back in file order, so the output order matches the input
+            worker = partial(filter_range, where=where)
+            for part_file, part_counts in map_ranges(input_file, worker, workers, output_dir=Path(output_file).parent):
+                outfile.copy_from(part_file, part_counts["kept"])
+                for counter in COUNTERS:
+                    counts[counter] += part_counts[counter]
+        else:
+            for line in kept_lines(input_file, counts, where=where):
+                outfile.write_line(line)
+
+    report_throughput(f"Filtered validations, kept {counts['kept']} ({counts['prevalidated']} pre-validated)", counts["rows"],
+                      time.perf_counter() - start, workers)
+    # Counted here rather than per row, so pool workers never touch the telemetry
+    telemetry.count("records_in_total", counts["rows"], stage="filter_validations")
+    telemetry.count("records_out_total", counts["kept"], stage="filter_validations")
+    telemetry.count("records_dropped_total", counts["rows"] - counts["kept"], stage="filter_validations")
+    telemetry.count("validations_recovered_total", counts["recovered"], stage="filter_validations")
+    print(f"Recovered {counts['recovered']} malformed validation results, {counts['unparsable']} unparsable")
+    return counts
+
+def run(input_file=INPUT_FILE, output_file=OUTPUT_FILE, workers=1, where=None):
+    filter_validations(input_file, output_file, workers, where or DEFAULT_WHERE)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Keep only accurate, complete validations")
+    parser.add_argument("--input", default=INPUT_FILE, help="Validations JSONL file")
+    parser.add_argument("--output", default=OUTPUT_FILE, help="Filtered JSONL file")
+    parser.add_argument("--workers", type=int, default=1, help="Filter byte ranges of the input in this many processes")
+    parser.add_argument("--where", default=DEFAULT_WHERE,
+                        help="Keep rows matching this expression over the validation fields and quality_score")
+    args = parser.parse_args()
+
+    # Run the filter
+    run(args.input, args.output, args.workers, args.where)
@@ -0,0 +1,368 @@
+import asyncio
+import hashlib
+import json
+import re
+import time
+from collections import deque
+from itertools import islice
+
+from dria import Prompt, DatasetGenerator, DriaDataset
+
+from checkpoint import instruction_hash
+from jsonl_io import JsonlWriter
+from routing import UsageReport, count_tokens
+from telemetry import telemetry
+
+def render_prompt(template, instruction):
+    """Fill the {{field}} placeholders of a prompt template from an instruction"""
+    return re.sub(
+        r"{{\s*(\w+)\s*}}",
+        lambda match: str(instruction.get(match.group(1), match.group(0))),
+        template
+    )
+
+def answered(pairs):
+    """Number of instructions with at least one record among (instruction, record) pairs"""
+    return len({id(instruction) for instruction, _ in pairs})
+
+def chunked(items, size):
+    """Lazily split any iterable into lists of at most size items"""
+    iterator = iter(items)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+class StageGenerator:
+    """DatasetGenerator for a single stage, fronted by a checkpoint journal and a cache.
+
+    Instructions already in the stage's CheckpointJournal are resumed from it, then
+    the ResponseCache is consulted, and only the rest reach DatasetGenerator.generate.
+
+    A RoutingPolicy narrows the models each instruction may use from its estimated
+    token counts. With a ModelScheduler the rest is split into batches, each routed to
+    a single allowed model picked by the scheduler; otherwise the SDK dispatches
+    across the allowed models. Tokens, cost and latency go to a UsageReport.
+
+    An optional prefilter(instruction) settles instructions locally before any of
+    that: it returns the records to use instead of generating, or None to generate.
+    An optional expand(record) splits a generated record with a list of children
+    into one record per child, and prepare() applies the stage's fan-out variants
+    and instruction limit (see fanout.py) before instructions are generated.
+
+    Records are paired with their instruction by the call that produced them, never
+    by the fields a model echoes back: every instruction is its own generate call on
+    a dataset no other call is using, so the new tail of that dataset's entry list is
+    exactly the instruction's records. Idle datasets are pooled per model selection
+    and a new one is created when all are busy. An instruction that got no record
+    (a failed call, or an item the SDK dropped) is left out of the journal and
+    generated again on the next run.
+    """
+
+    def __init__(self, stage, dataset, prompt_template, schema, models, cache=None, journal=None,
+                 scheduler=None, router=None, usage=None, prefilter=None, expand=None, variants=1,
+                 limit=None):
+        self.stage = stage
+        # Idle (dataset, generator) slots per model selection, see acquire()
+        self.datasets = {self.models_key(models): [self.wrap_dataset(dataset)]}
+        self.slots = {self.models_key(models): 1}
+        self.prompter = Prompt(prompt=prompt_template, schema=schema)
+        self.prompt_template = prompt_template
+        self.schema = schema
+        self.models = models
+        self.cache = cache
+        self.journal = journal
+        self.scheduler = scheduler
+        self.router = router
+        self.prefilter = prefilter
+        self.expand = expand
+        self.variants = variants
+        self.limit = limit
+        self.admitted = 0
+        self.over_limit = 0
+        if journal is not None:
+            journal.bind(self.fingerprint())
+        # A shared report is printed by its owner, a private one by report()
+        self.owns_usage = usage is None
+        self.usage = usage if usage is not None else UsageReport()
+        self.resumed = 0
+        self.processed = 0
+
+    def fingerprint(self):
+        schema = json.dumps(self.schema.model_json_schema(), sort_keys=True)
+        return hashlib.sha256((self.prompt_template + schema).encode("utf-8")).hexdigest()
+
+    def prepare(self, instructions):
+        """Expand each instruction into its variants and drop those over the limit"""
+        if self.variants > 1:
+            instructions = [
+                {**instruction, "variant": variant}
+                for instruction in instructions
+                for variant in range(1, self.variants + 1)
+            ]
+        if self.limit is not None:
+            allowed = max(self.limit - self.admitted, 0)
+            self.over_limit += max(len(instructions) - allowed, 0)
+            instructions = instructions[:allowed]
+        self.admitted += len(instructions)
+        return instructions
+
+    def children(self, record):
+        return self.expand(record) if self.expand is not None else [record]
+
+    def cache_key(self, instruction, models):
+        """Key of an instruction's response from the models routing allowed for it"""
+        rendered = render_prompt(self.prompt_template, instruction)
+        return self.cache.key(rendered, instruction, models, self.schema)
+
+    def route(self, instruction):
+        """The models the routing policy allows for an instruction"""
+        if self.router is None:
+            return self.models
+        return self.router.route(self.stage, self.models, self.input_tokens(instruction))
+
+    def input_tokens(self, instruction):
+        return count_tokens(render_prompt(self.prompt_template, instruction))
+
+    def output_tokens(self, instructions, records):
+        """Tokens of the fields the model produced, leaving out echoed instruction fields"""
+        echoed = {key for instruction in instructions for key in instruction}
+        return sum(
+            count_tokens(str(value))
+            for record in records
+            for key, value in record.items()
+            if key not in echoed
+        )
+
+    @staticmethod
+    def models_key(models):
+        return tuple(str(model) for model in models)
+
+    @staticmethod
+    def wrap_dataset(dataset):
+        dataset = dataset.reset()
+        return dataset, DatasetGenerator(dataset=dataset)
+
+    def acquire(self, models):
+        """An idle dataset for the model selection, or a new one when all are in use"""
+        key = self.models_key(models)
+        idle = self.datasets.setdefault(key, [])
+        if idle:
+            return idle.pop()
+        self.slots[key] = self.slots.get(key, 0) + 1
+        suffix = "" if key == self.models_key(self.models) else "_" + re.sub(r"\W+", "_", "_".join(key))
+        return self.wrap_dataset(DriaDataset(
+            name=f"{self.stage}{suffix}_{self.slots[key]}",
+            description=f"{self.stage} records generated by {', '.join(key)}",
+            schema=self.schema
+        ))
+
+    def release(self, models, slot):
+        self.datasets[self.models_key(models)].append(slot)
+
+    async def generate_one(self, instruction, models):
+        """Records generated for a single instruction, as one llm.generate call.
+
+        The call is tagged with the model that served it: the one the scheduler picked,
+        or the allowed models joined by "|" when the SDK chooses among several.
+        """
+        model = "|".join(self.models_key(models))
+        input_tokens = self.input_tokens(instruction)
+        telemetry.count("llm_calls_total", stage=self.stage, model=model)
+        slot = self.acquire(models)
+        dataset, generator = slot
+        try:
+            with telemetry.span("llm.generate", stage=self.stage, model=model, input_tokens=input_tokens) as span:
+                start = time.perf_counter()
+                # DriaDataset keeps appending, and nothing else writes to this one meanwhile
+                before = len(dataset.get_entries(data_only=True))
+                await generator.generate(
+                    instructions=[instruction],
+                    singletons=self.prompter,
+                    models=models
+                )
+                records = dataset.get_entries(data_only=True)[before:]
+                output_tokens = self.output_tokens([instruction], records)
+                span.set(records=len(records), output_tokens=output_tokens)
+        finally:
+            self.release(models, slot)
+
+        self.usage.record(self.stage, models, 1, input_tokens, output_tokens, time.perf_counter() - start)
+        telemetry.count("llm_tokens_total", input_tokens, stage=self.stage, model=model, direction="input")
+        telemetry.count("llm_tokens_total", output_tokens, stage=self.stage, model=model, direction="output")
+        return records
+
+    async def generate_uncached(self, instructions, models=None):
+        """Generate the instructions and return (instruction, record) pairs.
+
+        Instructions whose call failed are missing from the pairs; the first error
+        is raised only when every call failed, so that it reaches the scheduler.
+        """
+        models = models or self.models
+        results = await asyncio.gather(
+            *(self.generate_one(instruction, models) for instruction in instructions),
+            return_exceptions=True
+        )
+        errors = [result for result in results if isinstance(result, Exception)]
+        if errors and len(errors) == len(results):
+            raise errors[0]
+        return [
+            (instruction, record)
+            for instruction, records in zip(instructions, results)
+            if not isinstance(records, Exception)
+            for record in records
+        ]
+
+    async def generate_scheduled(self, instructions, models=None):
+        """Split instructions into batches and let the scheduler pick a model for each"""
+        async def submit(batch):
+            tokens = sum(self.input_tokens(instruction) for instruction in batch)
+            return await self.scheduler.submit(
+                lambda model: self.generate_uncached(batch, [model]),
+                size=len(batch),
+                tokens=tokens,
+                models=models or self.models,
+                count=answered
+            )
+
+        batches = list(chunked(instructions, self.scheduler.max_in_flight))
+        results = await asyncio.gather(*(submit(batch) for batch in batches))
+        return [pair for pairs in results for pair in pairs]
+
+    async def generate_routed(self, routed):
+        """Group (instruction, allowed models) by the models and generate each group"""
+        groups = {}
+        for instruction, models in routed:
+            groups.setdefault(self.models_key(models), (models, []))[1].append(instruction)
+
+        async def generate_group(models, group):
+            if self.scheduler is not None:
+                return await self.generate_scheduled(group, models)
+            # Without a scheduler the SDK spreads the group over its allowed models
+            return await self.generate_uncached(group, models)
+
+        results = await asyncio.gather(*(generate_group(models, group) for models, group in groups.values()))
+        return [pair for pairs in results for pair in pairs]
+
+    async def generate_pairs(self, instructions):
+        """Generate the instructions and return (instruction, record) pairs.
+
+        Instructions that produced no record have no pair.
+        """
+        pairs, pending = [], []
+        for instruction in instructions:
+            if self.journal is not None and instruction in self.journal:
+                self.resumed += 1
+                telemetry.count("resumed_total", stage=self.stage)
+                pairs.extend((instruction, record) for record in self.journal.get(instruction))
+                continue
+
+            if self.prefilter is not None:
+                settled = self.prefilter(instruction)
+                if settled is not None:
+                    telemetry.count("prefiltered_total", stage=self.stage)
+                    # Rejected instructions settle with no record and aren't journaled
+                    for record in settled:
+                        pairs.append((instruction, record))
+                        if self.journal is not None:
+                            self.journal.append(instruction, record)
+                    continue
+
+            models = self.route(instruction)
+            cached = None
+            if self.cache is not None:
+                cached = self.cache.get(self.cache_key(instruction, models))
+            if cached is not None:
+                telemetry.count("cache_hits_total", stage=self.stage)
+                for child in self.children(cached):
+                    pairs.append((instruction, child))
+                    if self.journal is not None:
+                        self.journal.append(instruction, child)
+            else:
+                pending.append((instruction, models))
+
+        if pending:
+            routed = {id(instruction): models for instruction, models in pending}
+            generated = await self.generate_routed(pending)
+            for instruction, record in generated:
+                # The cache keeps the raw response, the journal and output its children
+                if self.cache is not None:
+                    self.cache.put(self.cache_key(instruction, routed[id(instruction)]), self.stage, record)
+                for child in self.children(record):
+                    if self.journal is not None:
+                        self.journal.append(instruction, child)
+                    pairs.append((instruction, child))
+
+        done = {id(instruction) for instruction, _ in pairs}
+        telemetry.count("records_in_total", len(instructions), stage=self.stage)
+        telemetry.count("records_out_total", len(pairs), stage=self.stage)
+        telemetry.count("records_dropped_total", sum(id(instruction) not in done for instruction in instructions),
+                        stage=self.stage)
+        return pairs
+
+    async def generate(self, instructions):
+        """Generate records for the instructions, skipping journaled and cached ones"""
+        return [record for _, record in await self.generate_pairs(instructions)]
+
+    async def run(self, instructions, output_file, chunk_size=32, max_chunks=4):
+        """Generate a whole stage and export it to output_file.
+
+        instructions may be a lazy iterable; it is consumed in chunks so completed
+        records reach the journal while the stage is still running, and only the
+        instruction hashes are kept. Up to max_chunks chunks are generated at once,
+        so the next chunks' calls are already running while one is finishing. Chunks
+        complete in order. With a journal the output is rebuilt from it in
+        instruction order, which also drops records of instructions no longer present.
+        """
+        pending = deque()
+        try:
+            keys = []
+            with JsonlWriter(output_file) as writer:
+                async def finish_oldest():
+                    pairs = await pending.popleft()
+                    if self.journal is None:
+                        writer.write_all(record for _, record in pairs)
+
+                for chunk in chunked(instructions, chunk_size):
+                    chunk = self.prepare(chunk)
+                    if not chunk:
+                        continue
+                    self.processed += len(chunk)
+                    if self.journal is not None:
+                        keys.extend(instruction_hash(instruction) for instruction in chunk)
+                    pending.append(asyncio.ensure_future(self.generate_pairs(chunk)))
+                    if len(pending) >= max_chunks:
+                        await finish_oldest()
+                while pending:
+                    await finish_oldest()
+                if self.journal is not None:
+                    writer.write_all(self.journal.records(keys))
+            if self.journal is not None:
+                self.journal.compact(keys)
+        finally:
+            for task in pending:
+                task.cancel()
+            self.report()
+            self.close()
+
+    def report(self):
+        print(f"Processed {self.processed} instructions")
+        if self.over_limit:
+            print(f"Skipped {self.over_limit} instructions over the stage limit of {self.limit}")
+        if self.prefilter is not None:
+            self.prefilter.report()
+        if self.journal is not None:
+            print(f"Resumed {self.resumed} instructions from checkpoint")
+        if self.cache is not None:
+            print(f"Cache hits: {self.cache.hits}, misses: {self.cache.misses}")
+        if self.owns_usage:
+            self.usage.report()
+
+    def close(self):
+        if self.prefilter is not None:
+            self.prefilter.close()
+        if self.journal is not None:
+            self.journal.close()
+        if self.cache is not None:
+            self.cache.close()
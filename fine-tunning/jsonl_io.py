@@ -0,0 +1,157 @@
+import json
+import os
+import shutil
+from pathlib import Path
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+BUFFER_SIZE = 1 << 20
+
+def loads(data):
+    """Parse one JSON document from str or bytes"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def dumps(record):
+    """Serialize a record to a single-line JSON string"""
+    if orjson is not None:
+        return orjson.dumps(record).decode("utf-8")
+    return json.dumps(record)
+
+def project(record, fields):
+    if not isinstance(record, dict):
+        return record
+    return {field: record[field] for field in fields if field in record}
+
+def read_jsonl(path, fields=None, raw=False, start=0, end=None):
+    """Lazily yield the records of a JSONL file, one line at a time.
+
+    With fields only those keys are kept, so large unused values (contexts,
+    validation results, ...) are dropped as soon as a line is parsed. With raw the
+    original line is yielded alongside the record, for filters that copy lines
+    through unchanged. Blank lines are skipped. start and end restrict reading to
+    the lines starting in that byte range (see parallel.byte_ranges).
+    """
+    with open(path, 'rb', buffering=BUFFER_SIZE) as file:
+        file.seek(start)
+        position = start
+        for line in file:
+            if end is not None and position >= end:
+                break
+            position += len(line)
+            if not line.strip():
+                continue
+            record = loads(line)
+            if fields is not None:
+                record = project(record, fields)
+            if raw:
+                yield line if line.endswith(b"\n") else line + b"\n", record
+            else:
+                yield record
+
+class AtomicWriter:
+    """Buffered writer that only replaces the target file once writing succeeded.
+
+    Output goes to a temporary file next to the target and is moved into place on
+    close, so readers (and the pipeline's output checks) never see a half-written
+    file. If an exception leaves the with block the temporary file is discarded.
+    """
+
+    def __init__(self, path, mode='wb'):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.tmp_path = self.path.with_name(f".{self.path.name}.tmp")
+        self.file = open(self.tmp_path, mode, buffering=BUFFER_SIZE)
+        self.count = 0
+
+    def close(self):
+        self.file.close()
+        os.replace(self.tmp_path, self.path)
+
+    def discard(self):
+        self.file.close()
+        self.tmp_path.unlink(missing_ok=True)
+
+    def copy_from(self, path, count):
+        """Append a file of already serialized output holding count items"""
+        with open(path, 'rb' if 'b' in self.file.mode else 'r') as part:
+            shutil.copyfileobj(part, self.file, BUFFER_SIZE)
+        self.count += count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+class JsonlWriter(AtomicWriter):
+    """Atomic, buffered JSONL writer"""
+
+    def write(self, record):
+        self.file.write(dumps(record).encode("utf-8") + b"\n")
+        self.count += 1
+
+    def write_line(self, line):
+        """Copy an already serialized line, e.g. one yielded by read_jsonl(raw=True)"""
+        self.file.write(line)
+        self.count += 1
+
+    def write_all(self, records):
+        for record in records:
+            self.write(record)
+        return self
+
+class JsonArrayWriter(AtomicWriter):
+    """Atomic writer of a JSON array, one element at a time.
+
+    The output matches json.dump(items, indent=indent) without holding the items
+    in memory.
+    """
+
+    def __init__(self, path, indent=None):
+        super().__init__(path, mode='w')
+        self.indent = indent
+        self.file.write("[")
+
+    def write(self, item):
+        element = array_element(item, self.indent)
+        # The first element of the array has no separator
+        self.file.write(element if self.count else element.lstrip(", "))
+        self.count += 1
+
+    def copy_from(self, path, count):
+        """Append elements serialized by array_element, e.g. by worker processes"""
+        with open(path, 'r') as part:
+            if not self.count:
+                # The first element of the array has no separator
+                part.read(1 if self.indent is not None else 2)
+            shutil.copyfileobj(part, self.file, BUFFER_SIZE)
+        self.count += count
+
+    def close(self):
+        if self.indent is not None and self.count:
+            self.file.write("\n")
+        self.file.write("]")
+        super().close()
+
+def array_element(item, indent=None):
+    """One element of a JSON array as JsonArrayWriter writes it, after a comma"""
+    if indent is None:
+        return f", {json.dumps(item)}"
+    # Indent every line of the element by one level to nest it in the array
+    pad = " " * indent
+    element = json.dumps(item, indent=indent).replace("\n", "\n" + pad)
+    return f",\n{pad}{element}"
+
+def write_jsonl(records, path):
+    """Write records to a JSONL file atomically and return how many were written"""
+    with JsonlWriter(path) as writer:
+        writer.write_all(records)
+    return writer.count
@@ -0,0 +1,322 @@
+import argparse
+import json
+import math
+import os
+import random
+import re
+from functools import lru_cache
+
+from filter_validations import parse_validation
+from jsonl_io import read_jsonl, write_jsonl
+from predicates import DEFAULT_WHERE, Predicate, parse_json_lenient
+from prevalidate import is_null, leaves, normalize, terms
+
+CALIBRATION_FILE = "datasets/validations.jsonl"
+INPUT_FILE = "datasets/extractions.jsonl"
+OUTPUT_FILE = "datasets/validated_extractions_0.jsonl"
+WEIGHTS_FILE = "datasets/local_scorer.json"
+
+NGRAM = 5
+FEATURES = ["json_clean", "json_recovered", "values", "null_ratio", "grounding", "exact", "numbers", "key_coverage"]
+NUMBER = re.compile(r"\d+(?:\.\d+)?")
+# Quoted values of extractions written as loose key: "value" text instead of JSON
+QUOTED = re.compile(r"\"([^\"]{2,})\"|'([^']{2,})'")
+MIN_SUPPORT = 10
+
+# Direction every feature may push the score: a better extraction never scores lower
+SIGNS = {name: -1 if name == "null_ratio" else 1 for name in FEATURES}
+# A calibrated model is only written when its held-out AUC reaches this and its
+# settled rows agree with the LLM at least --precision of the time
+MIN_AUC = 0.75
+
+@lru_cache(maxsize=1024)
+def context_grams(context):
+    """Character n-grams of a normalized context, built once per context"""
+    text = normalize(context)
+    return frozenset(text[i:i + NGRAM] for i in range(len(text) - NGRAM + 1)), text
+
+def overlap(value, context):
+    """(fraction of the value's character n-grams found in the context, exact match)"""
+    grams, text = context_grams(context)
+    value = normalize(value if isinstance(value, str) else json.dumps(value))
+    exact = value in text
+    if len(value) < NGRAM:
+        return float(exact), exact
+    value_grams = {value[i:i + NGRAM] for i in range(len(value) - NGRAM + 1)}
+    return len(value_grams & grams) / len(value_grams), exact
+
+def features(extraction):
+    """Cheap features of one extraction, each in 0-1"""
+    parsed, recovered = parse_json_lenient(extraction["extracted_info"])
+    row = dict.fromkeys(FEATURES, 0.0)
+    if parsed is None or isinstance(parsed, str):
+        # Not JSON: its quoted strings are still the values to look for in the context
+        pairs = [("", first or second) for first, second in QUOTED.findall(str(extraction["extracted_info"]))]
+    else:
+        row["json_clean"] = float(not recovered)
+        row["json_recovered"] = float(recovered)
+        pairs = list(leaves(parsed))
+
+    numbers = NUMBER.findall(str(extraction["extracted_info"]))
+    row["numbers"] = sum(number in extraction["context"] for number in numbers) / len(numbers) if numbers else 1.0
+    values = [value for _, value in pairs if not is_null(value)]
+    if pairs:
+        row["null_ratio"] = 1 - len(values) / len(pairs)
+    if values:
+        # Saturates around 20 values so long lists don't dominate
+        row["values"] = min(math.log1p(len(values)) / math.log1p(20), 1.0)
+        overlaps = [overlap(value, extraction["context"]) for value in values]
+        row["grounding"] = sum(fraction for fraction, _ in overlaps) / len(overlaps)
+        row["exact"] = sum(exact for _, exact in overlaps) / len(overlaps)
+
+    description_terms = terms(extraction.get("description", ""))
+    key_terms = set().union(*(terms(path) for path, _ in pairs)) if pairs else set()
+    row["key_coverage"] = len(description_terms & key_terms) / len(description_terms) if description_terms else 1.0
+    return row
+
+def sigmoid(z):
+    return 1 / (1 + math.exp(-max(min(z, 30), -30)))
+
+def predict(model, row):
+    return sigmoid(model["bias"] + sum(model["weights"][name] * row[name] for name in FEATURES))
+
+def fit(rows, targets, iterations=1000, rate=1.0, l2=0.01):
+    """Logistic regression on soft 0-1 targets by projected gradient descent.
+
+    Each weight is kept on the side of zero given by SIGNS, so correlated features
+    can't cancel out into one that rewards worse extractions.
+    """
+    bias, weights = 0.0, dict.fromkeys(FEATURES, 0.0)
+    count = len(rows)
+    for _ in range(iterations):
+        grad_bias, grad = 0.0, dict.fromkeys(FEATURES, 0.0)
+        for row, target in zip(rows, targets):
+            error = sigmoid(bias + sum(weights[name] * row[name] for name in FEATURES)) - target
+            grad_bias += error
+            for name in FEATURES:
+                grad[name] += error * row[name]
+        bias -= rate * grad_bias / count
+        for name in FEATURES:
+            weight = weights[name] - rate * (grad[name] / count + l2 * weights[name])
+            weights[name] = max(weight * SIGNS[name], 0.0) * SIGNS[name]
+    return {"bias": round(bias, 3), "weights": {name: round(value, 3) for name, value in weights.items()}}
+
+def llm_target(record, predicate):
+    """(score, accepted) the LLM gave a row: its quality_score when there is one,
+    else the share of is_complete/is_accurate/format_valid; accepted is the filter verdict"""
+    validation = parse_validation(record.get("validation_result")) or {}
+    accepted = predicate({**record, **validation}) if validation else False
+    if "quality_score" in record:
+        return float(record["quality_score"]), accepted
+    checks = [bool(validation.get(key)) for key in ("is_complete", "is_accurate", "format_valid")]
+    return sum(checks) / len(checks), accepted
+
+def rank(values):
+    order = sorted(range(len(values)), key=values.__getitem__)
+    ranks = [0.0] * len(values)
+    position = 0
+    while position < len(order):
+        end = position
+        while end + 1 < len(order) and values[order[end + 1]] == values[order[position]]:
+            end += 1
+        for index in order[position:end + 1]:
+            ranks[index] = (position + end) / 2
+        position = end + 1
+    return ranks
+
+def pearson(xs, ys):
+    mean_x, mean_y = sum(xs) / len(xs), sum(ys) / len(ys)
+    cov = sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys))
+    norm = math.sqrt(sum((x - mean_x) ** 2 for x in xs) * sum((y - mean_y) ** 2 for y in ys))
+    return cov / norm if norm else 0.0
+
+def auc(scores, labels):
+    """Probability that an accepted row outscores a rejected one"""
+    ranks = rank(scores)
+    positives = sum(labels)
+    negatives = len(labels) - positives
+    if not positives or not negatives:
+        return float("nan")
+    return (sum(r for r, label in zip(ranks, labels) if label) - positives * (positives - 1) / 2) / (positives * negatives)
+
+def thresholds(scores, labels, precision=0.85, min_support=MIN_SUPPORT):
+    """(low, high): rows scoring at least high are accepted by the LLM, and rows below
+    low rejected, in at least precision of the calibration rows; in between is escalated.
+    Each side needs min_support rows, otherwise it is closed (everything escalates)."""
+    pairs = sorted(zip(scores, labels))
+    high = 1.01
+    for index in range(len(pairs) - min_support + 1):
+        above = [label for _, label in pairs[index:]]
+        if sum(above) / len(above) >= precision:
+            high = pairs[index][0]
+            break
+    low = 0.0
+    for index in range(len(pairs), min_support - 1, -1):
+        below = [label for _, label in pairs[:index]]
+        if below.count(False) / len(below) >= precision:
+            low = pairs[index - 1][0] + 1e-6
+            break
+    return round(min(low, high), 4), round(high, 4)
+
+def agreement(scores, targets, labels, decisions):
+    """How well local scores agree with the LLM's; decisions are True (accept), False
+    (reject) or None (escalated) for each row"""
+    settled = [(decision, label) for decision, label in zip(decisions, labels) if decision is not None]
+    return {
+        "rows": len(scores),
+        "pearson": round(pearson(scores, targets), 3),
+        "spearman": round(pearson(rank(scores), rank(targets)), 3),
+        "mae": round(sum(abs(s - t) for s, t in zip(scores, targets)) / len(scores), 3),
+        "auc": round(auc(scores, labels), 3),
+        "confident": round(len(settled) / len(scores), 3),
+        "confident_agreement": round(sum(d == l for d, l in settled) / len(settled), 3) if settled else None,
+    }
+
+def decide(score, low, high):
+    return True if score >= high else False if score < low else None
+
+def calibrate(input_file=CALIBRATION_FILE, weights_file=WEIGHTS_FILE, folds=5, precision=0.85, where=DEFAULT_WHERE,
+              min_auc=MIN_AUC, seed=0):
+    """Fit the scorer to the LLM judgments in input_file and report agreement.
+
+    Agreement is measured out of fold: each row is scored by a model fitted on the
+    other folds, with the escalation band chosen on those folds too, so the numbers
+    reflect rows the scorer hasn't seen. The model is only written to weights_file
+    when the held-out AUC reaches min_auc and the settled rows agree with the LLM at
+    least precision of the time.
+    """
+    predicate = Predicate(where)
+    records = [record for record in read_jsonl(input_file) if "extracted_info" in record and "context" in record]
+    rows = [features(record) for record in records]
+    targets, labels = zip(*(llm_target(record, predicate) for record in records))
+
+    order = list(range(len(rows)))
+    random.Random(seed).shuffle(order)
+    held_out = [0.0] * len(rows)
+    decisions = [None] * len(rows)
+    for fold in range(folds):
+        test = set(order[fold::folds])
+        train = [index for index in order if index not in test]
+        model = fit([rows[index] for index in train], [targets[index] for index in train])
+        low, high = thresholds([predict(model, rows[index]) for index in train], [labels[index] for index in train], precision)
+        for index in test:
+            held_out[index] = predict(model, rows[index])
+            decisions[index] = decide(held_out[index], low, high)
+
+    model = fit(rows, targets)
+    model["low"], model["high"] = thresholds([predict(model, row) for row in rows], labels, precision)
+    model["where"] = where
+    model["metrics"] = agreement(held_out, targets, labels, decisions)
+
+    metrics = model["metrics"]
+    print(f"Calibrated on {len(rows)} rows of {input_file} ({folds}-fold held-out agreement):")
+    print(
+        f"  pearson {metrics['pearson']}, spearman {metrics['spearman']}, MAE {metrics['mae']}, "
+        f"AUC {metrics['auc']} for the LLM's accept/reject"
+    )
+    print(
+        f"  {metrics['confident']:.0%} of rows settled without the LLM, agreeing with it on "
+        f"{metrics['confident_agreement']}; scores in [{model['low']}, {model['high']}) are escalated"
+    )
+    if not (metrics["auc"] >= min_auc and (metrics["confident_agreement"] or 0) >= precision):
+        print(f"❌ Not written: needs AUC >= {min_auc} and agreement >= {precision} on held-out rows")
+        return None
+
+    os.makedirs(os.path.dirname(weights_file) or ".", exist_ok=True)
+    with open(weights_file, 'w') as file:
+        json.dump(model, file, indent=2)
+    print(f"✅ Weights written to {weights_file}")
+    return model
+
+def load_model(weights_file=WEIGHTS_FILE):
+    """The calibrated model in weights_file, or None when there is none"""
+    if weights_file and os.path.exists(weights_file):
+        with open(weights_file) as file:
+            return json.load(file)
+    return None
+
+class LocalScorer:
+    """Scores extractions locally; only low-confidence rows need the LLM. Experimental.
+
+    The score is the model's estimate of the LLM's quality_score, which it was
+    fitted to. As a StageGenerator prefilter it settles rows scoring at least high
+    with an EntryScore record, drops rows scoring below low, and returns None for
+    the rest, which are escalated to the LLM scorer. Dropped rows get no score, so
+    they can't slip through a quality_score filter. Without a calibrated model
+    every row is escalated.
+    """
+
+    def __init__(self, weights_file=WEIGHTS_FILE, escalate=True):
+        self.model = load_model(weights_file)
+        self.escalate = escalate
+        self.counts = {"local": 0, "rejected": 0, "escalated": 0}
+        print("Local scoring is experimental: features are computed row by row in pure Python and "
+              "no calibration in this repo has passed the AUC gate yet")
+        if self.model is None:
+            print(f"❌ No calibrated local scorer in {weights_file} (see `python local_scorer.py calibrate`); "
+                  f"every row goes to the LLM")
+
+    def score(self, extraction):
+        return round(predict(self.model, features(extraction)), 3)
+
+    def __call__(self, extraction):
+        if self.model is None:
+            self.counts["escalated"] += 1
+            return None
+        score = self.score(extraction)
+        decision = decide(score, self.model["low"], self.model["high"])
+        if decision is None and self.escalate:
+            self.counts["escalated"] += 1
+            return None
+        if decision is False:
+            self.counts["rejected"] += 1
+            return []
+        self.counts["local"] += 1
+        return [{
+            "subject": extraction["subject"],
+            "context": extraction["context"],
+            "extracted_info": extraction["extracted_info"],
+            "quality_score": score,
+        }]
+
+    def report(self):
+        total = sum(self.counts.values())
+        print(
+            f"Local scoring: {self.counts['local']} scored locally, {self.counts['rejected']} rejected, "
+            f"{self.counts['escalated']} escalated to the LLM; "
+            f"saved {self.counts['local'] + self.counts['rejected']}/{total} LLM calls"
+        )
+
+    def close(self):
+        pass
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Score extractions locally instead of with an LLM (experimental)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    calibrate_parser = commands.add_parser("calibrate", help="Fit the scorer to LLM validations and report agreement")
+    calibrate_parser.add_argument("--input", default=CALIBRATION_FILE, help="Validations JSONL with validation_result or quality_score")
+    calibrate_parser.add_argument("--weights", default=WEIGHTS_FILE, help="Where to write the calibrated model")
+    calibrate_parser.add_argument("--precision", type=float, default=0.85,
+                                  help="Required agreement with the LLM for rows scored without escalation")
+    calibrate_parser.add_argument("--where", default=DEFAULT_WHERE, help="Expression for the LLM accepting a row")
+    calibrate_parser.add_argument("--min-auc", type=float, default=MIN_AUC,
+                                  help="Held-out AUC the model needs before it is written")
+
+    score_parser = commands.add_parser(
+        "score", help="Score extractions locally without escalation; rows below the uncertain band are dropped"
+    )
+    score_parser.add_argument("--input", default=INPUT_FILE, help="Extractions JSONL file")
+    score_parser.add_argument("--output", default=OUTPUT_FILE, help="EntryScore JSONL file")
+    score_parser.add_argument("--weights", default=WEIGHTS_FILE, help="Calibrated model")
+    args = parser.parse_args()
+
+    if args.command == "calibrate":
+        calibrate(args.input, args.weights, precision=args.precision, where=args.where, min_auc=args.min_auc)
+    else:
+        scorer = LocalScorer(args.weights, escalate=False)
+        if scorer.model is None:
+            raise SystemExit(1)
+        count = write_jsonl((row for extraction in read_jsonl(args.input) for row in scorer(extraction)), args.output)
+        print(f"✅ Scored {count} extractions locally into {args.output}, "
+              f"dropped {scorer.counts['rejected']} below the uncertain band")
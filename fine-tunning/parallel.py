@@ -0,0 +1,57 @@
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+# Target bytes per range; several ranges per worker keep the pool balanced when
+# some parts of the file filter or format slower than others
+CHUNK_BYTES = 32 << 20
+
+def byte_ranges(path, parts):
+    """Split a file into at most parts (start, end) byte ranges on line boundaries"""
+    size = os.path.getsize(path)
+    bounds = [0]
+    with open(path, 'rb') as file:
+        for part in range(1, parts):
+            # Move each cut to the start of the next line
+            file.seek(max(size * part // parts - 1, bounds[-1]))
+            file.readline()
+            position = min(file.tell(), size)
+            if position > bounds[-1]:
+                bounds.append(position)
+    if bounds[-1] < size:
+        bounds.append(size)
+    return list(zip(bounds, bounds[1:]))
+
+def default_workers():
+    return os.cpu_count() or 1
+
+def map_ranges(input_file, worker, workers=None, chunk_bytes=CHUNK_BYTES, output_dir=None):
+    """Run worker(input_file, start, end, part_file) over byte ranges in a process pool.
+
+    Each call handles the lines starting in its range, writes its output to its own
+    part file and returns its row counts. Results are yielded as (part_file, counts)
+    in file order, so copying the parts one after another preserves the input
+    order. Part files live in a temporary directory next to the output and are
+    removed once the consumer has moved past them.
+    """
+    workers = workers or default_workers()
+    parts = max(workers, -(-os.path.getsize(input_file) // chunk_bytes))
+    ranges = byte_ranges(input_file, parts)
+    if not ranges:
+        return
+    with tempfile.TemporaryDirectory(dir=output_dir, prefix=".parts-") as directory:
+        part_files = [str(Path(directory) / f"{index:05d}.part") for index in range(len(ranges))]
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = executor.map(
+                worker,
+                *zip(*((input_file, start, end, part_file) for (start, end), part_file in zip(ranges, part_files)))
+            )
+            for part_file, counts in zip(part_files, results):
+                yield part_file, counts
+                os.remove(part_file)
+
+def report_throughput(label, rows, elapsed, workers=1):
+    rate = rows / elapsed if elapsed > 0 else float("inf")
+    mode = f" with {workers} workers" if workers > 1 else ""
+    print(f"{label}: {rows} rows in {elapsed:.2f}s ({rate:,.0f} rows/sec{mode})")
@@ -0,0 +1,141 @@
+import ast
+import io
+import json
+import re
+import tokenize
+
+from jsonl_io import loads
+
+# Filter applied to validations unless another --where is given; the same checks
+# filter_validations.py has always made
+DEFAULT_WHERE = "is_accurate and format_valid and len(missing_fields) == 0 and len(incorrect_fields) == 0"
+
+FENCE = re.compile(r"```[ \t]*(?:json|JSON)?[ \t]*\n?(.*?)```", re.S)
+TRAILING_COMMA = re.compile(r",(\s*[}\]])")
+PYTHON_LITERALS = {"True": "true", "False": "false", "None": "null"}
+
+def outside_strings(text, replace):
+    """Apply replace to the parts of JSON-ish text that aren't inside string literals"""
+    parts = re.split(r'("(?:[^"\\]|\\.)*")', text)
+    return "".join(part if index % 2 else replace(part) for index, part in enumerate(parts))
+
+def outermost_object(text):
+    """The span from the first { or [ to the matching last } or ], if any"""
+    start = min((index for index in (text.find("{"), text.find("[")) if index != -1), default=-1)
+    if start == -1:
+        return None
+    end = text.rfind("}" if text[start] == "{" else "]")
+    return text[start:end + 1] if end > start else None
+
+def repair(text):
+    """Fix the usual slips of model-written JSON: trailing commas and Python literals"""
+    def fix(part):
+        part = TRAILING_COMMA.sub(r"\1", part)
+        return re.sub(r"\b(True|False|None)\b", lambda match: PYTHON_LITERALS[match.group(1)], part)
+    return outside_strings(text, fix)
+
+def parse_json_lenient(text):
+    """Parse JSON a model wrote, returning (value, recovered) or (None, False).
+
+    Clean JSON takes the fast path. Otherwise the JSON is recovered from code
+    fences or surrounding prose, trailing commas and True/False/None are repaired,
+    and as a last resort the text is read as a Python literal (single quotes).
+    recovered tells whether any of that was needed.
+    """
+    if not isinstance(text, str):
+        return text, False
+    try:
+        return loads(text), False
+    except ValueError:
+        pass
+
+    fenced = FENCE.search(text)
+    candidate = outermost_object(fenced.group(1) if fenced else text)
+    if candidate is None:
+        return None, False
+    for attempt in (candidate, repair(candidate)):
+        try:
+            return loads(attempt), True
+        except ValueError:
+            pass
+    try:
+        value = ast.literal_eval(candidate)
+    except (ValueError, TypeError, SyntaxError, MemoryError, RecursionError):
+        return None, False
+    # Round-trip so the value only holds JSON types
+    try:
+        return json.loads(json.dumps(value)), True
+    except (TypeError, ValueError):
+        return None, False
+
+# Functions a predicate may call
+FUNCTIONS = {
+    "len": len,
+    "abs": abs,
+    "min": min,
+    "max": max,
+    "float": float,
+    "int": int,
+    "bool": bool,
+    "str": str,
+    "lower": lambda value: str(value).lower(),
+}
+
+ALLOWED_NODES = (
+    ast.Expression, ast.BoolOp, ast.And, ast.Or, ast.UnaryOp, ast.Not, ast.USub, ast.UAdd,
+    ast.Compare, ast.Eq, ast.NotEq, ast.Lt, ast.LtE, ast.Gt, ast.GtE, ast.In, ast.NotIn,
+    ast.Is, ast.IsNot, ast.BinOp, ast.Add, ast.Sub, ast.Mult, ast.Div, ast.Mod,
+    ast.Name, ast.Load, ast.Constant, ast.Call, ast.List, ast.Tuple, ast.Subscript,
+)
+
+class Fields(dict):
+    """Predicate namespace: unknown names are None instead of an error"""
+
+    def __missing__(self, name):
+        return None
+
+class Predicate:
+    """A filter expression over validation rows, e.g.
+
+        is_accurate & format_valid & len(missing_fields) == 0 & quality_score >= 0.7
+
+    Names are the keys of the parsed validation_result and the row's own fields
+    (quality_score in combined mode, subject, ...). Supported are comparisons,
+    and/or/not (also written &, |, ~), arithmetic, constants, indexing and the
+    calls in FUNCTIONS. Expressions are checked against a whitelist of syntax
+    and compiled once, so evaluating a row costs one eval of the code object.
+    A row whose evaluation fails (e.g. comparing a missing field) doesn't match.
+    """
+
+    def __init__(self, expression=DEFAULT_WHERE):
+        self.expression = expression
+        tree = ast.parse(self.normalize(expression), mode="eval")
+        for node in ast.walk(tree):
+            if not isinstance(node, ALLOWED_NODES):
+                raise ValueError(f"Unsupported syntax in predicate: {type(node).__name__}")
+            if isinstance(node, ast.Call) and not (isinstance(node.func, ast.Name) and node.func.id in FUNCTIONS):
+                raise ValueError(f"Only {', '.join(FUNCTIONS)} can be called in a predicate")
+        self.code = compile(tree, "<predicate>", "eval")
+        self.names = sorted(
+            {node.id for node in ast.walk(tree) if isinstance(node, ast.Name)} - set(FUNCTIONS)
+        )
+
+    @staticmethod
+    def normalize(expression):
+        """Read &, | and ~ as and, or and not, with their usual low precedence"""
+        words = {"&": "and", "|": "or", "~": "not"}
+        tokens = [
+            (tokenize.NAME, words[token.string]) if token.type == tokenize.OP and token.string in words
+            else (token.type, token.string)
+            for token in tokenize.generate_tokens(io.StringIO(expression).readline)
+        ]
+        return tokenize.untokenize(tokens)
+
+    def __call__(self, fields):
+        try:
+            return bool(eval(self.code, {"__builtins__": {}}, Fields(FUNCTIONS, **fields)))
+        except Exception:
+            return False
+
+    def __repr__(self):
+        return f"Predicate({self.expression!r})"
@@ -0,0 +1,181 @@
+import argparse
+import json
+import re
+from difflib import SequenceMatcher
+
+from jsonl_io import read_jsonl
+from predicates import parse_json_lenient
+
+try:
+    from rapidfuzz import fuzz
+except ImportError:
+    fuzz = None
+
+INPUT_FILE = "datasets/extractions.jsonl"
+REJECTS_FILE = "datasets/prevalidation_rejects.jsonl"
+
+ACCEPT = "accept"
+REJECT = "reject"
+AMBIGUOUS = "ambiguous"
+
+NULL_VALUES = {"", "null", "none", "n/a", "not available", "not mentioned"}
+
+STOPWORDS = {
+    "about", "also", "and", "any", "are", "based", "been", "data", "details", "each",
+    "extract", "extraction", "extracted", "focus", "focusing", "from", "have", "including",
+    "information", "into", "key", "like", "more", "such", "than", "that", "the", "their",
+    "these", "this", "those", "through", "values", "various", "what", "which", "will",
+    "with", "within", "document", "related", "relevant", "regarding", "should", "task",
+}
+
+def leaves(value, path=""):
+    """Yield (key path, scalar) pairs of a parsed JSON value"""
+    if isinstance(value, dict):
+        for key, item in value.items():
+            yield from leaves(item, f"{path}.{key}" if path else str(key))
+    elif isinstance(value, list):
+        for item in value:
+            yield from leaves(item, path)
+    else:
+        yield path, value
+
+def is_null(value):
+    return value is None or (isinstance(value, str) and value.strip().lower() in NULL_VALUES)
+
+def terms(text):
+    """Content words of a description or key, stemmed to their first five letters"""
+    words = re.findall(r"[a-z]+", re.sub(r"([a-z])([A-Z])", r"\1 \2", text).lower().replace("_", " "))
+    return {word[:5] for word in words if len(word) > 3 and word not in STOPWORDS}
+
+def normalize(text):
+    return re.sub(r"\s+", " ", str(text)).strip().lower()
+
+def similarity(value, context):
+    """Best partial match of value inside context, 0-1"""
+    if fuzz is not None:
+        return fuzz.partial_ratio(value, context) / 100
+    match = SequenceMatcher(None, value, context, autojunk=False).find_longest_match(0, len(value), 0, len(context))
+    return match.size / len(value)
+
+class Prevalidator:
+    """Cheap local checks run before the LLM validator.
+
+    Rows are rejected when extracted_info holds only null values, and accepted when
+    nearly every extracted value appears in the context and the keys cover the
+    fields named in the description. Everything in between is ambiguous and still
+    goes to the LLM, including extracted_info with no JSON to recover: the
+    extraction prompt often answers in prose, which the LLM validator may accept.
+    Rejecting poorly grounded rows as well is opt-in through reject_grounding, since
+    the LLM validator often accepts paraphrased values.
+
+    Accepted rows keep their local scores under "prevalidation" rather than a
+    validation_result, so they can't be mistaken for an LLM verdict.
+    """
+
+    def __init__(self, accept_grounding=0.9, accept_coverage=0.5, reject_grounding=None,
+                 fuzzy_threshold=0.85, rejects_file=REJECTS_FILE):
+        self.accept_grounding = accept_grounding
+        self.accept_coverage = accept_coverage
+        self.reject_grounding = reject_grounding
+        self.fuzzy_threshold = fuzzy_threshold
+        self.rejects_file = rejects_file
+        self.rejects = open(rejects_file, 'w') if rejects_file else None
+        self.counts = {ACCEPT: 0, REJECT: 0, AMBIGUOUS: 0}
+
+    def grounded(self, values, context):
+        """Which values occur in the context, literally or as a close fuzzy match.
+
+        Long free-text values are usually paraphrased, so they count as grounded when
+        most of their words appear in the context.
+        """
+        context = normalize(context)
+        context_words = set(re.findall(r"\w+", context))
+        found = []
+        for value in values:
+            if not isinstance(value, str):
+                # Numbers and booleans: compare their text form
+                value = json.dumps(value)
+            value = normalize(value)
+            words = re.findall(r"\w+", value)
+            if len(words) > 4:
+                found.append(sum(word in context_words for word in words) / len(words) >= self.fuzzy_threshold)
+            else:
+                found.append(value in context or similarity(value, context) >= self.fuzzy_threshold)
+        return found
+
+    def check(self, extraction):
+        """Return (verdict, details) for one extraction"""
+        parsed, recovered = parse_json_lenient(extraction["extracted_info"])
+        if parsed is None:
+            return AMBIGUOUS, {"reason": "extracted_info holds no JSON"}
+
+        pairs = list(leaves(parsed))
+        values = [value for _, value in pairs if not is_null(value)]
+        if not values:
+            return REJECT, {"reason": "extracted_info is empty or all null"}
+
+        found = self.grounded(values, extraction["context"])
+        grounding = sum(found) / len(found)
+
+        description_terms = terms(extraction["description"])
+        key_terms = set().union(*(terms(path) for path, _ in pairs))
+        coverage = len(description_terms & key_terms) / len(description_terms) if description_terms else 1.0
+
+        details = {
+            "grounding": round(grounding, 3),
+            "key_coverage": round(coverage, 3),
+            "null_ratio": round(1 - len(values) / len(pairs), 3),
+            "recovered": recovered,
+        }
+        if self.reject_grounding is not None and grounding < self.reject_grounding:
+            return REJECT, {"reason": "extracted values do not appear in the context", **details}
+        if grounding >= self.accept_grounding and coverage >= self.accept_coverage:
+            return ACCEPT, details
+        return AMBIGUOUS, details
+
+    def __call__(self, extraction):
+        """StageGenerator prefilter: the records to use instead of an LLM call, or None.
+
+        Accepted rows become a single record carrying the local scores, rejected rows
+        produce none.
+        """
+        verdict, details = self.check(extraction)
+        self.counts[verdict] += 1
+        if verdict == AMBIGUOUS:
+            return None
+        if verdict == REJECT:
+            if self.rejects is not None:
+                self.rejects.write(json.dumps({**extraction, "prevalidation": details}) + "\n")
+                self.rejects.flush()
+            return []
+
+        return [{**extraction, "prevalidation": {"verdict": ACCEPT, **details}}]
+
+    @property
+    def llm_calls_saved(self):
+        return self.counts[ACCEPT] + self.counts[REJECT]
+
+    def report(self):
+        total = sum(self.counts.values())
+        print(
+            f"Pre-validation: {self.counts[ACCEPT]} accepted, {self.counts[REJECT]} rejected, "
+            f"{self.counts[AMBIGUOUS]} sent to the LLM; saved {self.llm_calls_saved}/{total} LLM calls"
+        )
+
+    def close(self):
+        if self.rejects is not None:
+            self.rejects.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Report how many extractions the local pre-validation decides without an LLM")
+    parser.add_argument("--input", default=INPUT_FILE, help="Extractions JSONL file")
+    parser.add_argument("--reject-grounding", type=float, default=None,
+                        help="Also reject rows with fewer grounded values than this fraction")
+    args = parser.parse_args()
+
+    prevalidator = Prevalidator(reject_grounding=args.reject_grounding)
+    for extraction in read_jsonl(args.input):
+        prevalidator(extraction)
+    prevalidator.close()
+    prevalidator.report()
+    print(f"Rejected rows written to {REJECTS_FILE}")
@@ -0,0 +1,150 @@
+import json
+import time
+from collections import defaultdict
+
+from scheduler import estimate_tokens
+
+try:
+    import tiktoken
+    _ENCODING = tiktoken.get_encoding("o200k_base")
+except ImportError:
+    _ENCODING = None
+
+# USD per 1M tokens and context window, keyed by dria Model name
+MODEL_PRICES = {
+    "GPT4O_MINI": {"input": 0.15, "output": 0.60, "context": 128000},
+    "GPT4O": {"input": 2.50, "output": 10.00, "context": 128000},
+    "ANTHROPIC_SONNET_3_5_OR": {"input": 3.00, "output": 15.00, "context": 200000},
+}
+
+# Expected output tokens per instruction and the most a single instruction may cost.
+# Short prompts can afford the stronger models; long-context prompts fall back to
+# cheaper ones once their estimated cost goes over max_cost.
+STAGE_BUDGETS = {
+    "sub_categories": {"output_tokens": 400, "max_cost": 0.01},
+    "subjects": {"output_tokens": 250, "max_cost": 0.01},
+    "contexts": {"output_tokens": 1400, "max_cost": 0.02},
+    "extractions": {"output_tokens": 400, "max_cost": 0.005},
+    "extraction_validations": {"output_tokens": 250, "max_cost": 0.005},
+    "scored_extraction_validations": {"output_tokens": 300, "max_cost": 0.005},
+    "validated_extractions": {"output_tokens": 50, "max_cost": 0.005},
+}
+
+def model_name(model):
+    return getattr(model, "name", str(model))
+
+def count_tokens(text):
+    """Count tokens locally with tiktoken when installed, else estimate from length"""
+    if _ENCODING is not None:
+        return len(_ENCODING.encode(text, disallowed_special=()))
+    return estimate_tokens(text)
+
+def estimate_cost(model, input_tokens, output_tokens):
+    price = MODEL_PRICES.get(model_name(model))
+    if price is None:
+        return 0.0
+    return (input_tokens * price["input"] + output_tokens * price["output"]) / 1_000_000
+
+class RoutingPolicy:
+    """Picks the models allowed to serve an instruction from its estimated token counts.
+
+    Models are considered in the stage's preference order (its MODELS list). A model is
+    allowed when the prompt fits its context window and the estimated cost stays within
+    the stage's max_cost; if none qualifies the cheapest model that fits is used.
+    Optionally a stage-wide max_stage_cost switches every further instruction to the
+    cheapest model once the spend recorded in the usage report reaches it.
+    """
+
+    def __init__(self, budgets=None, usage=None):
+        self.budgets = budgets or STAGE_BUDGETS
+        self.usage = usage
+
+    def route(self, stage, models, input_tokens):
+        budget = self.budgets.get(stage, {})
+        output_tokens = budget.get("output_tokens", 500)
+        fitting = [
+            model for model in models
+            if input_tokens + output_tokens <= MODEL_PRICES.get(model_name(model), {}).get("context", float("inf"))
+        ] or list(models)
+        cheapest = min(fitting, key=lambda model: estimate_cost(model, input_tokens, output_tokens))
+
+        max_stage_cost = budget.get("max_stage_cost")
+        if max_stage_cost is not None and self.usage is not None and self.usage.stage_cost(stage) >= max_stage_cost:
+            return [cheapest]
+
+        max_cost = budget.get("max_cost")
+        allowed = [
+            model for model in fitting
+            if max_cost is None or estimate_cost(model, input_tokens, output_tokens) <= max_cost
+        ]
+        return allowed or [cheapest]
+
+class UsageReport:
+    """Tokens, estimated cost and latency per stage and serving model.
+
+    Calls overlap, so latency is reported as the slowest call and the wall clock
+    from the first call's start to the last call's end, not a sum of call times.
+    """
+
+    def __init__(self):
+        self.rows = defaultdict(lambda: {"calls": 0, "instructions": 0, "input_tokens": 0,
+                                         "output_tokens": 0, "cost": 0.0, "max_latency": 0.0,
+                                         "start": float("inf"), "end": float("-inf")})
+
+    def record(self, stage, models, instructions, input_tokens, output_tokens, latency):
+        """Add a finished call served by models, normally the single model chosen for it.
+
+        When the SDK picked among several models the one used isn't known, so the
+        call is costed at the first, the stage's preferred model.
+        """
+        key = (stage, "|".join(model_name(model) for model in models))
+        row = self.rows[key]
+        end = time.perf_counter()
+        row["calls"] += 1
+        row["instructions"] += instructions
+        row["input_tokens"] += input_tokens
+        row["output_tokens"] += output_tokens
+        row["cost"] += estimate_cost(models[0], input_tokens, output_tokens)
+        row["max_latency"] = max(row["max_latency"], latency)
+        row["start"] = min(row["start"], end - latency)
+        row["end"] = max(row["end"], end)
+
+    @staticmethod
+    def wall(rows):
+        """Seconds from the first call's start to the last call's end over rows"""
+        return max(row["end"] for row in rows) - min(row["start"] for row in rows)
+
+    def stage_cost(self, stage):
+        return sum(row["cost"] for (row_stage, _), row in self.rows.items() if row_stage == stage)
+
+    def report(self):
+        print(
+            f"{'Stage':<24} {'Model':<46} {'instr':>6} {'in tok':>10} {'out tok':>9} {'cost $':>9} "
+            f"{'max call':>9} {'wall':>9}"
+        )
+        totals = defaultdict(float)
+        for (stage, models), row in sorted(self.rows.items()):
+            print(
+                f"{stage:<24} {models:<46} {row['instructions']:>6} {row['input_tokens']:>10} "
+                f"{row['output_tokens']:>9} {row['cost']:>9.4f} {row['max_latency']:>8.1f}s {self.wall([row]):>8.1f}s"
+            )
+            for field in ("instructions", "input_tokens", "output_tokens", "cost"):
+                totals[field] += row[field]
+        for stage in sorted({stage for stage, _ in self.rows}):
+            rows = [row for (row_stage, _), row in self.rows.items() if row_stage == stage]
+            print(f"{stage:<24} {'wall clock, all models':<46} {'':>6} {'':>10} {'':>9} {'':>9} {'':>9} {self.wall(rows):>8.1f}s")
+        print(
+            f"{'Total':<71} {int(totals['instructions']):>6} {int(totals['input_tokens']):>10} "
+            f"{int(totals['output_tokens']):>9} {totals['cost']:>9.4f}"
+        )
+
+    def to_json(self):
+        return json.dumps(
+            [
+                {"stage": stage, "models": models,
+                 **{field: value for field, value in row.items() if field not in ("start", "end")},
+                 "wall": self.wall([row])}
+                for (stage, models), row in sorted(self.rows.items())
+            ],
+            indent=2
+        )
@@ -1,67 +1,150 @@
+import argparse
 import asyncio
-import subprocess
-import os
+import importlib
+import sys
 import time
 from pathlib import Path
-import shutil
-import json
+
+from checkpoint import PipelineState
+from fanout import FanoutPlan, count_roots, parse_fanout
+from routing import RoutingPolicy, UsageReport
+from scheduler import ModelScheduler
+from telemetry import TELEMETRY_FILE, telemetry
 
 class Pipeline:
-    def __init__(self):
+    def __init__(self, stream=False, batch_size=8, max_batches=8, use_cache=True, force=False, max_in_flight=None,
+                 route=False, validation_mode="separate", prevalidate=False, dedup_threshold=0.8,
+                 export_format="jsonl", eval_fraction=0.0, fanout=None, budget=None, workers=1,
+                 where=None, telemetry_file=None, metrics_port=None):
+        # In streaming mode the stages marked "generative" hand records to each other
+        # through queues instead of waiting for the previous output file
+        self.stream = stream
+        self.batch_size = batch_size
+        # Streaming batches each stage keeps in flight at once
+        self.max_batches = max_batches
+        # Generative stages serve unchanged instructions from the response cache
+        self.use_cache = use_cache
         self.initial_data = "datasets/categories.jsonl"  # Simplified to just the path
-        
-        self.scripts = [
+
+        # Every stage is a module exposing run(*inputs, *outputs, **options), either sync
+        # or async. The execution order is derived from the files each stage reads and
+        # writes. "streamable" stages are local record filters that also run inside the
+        # streaming chain through their module's create_filter(**options). "level" names
+        # the stage in the fan-out plan, which sets its fanout and limit options.
+        self.stages = [
             {
                 "name": "Sub-category Generation",
-                "file": "sub_category_generator.py",
-                "input": "datasets/categories.jsonl",
-                "output": "datasets/sub_categories.jsonl",
-                "required": True
+                "module": "sub_category_generator",
+                "generative": True,
+                "level": "sub_categories",
+                "inputs": ["datasets/categories.jsonl"],
+                "outputs": ["datasets/sub_categories.jsonl"],
+                "required": False
             },
             {
                 "name": "Subject Generation",
-                "file": "subject_generator.py",
-                "input": "datasets/sub_categories.jsonl",
-                "output": "datasets/subjects.jsonl",
+                "module": "subject_generator",
+                "generative": True,
+                "level": "subjects",
+                "inputs": ["datasets/sub_categories.jsonl"],
+                "outputs": ["datasets/subjects.jsonl"],
+                "required": False
+            },
+            {
+                # Near-duplicate subjects would each pay for a context, extraction and validation
+                "name": "Subject Deduplication",
+                "module": "dedup",
+                "streamable": True,
+                "options": {"kind": "subjects", "threshold": dedup_threshold},
+                "inputs": ["datasets/subjects.jsonl"],
+                "outputs": ["datasets/unique_subjects.jsonl"],
                 "required": True
             },
             {
                 "name": "Context Generation",
-                "file": "context_generator.py",
-                "input": "datasets/subjects.jsonl",
-                "output": "datasets/contexts.jsonl",
+                "module": "context_generator",
+                "generative": True,
+                "level": "contexts",
+                "inputs": ["datasets/unique_subjects.jsonl"],
+                "outputs": ["datasets/contexts.jsonl"],
+                "required": False
+            },
+            {
+                "name": "Context Deduplication",
+                "module": "dedup",
+                "streamable": True,
+                "options": {"kind": "contexts", "threshold": dedup_threshold},
+                "inputs": ["datasets/contexts.jsonl"],
+                "outputs": ["datasets/unique_contexts.jsonl"],
                 "required": True
             },
             {
                 "name": "Extraction Generation",
-                "file": "extracted_data_generator.py",
-                "input": "datasets/contexts.jsonl",
-                "output": "datasets/extractions.jsonl",
-                "required": True
+                "module": "extracted_data_generator",
+                "generative": True,
+                "level": "extractions",
+                "inputs": ["datasets/unique_contexts.jsonl"],
+                "outputs": ["datasets/extractions.jsonl"],
+                "required": False
             },
             {
                 "name": "Validation Generation",
-                "file": "validate_extractions.py",
-                "input": "datasets/extractions.jsonl",
-                "output": "datasets/validations.jsonl",
-                "required": True
+                "module": "validate_extractions",
+                "generative": True,
+                "level": "validations",
+                # "combined" also returns the quality score in the same LLM call;
+                # prevalidate settles clear-cut rows locally before any LLM call
+                "options": {"mode": validation_mode, "prevalidate": prevalidate},
+                "inputs": ["datasets/extractions.jsonl"],
+                "outputs": ["datasets/validations.jsonl"],
+                "required": False
             },
             {
                 "name": "Filter Validations",
-                "file": "filter_validations.py",
-                "input": "datasets/validations.jsonl",
-                "output": "datasets/filtered_validations.jsonl",
+                "module": "filter_validations",
+                # Byte ranges of the file are filtered in a process pool with workers > 1;
+                # where is the predicate rows must match (see predicates.py)
+                "options": {"workers": workers, "where": where},
+                "inputs": ["datasets/validations.jsonl"],
+                "outputs": ["datasets/filtered_validations.jsonl"],
+                "required": True
+            },
+            {
+                "name": "Data Conversion",
+                "module": "data_formatter",
+                # "jsonl"/"parquet" stream into train/eval shards instead of one JSON array
+                "options": {"format": export_format, "eval_fraction": eval_fraction, "workers": workers},
+                "inputs": ["datasets/filtered_validations.jsonl"],
+                "outputs": [
+                    "datasets/conversation_format_dataset.json" if export_format == "json" else "datasets/conversations"
+                ],
                 "required": True
             }
         ]
-        
-        self.data_prep = {
-            "name": "Data Conversion",
-            "file": "data_formatter.py",
-            "input": "datasets/filtered_validations.jsonl",
-            "output": "datasets/conversation_format_dataset.json"
-        }
-        
+
+        # Children per parent at each level of the generation tree and an optional cap
+        # on the total LLM calls, see fanout.py
+        self.fanout = fanout
+        self.budget = budget
+
+        # Spans and metrics go to telemetry_file and, with a port, a Prometheus endpoint
+        self.telemetry_file = telemetry_file
+        self.metrics_port = metrics_port
+
+        # Wall-clock seconds per stage name, filled in as stages complete
+        self.timings = {}
+        # Input hashes of the last successful run; stages that aren't required are
+        # skipped while their inputs are unchanged
+        self.state = PipelineState()
+        self.force = force
+        # With max_in_flight set, a shared ModelScheduler routes every batch to the model
+        # with the best current throughput instead of leaving dispatch to the SDK
+        self.max_in_flight = max_in_flight
+        self.scheduler = None
+        # Tokens, estimated cost and latency per stage/model; with route=True each
+        # instruction is restricted to the models its estimated cost allows
+        self.usage = UsageReport()
+        self.router = RoutingPolicy(usage=self.usage) if route else None
 
     def check_file_exists(self, filepath):
         path = Path(filepath)
@@ -80,66 +163,267 @@ class Pipeline:
         print(f"\n✅ Initial data file verified: {self.initial_data}")
         return True
 
-    def run_script(self, script_info):
+    def plan_fanout(self):
+        """Size the generation tree and pass each stage its fan-out and instruction limit"""
+        plan = FanoutPlan(count_roots(self.initial_data), self.fanout, self.budget)
+        print()
+        plan.report()
+        limits = plan.limits()
+        for stage in self.stages:
+            level = stage.get("level")
+            if level is None:
+                continue
+            options = stage.setdefault("options", {})
+            if level in plan.fanout:
+                options["fanout"] = plan.fanout[level]
+            if self.budget is not None:
+                options["limit"] = limits[level]
+        return plan
+
+    def dependencies(self, stage, stages=None):
+        """Stages producing any of the files this stage reads"""
+        return [
+            other for other in (self.stages if stages is None else stages)
+            if other is not stage and set(other["outputs"]) & set(stage["inputs"])
+        ]
+
+    def topological_order(self, stages=None):
+        stages = self.stages if stages is None else stages
+        ordered, pending = [], list(stages)
+        while pending:
+            ready = [
+                stage for stage in pending
+                if all(dep in ordered for dep in self.dependencies(stage, stages))
+            ]
+            if not ready:
+                names = ", ".join(stage["name"] for stage in pending)
+                raise ValueError(f"Stage dependencies form a cycle: {names}")
+            ordered.extend(ready)
+            pending = [stage for stage in pending if stage not in ready]
+        return ordered
+
+    async def run_stage(self, stage):
         print(f"\n{'='*50}")
-        print(f"Running: {script_info['name']}")
+        print(f"Running: {stage['name']}")
         print(f"{'='*50}")
-        
+
+        start = time.perf_counter()
         try:
-            # Run the script
-            result = subprocess.run(['python', script_info['file']], check=True)
-            
-            # Wait a bit and check if the output file was created
-            time.sleep(2)
-            if 'output' in script_info and not self.check_file_exists(script_info['output']):
-                raise Exception(f"Output file {script_info['output']} was not created or is empty")
-            
-            print(f"\n✅ {script_info['name']} completed successfully")
+            # Run the stage inside this interpreter; sync stages go to a worker thread
+            # so they don't block stages that are still generating
+            run = importlib.import_module(stage["module"]).run
+            args = [*stage["inputs"], *stage["outputs"]]
+            kwargs = dict(stage.get("options", {}))
+            if stage.get("generative"):
+                kwargs.update({
+                    "use_cache": self.use_cache,
+                    "scheduler": self.scheduler,
+                    "router": self.router,
+                    "usage": self.usage
+                })
+            with telemetry.span("stage", stage=stage["name"], module=stage["module"]):
+                if asyncio.iscoroutinefunction(run):
+                    await run(*args, **kwargs)
+                else:
+                    await asyncio.to_thread(run, *args, **kwargs)
+
+            for output in stage["outputs"]:
+                if not self.check_file_exists(output):
+                    raise Exception(f"Output file {output} was not created or is empty")
+
+            self.state.mark_done(stage)
+            elapsed = time.perf_counter() - start
+            self.timings[stage["name"]] = elapsed
+            print(f"\n✅ {stage['name']} completed successfully in {elapsed:.2f}s")
             return True
-            
+
         except Exception as e:
-            print(f"\n❌ Error in {script_info['name']}: {str(e)}")
+            self.timings[stage["name"]] = time.perf_counter() - start
+            print(f"\n❌ Error in {stage['name']}: {str(e)}")
             return False
 
-    def run_pipeline(self):
+    async def run_dag(self, stages):
+        tasks = {}
+
+        async def run_when_ready(stage):
+            # Wait for every upstream stage; independent branches run concurrently
+            upstream = [tasks[dep["name"]] for dep in self.dependencies(stage, stages)]
+            if not all(await asyncio.gather(*upstream)):
+                return False
+
+            # Skip if not required and its inputs haven't changed since the last run
+            if not (stage["required"] or self.force) and self.state.is_up_to_date(stage):
+                print(f"\nSkipping {stage['name']} - inputs unchanged since the last run")
+                return True
+
+            for input_file in stage["inputs"]:
+                if not self.check_file_exists(input_file):
+                    print(f"\n❌ Required input file {input_file} not found")
+                    return False
+
+            return await self.run_stage(stage)
+
+        for stage in self.topological_order(stages):
+            tasks[stage["name"]] = asyncio.create_task(run_when_ready(stage))
+        return all(await asyncio.gather(*tasks.values()))
+
+    async def run_streaming(self, stages):
+        # Imported lazily so the file-based mode doesn't depend on it
+        from cache import ResponseCache
+        from streaming import StreamingPipeline
+
+        print(f"\n{'='*50}")
+        print(f"Streaming: {', '.join(stage['name'] for stage in stages)}")
+        print(f"{'='*50}")
+
+        cache = ResponseCache() if self.use_cache else None
+        streaming = StreamingPipeline(
+            stages,
+            batch_size=self.batch_size,
+            max_batches=self.max_batches,
+            cache=cache,
+            scheduler=self.scheduler,
+            router=self.router,
+            usage=self.usage
+        )
+        try:
+            with telemetry.span("streaming", stages=[stage["name"] for stage in stages]):
+                await streaming.run()
+        except Exception as e:
+            print(f"\n❌ Error in streaming stages: {str(e)}")
+            return False
+        finally:
+            for stage in streaming.stages:
+                self.timings[stage.name] = stage.active_time
+            if cache is not None:
+                print(f"Cache hits: {cache.hits}, misses: {cache.misses}")
+                cache.close()
+
+        if not all(self.check_file_exists(stage["outputs"][0]) for stage in stages):
+            return False
+        for stage in stages:
+            self.state.mark_done(stage)
+        return True
+
+    async def execute(self):
         print("\nStarting Data Generation Pipeline")
         print("================================")
-        
+
         # First, verify the initial data file exists
         if not self.check_initial_data():
             return False
-        
-        # Run each script in sequence
-        for script in self.scripts:
-            # Skip if file exists and not required
-            if not script['required'] and self.check_file_exists(script['output']):
-                print(f"\nSkipping {script['name']} - output file already exists")
-                continue
-                
-            # Check if previous output exists if needed
-            if script != self.scripts[0]:  # Not the first script
-                prev_script = self.scripts[self.scripts.index(script) - 1]
-                if not self.check_file_exists(prev_script['output']):
-                    print(f"\n❌ Required input file {prev_script['output']} not found")
-                    return False
-            
-            # Run the script
-            if not self.run_script(script):
-                return False
-                
-            # Wait between scripts
-            time.sleep(5)
-        
-        # Run the data conversion script
-        if self.check_file_exists(self.data_prep['input']):
-            if self.run_script(self.data_prep):
-                print("\n✅ Pipeline completed successfully!")
-                return True
-        else:
-            print(f"\n❌ Required input file {self.data_prep['input']} not found")
-        
+        self.plan_fanout()
+
+        if self.max_in_flight:
+            self.scheduler = self.create_scheduler()
+        if self.telemetry_file or self.metrics_port is not None:
+            telemetry.enable(self.telemetry_file, self.metrics_port)
+
+        start = time.perf_counter()
+        try:
+            with telemetry.span("pipeline", stream=self.stream) as span:
+                stages = self.topological_order()
+                success = True
+                if self.stream:
+                    streamed = [stage for stage in stages if stage.get("generative") or stage.get("streamable")]
+                    stages = [stage for stage in stages if stage not in streamed]
+                    success = await self.run_streaming(streamed)
+                if success:
+                    success = await self.run_dag(stages)
+                span.set(success=success)
+        finally:
+            telemetry.close()
+        self.report_timings(time.perf_counter() - start)
+        if self.scheduler is not None:
+            print()
+            self.scheduler.report()
+        print()
+        self.usage.report()
+
+        if success:
+            print("\n✅ Pipeline completed successfully!")
+            return True
         return False
 
+    def create_scheduler(self):
+        models = []
+        for stage in self.stages:
+            if stage.get("generative"):
+                for model in importlib.import_module(stage["module"]).MODELS:
+                    if model not in models:
+                        models.append(model)
+        return ModelScheduler(models, max_in_flight=self.max_in_flight)
+
+    def report_timings(self, total):
+        print(f"\n{'='*50}")
+        print("Stage timings")
+        print(f"{'='*50}")
+        for stage in self.stages:
+            if stage["name"] in self.timings:
+                print(f"{stage['name']:<30} {self.timings[stage['name']]:>8.2f}s")
+        print(f"{'Total':<30} {total:>8.2f}s")
+
+    def run_pipeline(self):
+        return asyncio.run(self.execute())
+
 if __name__ == "__main__":
-    pipeline = Pipeline()
-    pipeline.run_pipeline() 
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Run the data generation pipeline")
+    parser.add_argument("--stream", action="store_true", help="Stream records between the generative stages")
+    parser.add_argument("--batch-size", type=int, default=8, help="Maximum records per streaming batch")
+    parser.add_argument("--max-batches", type=int, default=8, help="Streaming batches each stage keeps in flight at once")
+    parser.add_argument("--no-cache", action="store_true", help="Regenerate every record instead of using the response cache")
+    parser.add_argument("--force", action="store_true", help="Rerun stages even if their inputs are unchanged")
+    parser.add_argument("--route", action="store_true", help="Pick models per instruction from estimated token counts and stage budgets")
+    parser.add_argument("--validation-mode", choices=["separate", "combined"], default="separate",
+                        help="combined validates and scores every extraction in a single call")
+    parser.add_argument("--prevalidate", action="store_true", help="Decide clear-cut extractions locally and only send ambiguous ones to the LLM validator")
+    parser.add_argument("--dedup-threshold", type=float, default=0.8, help="Similarity above which subjects and contexts count as near-duplicates")
+    parser.add_argument("--export-format", choices=["json", "jsonl", "parquet"], default="jsonl", help="Write the final dataset as JSONL/Parquet shards in datasets/conversations, as loaded by Fine_Tuning.ipynb, or as one JSON array")
+    parser.add_argument("--eval-fraction", type=float, default=0.0, help="Fraction of conversations held out as the eval split of the shards")
+    parser.add_argument("--fanout", help="Children per parent, e.g. sub_categories=5,subjects=2,contexts=1")
+    parser.add_argument("--budget", type=int, help="Maximum total LLM calls; the fan-out is reduced to fit")
+    parser.add_argument("--where", help="Filter expression for validations, e.g. \"is_accurate & quality_score >= 0.7\"")
+    parser.add_argument("--workers", type=int, default=1, help="Processes used to filter and convert the validations")
+    parser.add_argument("--telemetry", nargs="?", const=TELEMETRY_FILE, metavar="FILE",
+                        help=f"Write spans and metrics to this JSONL file (default {TELEMETRY_FILE})")
+    parser.add_argument("--metrics-port", type=int, help="Serve Prometheus metrics on this port during the run")
+    parser.add_argument("--max-in-flight", type=int, help="Route batches through the adaptive scheduler with this many in-flight instructions per model")
+    parser.add_argument("--shards", type=int, help="Partition the categories into this many shards, each run as its own pipeline, and merge the results")
+    parser.add_argument("--shard-workers", type=int, default=1, help="Local processes working through the shards")
+    args = parser.parse_args()
+
+    if args.prevalidate and args.where:
+        from filter_validations import check_prevalidated
+        from predicates import Predicate
+        try:
+            check_prevalidated(Predicate(args.where))
+        except ValueError as e:
+            parser.error(str(e))
+
+    if args.shards:
+        # Imported lazily so the single-directory mode doesn't depend on it
+        from sharding import run_sharded
+        sys.exit(0 if run_sharded(args.shards, args.shard_workers, sys.argv[1:], threshold=args.dedup_threshold,
+                                 format=args.export_format, eval_fraction=args.eval_fraction) else 1)
+
+    pipeline = Pipeline(
+        stream=args.stream,
+        batch_size=args.batch_size,
+        max_batches=args.max_batches,
+        use_cache=not args.no_cache,
+        force=args.force,
+        max_in_flight=args.max_in_flight,
+        route=args.route,
+        validation_mode=args.validation_mode,
+        prevalidate=args.prevalidate,
+        dedup_threshold=args.dedup_threshold,
+        export_format=args.export_format,
+        eval_fraction=args.eval_fraction,
+        fanout=parse_fanout(args.fanout),
+        budget=args.budget,
+        workers=args.workers,
+        where=args.where,
+        telemetry_file=args.telemetry,
+        metrics_port=args.metrics_port
+    )
+    sys.exit(0 if pipeline.run_pipeline() else 1)
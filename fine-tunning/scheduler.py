@@ -0,0 +1,192 @@
+import asyncio
+import random
+import time
+from collections import deque
+
+class RateLimitError(Exception):
+    """Raised by model backends when a provider answers 429"""
+
+def is_rate_limited(error):
+    if isinstance(error, RateLimitError):
+        return True
+    if getattr(error, "status", None) == 429 or getattr(error, "status_code", None) == 429:
+        return True
+    message = str(error).lower()
+    return "429" in message or "rate limit" in message
+
+def estimate_tokens(text):
+    """Rough token count used until a real tokenizer is available"""
+    return max(1, len(text) // 4)
+
+class ModelStats:
+    """Live health of one model: latency, error rate, in-flight slots and token headroom"""
+
+    def __init__(self, model, max_in_flight, tokens_per_minute=None, smoothing=0.2):
+        self.model = model
+        self.max_in_flight = max_in_flight
+        self.tokens_per_minute = tokens_per_minute
+        self.smoothing = smoothing
+
+        # Optimistic priors so every model gets tried before the stats settle
+        self.latency = 1.0
+        self.error_rate = 0.0
+        self.in_flight = 0
+        self.backoff_until = 0.0
+        self.consecutive_rate_limits = 0
+        self.token_log = deque()
+
+        self.calls = 0
+        self.errors = 0
+        self.rate_limits = 0
+        self.short = 0
+
+    def tokens_last_minute(self, now):
+        while self.token_log and self.token_log[0][0] < now - 60:
+            self.token_log.popleft()
+        return sum(tokens for _, tokens in self.token_log)
+
+    def headroom(self, now):
+        if self.tokens_per_minute is None:
+            return float("inf")
+        return self.tokens_per_minute - self.tokens_last_minute(now)
+
+    def can_take(self, size, tokens, now):
+        # A batch larger than the cap is still allowed onto an idle model
+        fits = self.in_flight + size <= self.max_in_flight or self.in_flight == 0
+        # Likewise a batch over the whole per-minute budget waits for an empty window
+        has_budget = self.headroom(now) >= tokens or not self.token_log
+        return fits and now >= self.backoff_until and has_budget
+
+    def throughput(self):
+        """Expected successful instructions per second with the free slots"""
+        free = max(self.max_in_flight - self.in_flight, 1)
+        return free * (1 - self.error_rate) / self.latency
+
+    def record_success(self, latency, size):
+        per_instruction = latency / max(size, 1)
+        self.latency += self.smoothing * (per_instruction - self.latency)
+        self.error_rate += self.smoothing * (0 - self.error_rate)
+        self.consecutive_rate_limits = 0
+
+    def record_error(self):
+        self.errors += 1
+        self.error_rate += self.smoothing * (1 - self.error_rate)
+
+    def record_shortfall(self, missing, size, base_delay, max_delay):
+        """A batch came back with missing results, which is how the SDK reports 429s and
+        failed items: the missing share counts as errors and the model backs off"""
+        self.short += 1
+        self.errors += missing
+        self.error_rate += self.smoothing * (missing / size - self.error_rate)
+        self.back_off(base_delay, max_delay)
+
+    def record_rate_limit(self, base_delay, max_delay):
+        self.rate_limits += 1
+        self.back_off(base_delay, max_delay)
+
+    def back_off(self, base_delay, max_delay):
+        self.consecutive_rate_limits += 1
+        delay = min(max_delay, base_delay * 2 ** (self.consecutive_rate_limits - 1))
+        self.backoff_until = time.monotonic() + delay * random.uniform(0.5, 1.0)
+
+class ModelScheduler:
+    """Routes batches of instructions to the model with the best current throughput.
+
+    Each model has a cap on in-flight instructions and an optional tokens-per-minute
+    budget. A 429 puts the model into exponential backoff and the batch is retried on
+    whichever model is best at that moment, up to max_rate_limits times; other errors
+    count against the model's error rate and are retried up to max_retries times.
+
+    The dria SDK doesn't raise on 429s or failed items, it returns fewer records. With
+    count(result) giving the number of instructions a result answers, a short result
+    counts the missing share against the model's error rate and backs it off. A
+    partial result is still returned, and an empty one is retried like a 429.
+    """
+
+    def __init__(self, models, max_in_flight=8, tokens_per_minute=None, max_retries=3,
+                 max_rate_limits=20, backoff_base=1.0, backoff_max=60.0):
+        tokens_per_minute = tokens_per_minute or {}
+        self.stats = {
+            model: ModelStats(model, max_in_flight, tokens_per_minute.get(model))
+            for model in models
+        }
+        self.max_in_flight = max_in_flight
+        self.max_retries = max_retries
+        self.max_rate_limits = max_rate_limits
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.changed = asyncio.Condition()
+
+    def choose(self, size, tokens, models=None):
+        now = time.monotonic()
+        candidates = [
+            stats for model, stats in self.stats.items()
+            if (models is None or model in models) and stats.can_take(size, tokens, now)
+        ]
+        if not candidates:
+            return None
+        return max(candidates, key=lambda stats: stats.throughput())
+
+    async def acquire(self, size, tokens, models=None):
+        async with self.changed:
+            while True:
+                stats = self.choose(size, tokens, models)
+                if stats is not None:
+                    stats.in_flight += size
+                    stats.calls += 1
+                    stats.token_log.append((time.monotonic(), tokens))
+                    return stats
+                # Wake up on a release, or when the earliest backoff expires
+                now = time.monotonic()
+                waits = [s.backoff_until - now for s in self.stats.values() if s.backoff_until > now]
+                try:
+                    await asyncio.wait_for(self.changed.wait(), min(waits, default=1.0))
+                except asyncio.TimeoutError:
+                    pass
+
+    async def release(self, stats, size):
+        async with self.changed:
+            stats.in_flight -= size
+            self.changed.notify_all()
+
+    async def submit(self, call, size=1, tokens=0, models=None, count=None):
+        """Run call(model) on the best model for a batch of size instructions"""
+        attempts = rate_limited = 0
+        while True:
+            stats = await self.acquire(size, tokens, models)
+            start = time.monotonic()
+            try:
+                result = await call(stats.model)
+            except Exception as e:
+                if is_rate_limited(e):
+                    # Rate limits don't use up retries, the batch just moves elsewhere
+                    stats.record_rate_limit(self.backoff_base, self.backoff_max)
+                    rate_limited += 1
+                    if rate_limited > self.max_rate_limits:
+                        raise
+                else:
+                    stats.record_error()
+                    attempts += 1
+                    if attempts > self.max_retries:
+                        raise
+                continue
+            else:
+                answered = count(result) if count is not None else size
+                if answered >= size:
+                    stats.record_success(time.monotonic() - start, size)
+                    return result
+                stats.record_shortfall(size - answered, size, self.backoff_base, self.backoff_max)
+                if answered == 0 and rate_limited < self.max_rate_limits:
+                    rate_limited += 1
+                    continue
+                return result
+            finally:
+                await self.release(stats, size)
+
+    def report(self):
+        print(f"{'Model':<40} {'calls':>6} {'errors':>7} {'429s':>6} {'short':>6} {'latency':>9} {'error rate':>11}")
+        for stats in self.stats.values():
+            print(
+                f"{str(stats.model):<40} {stats.calls:>6} {stats.errors:>7} {stats.rate_limits:>6} {stats.short:>6} "
+                f"{stats.latency:>8.2f}s {stats.error_rate:>11.2f}"
+            )
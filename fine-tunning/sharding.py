@@ -0,0 +1,339 @@
+import argparse
+import fcntl
+import hashlib
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+from data_formatter import SHARDS_DIR as CONVERSATIONS_DIR, ShardedExporter
+from dedup import Deduplicator
+from jsonl_io import JsonArrayWriter, read_jsonl
+
+CATEGORIES_FILE = "datasets/categories.jsonl"
+SHARDS_DIR = "datasets/shards"
+OUTPUT_FILE = "datasets/conversation_format_dataset.json"
+MANIFEST = "manifest.json"
+RUN_PIPELINE = str(Path(__file__).resolve().with_name("run_pipeline.py"))
+
+# Every path the pipeline uses is relative to its working directory, so a shard
+# runs the unchanged pipeline with its directory as the working directory
+SHARD_INPUT = "datasets/categories.jsonl"
+SHARD_OUTPUT = "datasets/conversations"
+# Shards always stream JSONL; the merge writes the format and eval split asked for
+SHARD_FORMAT = ["--export-format", "jsonl"]
+
+# Pipeline options that can't be passed to every shard as they are
+BUDGET_OPTION = "--budget"
+DROPPED_OPTIONS = {"--metrics-port": True, "--shards": True, "--shard-workers": True, "--export-format": True,
+                   "--eval-fraction": True}
+
+def shard_of(record, shards):
+    """Shard of a category; a stable hash, so every node partitions the same way"""
+    key = str(record.get("main_category", "")).strip().lower()
+    return int.from_bytes(hashlib.sha1(key.encode("utf-8")).digest()[:8], "big") % shards
+
+def strip_options(argv, options):
+    """argv without the given options; options maps a name to whether it takes a value"""
+    result, skip = [], False
+    for arg in argv:
+        if skip:
+            skip = False
+            continue
+        name = arg.split("=", 1)[0]
+        if name in options:
+            skip = options[name] and "=" not in arg
+            continue
+        result.append(arg)
+    return result
+
+def option_value(argv, name):
+    for index, arg in enumerate(argv):
+        if arg == name and index + 1 < len(argv):
+            return argv[index + 1]
+        if arg.startswith(name + "="):
+            return arg.split("=", 1)[1]
+    return None
+
+def file_hash(path):
+    with open(path, 'rb') as file:
+        return hashlib.sha256(file.read()).hexdigest()
+
+class ShardSet:
+    """A categories file partitioned into shards that any number of processes or
+    nodes work through together.
+
+    Every shard is a directory holding its slice of the categories and, once it
+    has run, its own outputs, checkpoints and cache. Workers claim a shard by
+    taking an exclusive flock on its .lock file and keep it for the whole run; the
+    kernel releases it if the worker dies, so another worker can pick the shard up
+    and resume it from its checkpoints. A finished shard gets a .done marker and a
+    failed one a .failed marker with its exit code. The root directory only needs
+    to be shared by the nodes (e.g. over NFS with working flock support).
+    """
+
+    def __init__(self, root=SHARDS_DIR):
+        self.root = Path(root)
+        self.manifest = None
+        manifest_path = self.root / MANIFEST
+        if manifest_path.exists():
+            with open(manifest_path) as file:
+                self.manifest = json.load(file)
+
+    def path(self, shard):
+        return self.root / f"shard-{shard:03d}"
+
+    def partition(self, input_file=CATEGORIES_FILE, shards=4, pipeline_args=()):
+        """Split input_file into shards by category hash; an identical existing split is kept"""
+        source = file_hash(input_file)
+        args = strip_options(list(pipeline_args), {BUDGET_OPTION: True, **DROPPED_OPTIONS})
+        budget = option_value(list(pipeline_args), BUDGET_OPTION)
+        if (self.manifest is not None and self.manifest["source"] == source and self.manifest["shards"] == shards
+                and self.manifest["pipeline_args"] == args and self.manifest["budget"] == budget):
+            print(f"Reusing {shards} shards in {self.root}")
+            return self.manifest
+        if self.manifest is not None and any(self.state(shard) != "pending" for shard in range(self.manifest["shards"])):
+            raise RuntimeError(
+                f"{self.root} holds shards of a different input or options; merge or remove it before resharding"
+            )
+
+        self.root.mkdir(parents=True, exist_ok=True)
+        files = []
+        for shard in range(shards):
+            (self.path(shard) / "datasets").mkdir(parents=True, exist_ok=True)
+            files.append(open(self.path(shard) / SHARD_INPUT, 'wb'))
+        roots = [0] * shards
+        for line, record in read_jsonl(input_file, raw=True):
+            if not str(record.get("main_category", "")).strip():
+                continue
+            shard = shard_of(record, shards)
+            files[shard].write(line)
+            roots[shard] += 1
+        for file in files:
+            file.close()
+
+        total = sum(roots)
+        self.manifest = {
+            "source": source,
+            "shards": shards,
+            "roots": roots,
+            "pipeline_args": args,
+            "budget": budget,
+            # The total LLM call budget is split by the categories in each shard
+            "budgets": [int(budget) * count // total if budget and total else None for count in roots],
+            "created": time.time(),
+        }
+        temp_file = self.root / f"{MANIFEST}.tmp"
+        with open(temp_file, 'w') as file:
+            json.dump(self.manifest, file, indent=2)
+        os.replace(temp_file, self.root / MANIFEST)
+        print(f"✅ Partitioned {total} categories into {shards} shards in {self.root}: {roots}")
+        return self.manifest
+
+    def state(self, shard):
+        path = self.path(shard)
+        if (path / ".done").exists():
+            return "done"
+        lock = self.try_lock(shard)
+        if lock is None:
+            return "running"
+        lock.close()
+        if (path / ".failed").exists():
+            return "failed"
+        return "pending"
+
+    def try_lock(self, shard):
+        """The shard's lock file, held exclusively, or None if another worker has it"""
+        lock = open(self.path(shard) / ".lock", 'a+')
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock.close()
+            return None
+        return lock
+
+    def run_shard(self, shard, lock, node):
+        path = self.path(shard)
+        lock.seek(0)
+        lock.truncate()
+        lock.write(f"{node} {os.getpid()} {time.time():.0f}\n")
+        lock.flush()
+
+        args = [sys.executable, RUN_PIPELINE, *self.manifest["pipeline_args"], *SHARD_FORMAT]
+        if self.manifest["budgets"][shard] is not None:
+            args += [BUDGET_OPTION, str(self.manifest["budgets"][shard])]
+        print(f"\n[{node}] Running shard {shard} ({self.manifest['roots'][shard]} categories) in {path}")
+        start = time.perf_counter()
+        with open(path / "pipeline.log", 'a') as log:
+            # The pipeline inherits the locked file, so the shard stays claimed until it
+            # exits even if this worker is killed first
+            returncode = subprocess.run(
+                args, cwd=path, stdout=log, stderr=subprocess.STDOUT, pass_fds=(lock.fileno(),)
+            ).returncode
+        elapsed = time.perf_counter() - start
+
+        # A failed stage makes run_pipeline.py exit 1; the merged output must exist as well
+        succeeded = returncode == 0 and (path / SHARD_OUTPUT).exists()
+        marker = path / (".done" if succeeded else ".failed")
+        with open(marker, 'w') as file:
+            json.dump({"node": node, "returncode": returncode, "seconds": round(elapsed, 2)}, file)
+        if succeeded:
+            (path / ".failed").unlink(missing_ok=True)
+            print(f"[{node}] ✅ Shard {shard} done in {elapsed:.1f}s")
+        else:
+            print(f"[{node}] ❌ Shard {shard} failed after {elapsed:.1f}s, see {path / 'pipeline.log'}")
+        return succeeded
+
+    def require_manifest(self):
+        if self.manifest is None:
+            raise RuntimeError(f"No shards in {self.root}; partition the categories first")
+
+    def work(self, node=None, offset=0):
+        """Claim and run shards until none is left unclaimed; each shard is tried once per call"""
+        self.require_manifest()
+        node = node or f"{socket.gethostname()}:{os.getpid()}"
+        shards = self.manifest["shards"]
+        counts = {"done": 0, "failed": 0}
+        # Workers start at different shards so they rarely contend for the same lock
+        for shard in [(offset + index) % shards for index in range(shards)]:
+            if not self.manifest["roots"][shard] or (self.path(shard) / ".done").exists():
+                continue
+            lock = self.try_lock(shard)
+            if lock is None:
+                continue
+            try:
+                # Another worker may have finished it between the check and the lock
+                if (self.path(shard) / ".done").exists():
+                    continue
+                counts["done" if self.run_shard(shard, lock, node) else "failed"] += 1
+            finally:
+                lock.close()
+        return counts
+
+    def status(self):
+        self.require_manifest()
+        states = [self.state(shard) if self.manifest["roots"][shard] else "empty"
+                  for shard in range(self.manifest["shards"])]
+        for shard, state in enumerate(states):
+            print(f"shard-{shard:03d}  {self.manifest['roots'][shard]:>5} categories  {state}")
+        return states
+
+    def conversations(self, shard):
+        for path in sorted((self.path(shard) / SHARD_OUTPUT).glob("*.jsonl")):
+            for row in read_jsonl(path):
+                yield row["conversations"]
+
+    def merge(self, output_file=OUTPUT_FILE, threshold=0.8, format="json", eval_fraction=0.0):
+        """Reassemble the shards' conversations in shard order, dropping exact duplicates
+        and, with a threshold, near-duplicates of the user turn across shards.
+
+        format "json" writes one array to output_file; "jsonl"/"parquet" write train/eval
+        shards into the output_file directory, like data_formatter.py.
+        """
+        states = self.status()
+        pending = [shard for shard, state in enumerate(states) if state not in ("done", "empty")]
+        if pending:
+            raise RuntimeError(f"Shards not done yet: {', '.join(map(str, pending))}")
+
+        seen = set()
+        deduplicator = Deduplicator(["user"], threshold, label="dedup_shards") if threshold else None
+        counts = {"read": 0, "duplicates": 0, "near_duplicates": 0}
+        if format == "json":
+            Path(output_file).parent.mkdir(parents=True, exist_ok=True)
+            out = JsonArrayWriter(output_file, indent=2)
+        else:
+            out = ShardedExporter(output_file, format, eval_fraction=eval_fraction)
+        kept = 0
+        try:
+            for shard, state in enumerate(states):
+                if state != "done":
+                    continue
+                for conversation in self.conversations(shard):
+                    counts["read"] += 1
+                    digest = hashlib.sha256(json.dumps(conversation, sort_keys=True).encode("utf-8")).digest()
+                    if digest in seen:
+                        counts["duplicates"] += 1
+                        continue
+                    seen.add(digest)
+                    user = "\n".join(turn["content"] for turn in conversation if turn.get("role") == "user")
+                    if deduplicator is not None and not deduplicator({"user": user}):
+                        counts["near_duplicates"] += 1
+                        continue
+                    out.write(conversation)
+                    kept += 1
+        finally:
+            out.close()
+
+        print(
+            f"✅ Merged {counts['read']} conversations from {states.count('done')} shards into {output_file}: "
+            f"{kept} kept, {counts['duplicates']} duplicates and {counts['near_duplicates']} near-duplicates removed"
+        )
+        return counts
+
+def run_sharded(shards, workers, pipeline_args, input_file=CATEGORIES_FILE, root=SHARDS_DIR,
+                output_file=None, threshold=0.8, format="json", eval_fraction=0.0):
+    """Partition, run the shards with local worker processes and merge the results"""
+    output_file = output_file or (OUTPUT_FILE if format == "json" else CONVERSATIONS_DIR)
+    shard_set = ShardSet(root)
+    shard_set.partition(input_file, shards, pipeline_args)
+
+    # The same `work` command other nodes run against the shared root
+    start = time.perf_counter()
+    processes = [
+        subprocess.Popen([sys.executable, str(Path(__file__).resolve()), "--root", str(root), "work",
+                          "--offset", str(index * shards // workers)])
+        for index in range(workers)
+    ]
+    failed = sum(process.wait() != 0 for process in processes)
+    print(f"\nShards finished in {time.perf_counter() - start:.1f}s with {workers} workers")
+    if failed:
+        print(f"❌ {failed} workers exited with an error")
+
+    try:
+        shard_set.merge(output_file, threshold, format, eval_fraction)
+    except RuntimeError as e:
+        print(f"❌ {e}")
+        return False
+    return True
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the pipeline in shards across processes or nodes")
+    parser.add_argument("--root", default=SHARDS_DIR, help="Shared directory holding the shards")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    partition_parser = commands.add_parser("partition", help="Split the categories into shards")
+    partition_parser.add_argument("--input", default=CATEGORIES_FILE, help="Categories JSONL file")
+    partition_parser.add_argument("--shards", type=int, required=True, help="Number of shards")
+    partition_parser.add_argument("pipeline_args", nargs=argparse.REMAINDER,
+                                  help="run_pipeline.py options for every shard, after --")
+
+    work_parser = commands.add_parser("work", help="Claim and run shards until none is left")
+    work_parser.add_argument("--node", help="Name of this worker in logs and markers (default host:pid)")
+    work_parser.add_argument("--offset", type=int, default=0, help="Shard to start from")
+
+    commands.add_parser("status", help="Show the state of every shard")
+
+    merge_parser = commands.add_parser("merge", help="Merge and dedup the shards' conversations")
+    merge_parser.add_argument("--output", help=f"Merged JSON file or shard directory (default {OUTPUT_FILE} or {CONVERSATIONS_DIR})")
+    merge_parser.add_argument("--export-format", choices=["json", "jsonl", "parquet"], default="jsonl",
+                              help="Write one JSON array or JSONL/Parquet shards, as loaded by Fine_Tuning.ipynb")
+    merge_parser.add_argument("--eval-fraction", type=float, default=0.0, help="Fraction of conversations held out as eval shards")
+    merge_parser.add_argument("--dedup-threshold", type=float, default=0.8,
+                              help="Similarity of user turns above which conversations count as near-duplicates, 0 to disable")
+    args = parser.parse_args()
+
+    shard_set = ShardSet(args.root)
+    if args.command == "partition":
+        pipeline_args = args.pipeline_args[1:] if args.pipeline_args[:1] == ["--"] else args.pipeline_args
+        shard_set.partition(args.input, args.shards, pipeline_args)
+    elif args.command == "work":
+        counts = shard_set.work(args.node, args.offset)
+        sys.exit(1 if counts["failed"] else 0)
+    elif args.command == "status":
+        shard_set.status()
+    else:
+        output_file = args.output or (OUTPUT_FILE if args.export_format == "json" else CONVERSATIONS_DIR)
+        shard_set.merge(output_file, args.dedup_threshold, args.export_format, args.eval_fraction)
@@ -0,0 +1,225 @@
+import asyncio
+import importlib
+import time
+
+from checkpoint import instruction_hash
+from jsonl_io import dumps, read_jsonl
+from telemetry import telemetry
+
+# Marks the end of an upstream stage's output
+DONE = None
+
+class StreamingStage:
+    """A generative stage that consumes records from a queue instead of a finished file.
+
+    Upstream records are turned into instructions with the stage module's
+    to_instructions() and generated in small batches. Up to max_batches batches are
+    in flight at once, so a slow batch doesn't hold back the ones behind it. Every
+    output record is written to the stage's output file and pushed to the next stage
+    as soon as its batch returns, so downstream stages start on the first records
+    instead of the last.
+    """
+
+    def __init__(self, name, module, output_file, batch_size=8, max_wait=1.0, cache=None, scheduler=None,
+                 router=None, usage=None, options=None, max_batches=8):
+        self.name = name
+        self.module = importlib.import_module(module)
+        self.output_file = output_file
+        self.cache = cache
+        self.scheduler = scheduler
+        self.router = router
+        self.usage = usage
+        self.options = options or {}
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.max_batches = max_batches
+
+        self.records_in = 0
+        self.records_out = 0
+        self.started = None
+        self.finished = None
+
+    async def next_batch(self, inbox):
+        """Wait for one record, then collect whatever else arrives within max_wait.
+
+        Returns the batch and whether the upstream stage is done.
+        """
+        record = await inbox.get()
+        if record is DONE:
+            return [], True
+
+        batch = [record]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                record = await asyncio.wait_for(inbox.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            if record is DONE:
+                return batch, True
+            batch.append(record)
+        return batch, False
+
+    async def process(self, generator, instructions, out, outbox, slots):
+        """Generate one batch and hand its records on; frees its slot when done"""
+        try:
+            records = await generator.generate(instructions)
+            for record in records:
+                out.write(dumps(record) + "\n")
+                if outbox is not None:
+                    await outbox.put(record)
+            out.flush()
+            self.records_out += len(records)
+            self.finished = time.perf_counter()
+        finally:
+            slots.release()
+
+    async def run(self, inbox, outbox=None):
+        generator = self.module.create_generator(
+            self.cache, scheduler=self.scheduler, router=self.router, usage=self.usage, **self.options
+        )
+        seen_keys = []
+        slots = asyncio.Semaphore(self.max_batches)
+        tasks = []
+
+        try:
+            with telemetry.span("stage", stage=self.name, streaming=True), open(self.output_file, 'w') as out:
+                upstream_done = False
+                while not upstream_done:
+                    batch, upstream_done = await self.next_batch(inbox)
+                    self.records_in += len(batch)
+                    telemetry.gauge("queue_depth", inbox.qsize(), stage=self.name)
+
+                    instructions = generator.prepare([
+                        instruction
+                        for record in batch
+                        for instruction in self.module.to_instructions(record)
+                    ])
+                    seen_keys.extend(instruction_hash(instruction) for instruction in instructions)
+                    if not instructions:
+                        continue
+
+                    # Wait for a free slot, then read the next batch while this one runs
+                    await slots.acquire()
+                    # A failed batch stops the stage instead of feeding it more
+                    failed = next((task for task in tasks if task.done() and task.exception()), None)
+                    if failed is not None:
+                        slots.release()
+                        failed.result()
+                    if self.started is None:
+                        self.started = time.perf_counter()
+                    tasks.append(asyncio.create_task(self.process(generator, instructions, out, outbox, slots)))
+                    tasks = [task for task in tasks if not task.done() or task.exception()]
+                await asyncio.gather(*tasks)
+            if generator.journal is not None:
+                generator.journal.compact(seen_keys)
+        finally:
+            for task in tasks:
+                task.cancel()
+            # Always release the downstream stage, even if this one failed
+            if outbox is not None:
+                await outbox.put(DONE)
+            # The cache, scheduler and usage report are shared and owned by the caller
+            if generator.prefilter is not None:
+                generator.prefilter.report()
+                generator.prefilter.close()
+            if generator.journal is not None:
+                generator.journal.close()
+
+    @property
+    def active_time(self):
+        if self.started is None:
+            return 0.0
+        return self.finished - self.started
+
+class StreamingFilter:
+    """A local stage that drops records as they stream past.
+
+    The stage module's create_filter(**options) returns a callable deciding whether
+    to keep each record; kept records are written to the output file and forwarded.
+    The filter's report() is printed once the upstream stage is done.
+    """
+
+    def __init__(self, name, module, output_file, options=None):
+        self.name = name
+        self.module = importlib.import_module(module)
+        self.output_file = output_file
+        self.options = options or {}
+
+        self.records_in = 0
+        self.records_out = 0
+        self.active_time = 0.0
+
+    async def run(self, inbox, outbox=None):
+        keep = self.module.create_filter(**self.options)
+        try:
+            with telemetry.span("stage", stage=self.name, streaming=True), open(self.output_file, 'w') as out:
+                while True:
+                    record = await inbox.get()
+                    if record is DONE:
+                        break
+                    self.records_in += 1
+                    telemetry.gauge("queue_depth", inbox.qsize(), stage=self.name)
+
+                    start = time.perf_counter()
+                    kept = keep(record)
+                    self.active_time += time.perf_counter() - start
+                    if kept:
+                        out.write(dumps(record) + "\n")
+                        out.flush()
+                        self.records_out += 1
+                        if outbox is not None:
+                            await outbox.put(record)
+            keep.report()
+        finally:
+            if outbox is not None:
+                await outbox.put(DONE)
+
+class StreamingPipeline:
+    """Chains generative stages through asyncio queues so their LLM calls overlap"""
+
+    def __init__(self, stages, batch_size=8, max_wait=1.0, cache=None, scheduler=None, router=None, usage=None,
+                 max_batches=8):
+        self.source = stages[0]["inputs"][0]
+        self.stages = [
+            StreamingStage(
+                stage["name"],
+                stage["module"],
+                stage["outputs"][0],
+                batch_size=batch_size,
+                max_wait=max_wait,
+                cache=cache,
+                scheduler=scheduler,
+                router=router,
+                usage=usage,
+                options=stage.get("options"),
+                max_batches=max_batches
+            )
+            if stage.get("generative") else
+            StreamingFilter(stage["name"], stage["module"], stage["outputs"][0], options=stage.get("options"))
+            for stage in stages
+        ]
+
+    async def feed(self, outbox):
+        try:
+            for record in read_jsonl(self.source):
+                await outbox.put(record)
+        finally:
+            await outbox.put(DONE)
+
+    async def run(self):
+        queues = [asyncio.Queue() for _ in self.stages]
+        outboxes = queues[1:] + [None]
+        await asyncio.gather(
+            self.feed(queues[0]),
+            *(
+                stage.run(inbox, outbox)
+                for stage, inbox, outbox in zip(self.stages, queues, outboxes)
+            )
+        )
+
+        for stage in self.stages:
+            print(f"{stage.name:<30} in: {stage.records_in:>6}  out: {stage.records_out:>6}  active: {stage.active_time:>8.2f}s")
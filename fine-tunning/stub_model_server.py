@@ -0,0 +1,148 @@
+import argparse
+import asyncio
+import json
+import random
+import time
+
+from scheduler import ModelScheduler, RateLimitError
+
+# Per-model behaviour: latency in seconds (lognormal around the median), probability
+# of a 429 and of a 500, and how many concurrent requests it serves before answering 429
+DEFAULT_PROFILES = {
+    "gpt-4o-mini": {"latency": 0.3, "rate_limit": 0.05, "error": 0.01, "max_concurrency": 16},
+    "gpt-4o": {"latency": 0.8, "rate_limit": 0.02, "error": 0.01, "max_concurrency": 8},
+    "anthropic/claude-3.5-sonnet": {"latency": 1.2, "rate_limit": 0.10, "error": 0.02, "max_concurrency": 4},
+}
+
+class StubModelServer:
+    """Local HTTP server that imitates model providers with injected latency and errors.
+
+    POST /generate with {"model": ..., "prompt": ...} answers {"model": ..., "output": ...}
+    after the model's simulated latency, or 429/500 according to its profile.
+    """
+
+    def __init__(self, profiles=None, host="127.0.0.1", port=0, responder=None):
+        self.profiles = profiles or DEFAULT_PROFILES
+        self.host = host
+        self.port = port
+        # responder(model, prompt) -> output text
+        self.responder = responder or (lambda model, prompt: f"stub response from {model}")
+        self.active = {model: 0 for model in self.profiles}
+        self.server = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    async def close(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def simulate(self, request):
+        model = request.get("model")
+        profile = self.profiles.get(model)
+        if profile is None:
+            return 404, {"error": f"unknown model {model}"}
+        if self.active[model] >= profile["max_concurrency"] or random.random() < profile["rate_limit"]:
+            return 429, {"error": "rate limit exceeded"}
+
+        self.active[model] += 1
+        try:
+            await asyncio.sleep(random.lognormvariate(0, 0.4) * profile["latency"])
+        finally:
+            self.active[model] -= 1
+
+        if random.random() < profile["error"]:
+            return 500, {"error": "internal error"}
+        return 200, {"model": model, "output": self.responder(model, request.get("prompt", ""))}
+
+    async def handle(self, reader, writer):
+        try:
+            request_line = await reader.readline()
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+            method, path, _ = request_line.decode("latin-1").split(" ", 2)
+            if method != "POST" or path != "/generate":
+                status, payload = 404, {"error": "not found"}
+            else:
+                status, payload = await self.simulate(json.loads(body or b"{}"))
+
+            data = json.dumps(payload).encode("utf-8")
+            writer.write(
+                f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\n"
+                f"Content-Type: application/json\r\nContent-Length: {len(data)}\r\n"
+                f"Connection: close\r\n\r\n".encode("latin-1") + data
+            )
+            await writer.drain()
+        finally:
+            writer.close()
+
+class StubModelClient:
+    """Minimal client for StubModelServer, raising RateLimitError on 429"""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+
+    async def generate(self, model, prompt):
+        body = json.dumps({"model": model, "prompt": prompt}).encode("utf-8")
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        try:
+            writer.write(
+                f"POST /generate HTTP/1.1\r\nHost: {self.host}\r\n"
+                f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n".encode("latin-1") + body
+            )
+            await writer.drain()
+            response = await reader.read()
+        finally:
+            writer.close()
+
+        head, _, payload = response.partition(b"\r\n\r\n")
+        status = int(head.split(b" ", 2)[1])
+        if status == 429:
+            raise RateLimitError(f"{model} answered 429")
+        if status != 200:
+            raise RuntimeError(f"{model} answered {status}")
+        return json.loads(payload)["output"]
+
+async def demo(requests, max_in_flight):
+    """Push requests through ModelScheduler against the stub server and report per-model stats"""
+    async with StubModelServer() as server:
+        client = StubModelClient(server.host, server.port)
+        scheduler = ModelScheduler(list(server.profiles), max_in_flight=max_in_flight, backoff_base=0.2, backoff_max=5)
+
+        start = time.perf_counter()
+        results = await asyncio.gather(
+            *(
+                scheduler.submit(lambda model, i=i: client.generate(model, f"prompt {i}"))
+                for i in range(requests)
+            ),
+            return_exceptions=True
+        )
+        elapsed = time.perf_counter() - start
+
+    failed = sum(isinstance(result, Exception) for result in results)
+    print(f"{requests - failed}/{requests} requests succeeded in {elapsed:.2f}s ({requests / elapsed:.1f} req/s)\n")
+    scheduler.report()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Exercise the model scheduler against a local stub model server")
+    parser.add_argument("--requests", type=int, default=200, help="Number of requests to send")
+    parser.add_argument("--max-in-flight", type=int, default=8, help="In-flight cap per model")
+    args = parser.parse_args()
+
+    asyncio.run(demo(args.requests, args.max_in_flight))
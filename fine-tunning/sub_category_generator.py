@@ -1,78 +1,106 @@
 import asyncio
-import json
-from dria import Prompt, DatasetGenerator, DriaDataset, Model
+from typing import List
+
+from dria import DriaDataset, Model
 from pydantic import BaseModel, Field
 
+from cache import ResponseCache
+from checkpoint import CheckpointJournal
+from generation import StageGenerator
+from jsonl_io import read_jsonl
+
+INPUT_FILE = "datasets/categories.jsonl"
+OUTPUT_FILE = "datasets/sub_categories.jsonl"
+MODELS = [Model.GPT4O_MINI, Model.GPT4O, Model.ANTHROPIC_SONNET_3_5_OR]
+
 # Define output schema
+class SubCategory(BaseModel):
+    sub_category: str = Field(..., description="Sub-category name")
+    description: str = Field(..., description="Description of the sub-category")
+
 class SubCategoryOutput(BaseModel):
     main_category: str = Field(..., description="Main category name")
-    sub_category_1: str = Field(..., description="Sub-category name")
-    description_1: str = Field(..., description="Description of the sub-category")
-    sub_category_2: str = Field(..., description="Sub-category name")
-    description_2: str = Field(..., description="Description of the sub-category")
-    sub_category_3: str = Field(..., description="Sub-category name")
-    description_3: str = Field(..., description="Description of the sub-category")
-
-# Define the prompt template
+    sub_categories: List[SubCategory] = Field(..., description="Sub-categories of the main category")
+
+# Define the prompt template; {{count}} is the fan-out, filled in by create_generator
 PROMPT_TEMPLATE = """
 For the following main category:
 {{category}}
 
-Generate 3 specific sub-categories. Each sub-category should:
+Generate {{count}} specific sub-categories. Each sub-category should:
 1. Be a specific subset of the main category
 2. Have clear, defined boundaries
 3. Be suitable for information extraction tasks
 4. Have practical business applications
+5. Be clearly distinct from the other sub-categories
 
-Return the response as a JSON with the following format:
-Sub-Category_1: [name]
-Description_1: [detailed description]
-
-Sub-Category_2: [name]
-Description_2: [detailed description]
-
-Sub-Category_3: [name]
-Description_3: [detailed description]
+Return the response as a JSON with the main category and a list of sub-categories,
+each with:
+Sub-Category: [name]
+Description: [detailed description]
 
-Generate exactly a unique sub-category, without any numbering or prefixes.
+Name each sub-category without any numbering or prefixes.
 """
 
-# Create dataset
-dataset = DriaDataset(
-    name="sub_categories",
-    description="A dataset of sub-categories for information extraction",
-    schema=SubCategoryOutput
-).reset()
-
-# Read categories from JSONL file
-categories = []
-with open('datasets/categories.jsonl', 'r') as file:
-    for line in file:
-        category_data = json.loads(line)
-        if 'main_category' in category_data and category_data['main_category'].strip():
-            categories.append(category_data['main_category'])
-
-print(f"Loaded {len(categories)} categories for processing")
-
-# Create instructions for all categories
-instructions = [{"category": category} for category in categories]
-
-# Create prompt
-prompter = Prompt(prompt=PROMPT_TEMPLATE, schema=SubCategoryOutput)
-
-generator = DatasetGenerator(dataset=dataset)
-
-# Run generation
-asyncio.run(
-    generator.generate(
-        instructions=instructions,
-        singletons=prompter,
-        models=[Model.GPT4O_MINI,Model.GPT4O,Model.ANTHROPIC_SONNET_3_5_OR]
+def create_dataset():
+    return DriaDataset(
+        name="sub_categories",
+        description="A dataset of sub-categories for information extraction",
+        schema=SubCategoryOutput
     )
-)
 
-# Export results to JSONL file
-dataset.to_jsonl("datasets/sub_categories.jsonl")
+def expand_record(record, fanout=3):
+    """Split a SubCategoryOutput record into one sub_categories.jsonl line per sub-category"""
+    return [
+        {
+            "main_category": record.get("main_category", ""),
+            "sub_category": item.get("sub_category", ""),
+            "description": item.get("description", "")
+        }
+        for item in (record.get("sub_categories") or [])[:fanout]
+        if isinstance(item, dict)
+    ]
+
+def create_generator(cache=None, resume=True, scheduler=None, router=None, usage=None, fanout=3, limit=None):
+    return StageGenerator(
+        stage="sub_categories",
+        dataset=create_dataset(),
+        prompt_template=PROMPT_TEMPLATE.replace("{{count}}", str(fanout)),
+        schema=SubCategoryOutput,
+        models=MODELS,
+        cache=cache,
+        journal=CheckpointJournal("sub_categories") if resume else None,
+        scheduler=scheduler,
+        router=router,
+        usage=usage,
+        expand=lambda record: expand_record(record, fanout),
+        limit=limit
+    )
+
+def to_instructions(category_data):
+    """Build the instructions for one categories.jsonl record"""
+    if 'main_category' in category_data and category_data['main_category'].strip():
+        return [{"category": category_data['main_category']}]
+    return []
+
+def load_instructions(input_file=INPUT_FILE):
+    """Lazily read categories from JSONL file"""
+    for category_data in read_jsonl(input_file, fields=["main_category"]):
+        yield from to_instructions(category_data)
+
+async def run(input_file=INPUT_FILE, output_file=OUTPUT_FILE, use_cache=True, resume=True,
+              scheduler=None, router=None, usage=None, fanout=3, limit=None):
+    # Create generator; journaled instructions are resumed and unchanged ones served from cache
+    generator = create_generator(ResponseCache() if use_cache else None, resume, scheduler, router, usage,
+                                 fanout, limit)
+
+    instructions = load_instructions(input_file)
+
+    # Run generation and export results to JSONL file
+    await generator.run(instructions, output_file)
+
+    # Print confirmation
+    print(f"Results have been exported to {output_file}")
 
-# Print confirmation
-print("Results have been exported to datasets/sub_categories.jsonl") 
\ No newline at end of file
+if __name__ == "__main__":
+    asyncio.run(run())
@@ -1,75 +1,118 @@
 import asyncio
-import json
-from dria import Prompt, DatasetGenerator, DriaDataset, Model
+from typing import List
+
+from dria import DriaDataset, Model
 from pydantic import BaseModel, Field
 
+from cache import ResponseCache
+from checkpoint import CheckpointJournal
+from generation import StageGenerator
+from jsonl_io import read_jsonl
+
+INPUT_FILE = "datasets/sub_categories.jsonl"
+OUTPUT_FILE = "datasets/subjects.jsonl"
+MODELS = [Model.GPT4O_MINI, Model.GPT4O, Model.ANTHROPIC_SONNET_3_5_OR]
+
 # Define output schema
-class SubjectOutput(BaseModel):
+class Subject(BaseModel):
     subject: str = Field(..., description="Subject name for the extraction task")
     description: str = Field(..., description="Description of what to extract")
 
-# Define the prompt template
+class SubjectOutput(BaseModel):
+    subjects: List[Subject] = Field(..., description="Subjects for the sub-category")
+
+# Define the prompt template; {{count}} is the fan-out, filled in by create_generator
 PROMPT_TEMPLATE = """
 For the following sub-category of {{main_category}}:
 {{sub_category}}
 
 Description: {{description}}
 
-Generate a specific subject for information extraction. The subject should:
+Generate {{count}} specific subjects for information extraction. Each subject should:
 1. Be focused and specific
 2. Clearly define what information needs to be extracted
 3. Be practical and business-relevant
 4. Include clear extraction guidelines
+5. Differ from the other subjects in what is extracted
 
-Format your response EXACTLY as:
+Return the response as a JSON with a list of subjects, each with:
 Subject: [specific subject name]
 Description: [description of the information extraction task, the expected values to be extracted]
 """
 
-# Create dataset
-dataset = DriaDataset(
-    name="subjects",
-    description="A dataset of subjects for information extraction",
-    schema=SubjectOutput
-).reset()
-
-# Read sub-categories from JSONL file
-instructions = []
-with open('datasets/sub_categories.jsonl', 'r') as file:
-    for line in file:
-        item = json.loads(line)
-        # Check if main_category exists
-        if "main_category" not in item or not item["main_category"].strip():
-            continue
-            
-        # Process each sub-category (1-3)
-        for i in range(1, 4):
-            sub_cat_key = f"sub_category_{i}"
-            desc_key = f"description_{i}"
-            
-            if all(key in item and item[key].strip() for key in [sub_cat_key, desc_key]):
-                instructions.append({
-                    "main_category": item["main_category"],
-                    "sub_category": item[sub_cat_key],
-                    "description": item[desc_key]
-                })
-
-# Create prompt
-prompter = Prompt(prompt=PROMPT_TEMPLATE, schema=SubjectOutput)
-
-generator = DatasetGenerator(dataset=dataset)
-
-# Run generation
-asyncio.run(
-    generator.generate(
-        instructions=instructions,
-        singletons=prompter,
-        models=[Model.GPT4O_MINI,Model.GPT4O,Model.ANTHROPIC_SONNET_3_5_OR]
+def create_dataset():
+    return DriaDataset(
+        name="subjects",
+        description="A dataset of subjects for information extraction",
+        schema=SubjectOutput
+    )
+
+def expand_record(record, fanout=1):
+    """Split a SubjectOutput record into one subjects.jsonl line per subject"""
+    return [
+        {"subject": item.get("subject", ""), "description": item.get("description", "")}
+        for item in (record.get("subjects") or [])[:fanout]
+        if isinstance(item, dict)
+    ]
+
+def create_generator(cache=None, resume=True, scheduler=None, router=None, usage=None, fanout=1, limit=None):
+    return StageGenerator(
+        stage="subjects",
+        dataset=create_dataset(),
+        prompt_template=PROMPT_TEMPLATE.replace("{{count}}", str(fanout)),
+        schema=SubjectOutput,
+        models=MODELS,
+        cache=cache,
+        journal=CheckpointJournal("subjects") if resume else None,
+        scheduler=scheduler,
+        router=router,
+        usage=usage,
+        expand=lambda record: expand_record(record, fanout),
+        limit=limit
     )
-)
 
-# Export results to JSON file
-dataset.to_jsonl("datasets/subjects.jsonl")
+def to_instructions(item):
+    """Build the instructions for one sub_categories.jsonl line.
+
+    Lines hold a single sub-category; older files with sub_category_1..3 slots per
+    main category are still accepted.
+    """
+    # Check if main_category exists
+    if "main_category" not in item or not item["main_category"].strip():
+        return []
+
+    slots = [("sub_category", "description")]
+    if "sub_category" not in item:
+        slots = [(f"sub_category_{i}", f"description_{i}") for i in range(1, 4)]
+
+    instructions = []
+    for sub_cat_key, desc_key in slots:
+        if all(key in item and item[key].strip() for key in [sub_cat_key, desc_key]):
+            instructions.append({
+                "main_category": item["main_category"],
+                "sub_category": item[sub_cat_key],
+                "description": item[desc_key]
+            })
+    return instructions
+
+def load_instructions(input_file=INPUT_FILE):
+    """Lazily read sub-categories from JSONL file"""
+    for item in read_jsonl(input_file):
+        yield from to_instructions(item)
+
+async def run(input_file=INPUT_FILE, output_file=OUTPUT_FILE, use_cache=True, resume=True,
+              scheduler=None, router=None, usage=None, fanout=1, limit=None):
+    # Create generator; journaled instructions are resumed and unchanged ones served from cache
+    generator = create_generator(ResponseCache() if use_cache else None, resume, scheduler, router, usage,
+                                 fanout, limit)
+
+    instructions = load_instructions(input_file)
+
+    # Run generation and export results to JSONL file
+    await generator.run(instructions, output_file)
+
+    # Print confirmation
+    print(f"Results have been exported to {output_file}")
 
-# Print confirmation
-print("Results have been exported to datasets/subjects.jsonl")
\ No newline at end of file
+if __name__ == "__main__":
+    asyncio.run(run())
@@ -0,0 +1,226 @@
+import argparse
+import contextvars
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+TELEMETRY_FILE = "datasets/telemetry.jsonl"
+PREFIX = "pipeline_"
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+class Span:
+    """One timed operation, OpenTelemetry-style: ids, parent, attributes, status.
+
+    Used as a context manager; spans opened inside it (also in tasks it starts)
+    become its children. Attributes known only at the end go in through set().
+    """
+
+    def __init__(self, telemetry, name, attributes):
+        parent = _current_span.get()
+        self.telemetry = telemetry
+        self.name = name
+        self.attributes = attributes
+        self.trace_id = parent.trace_id if parent is not None else telemetry.trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent.span_id if parent is not None else None
+        self.status = "ok"
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def __enter__(self):
+        self.start = time.time()
+        self.perf_start = time.perf_counter()
+        self.token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.duration = time.perf_counter() - self.perf_start
+        if exc_type is not None:
+            self.status = "error"
+            self.attributes["error"] = f"{exc_type.__name__}: {exc}"
+        _current_span.reset(self.token)
+        self.telemetry.finish(self)
+
+    def to_dict(self):
+        return {
+            "type": "span",
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start": round(self.start, 6),
+            "duration": round(self.duration, 6),
+            "status": self.status,
+            "attributes": self.attributes,
+        }
+
+class NullSpan:
+    """What span() returns while telemetry is off"""
+
+    def set(self, **attributes):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        pass
+
+NULL_SPAN = NullSpan()
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        data = self.server.telemetry.prometheus_text().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+class Telemetry:
+    """Spans and metrics for the whole pipeline, off until enable() is called.
+
+    Finished spans are appended to a JSONL file as they end; counters and gauges
+    are kept in memory, written to the same file on close and, with a port, served
+    in Prometheus text format at http://<host>:<port>/metrics during the run.
+    Every finished span also adds to the span_seconds_total and spans_total
+    counters, so wall-clock time per stage shows up in Prometheus too. While off,
+    span() returns a no-op and count()/gauge() return immediately.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.trace_id = os.urandom(16).hex()
+        self.counters = defaultdict(float)
+        self.gauges = {}
+        self.file = None
+        self.server = None
+
+    def enable(self, path=TELEMETRY_FILE, port=None, host="127.0.0.1"):
+        self.enabled = True
+        if path:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            self.file = open(path, 'a', buffering=1)
+        if port is not None:
+            self.server = ThreadingHTTPServer((host, port), MetricsHandler)
+            self.server.telemetry = self
+            threading.Thread(target=self.server.serve_forever, daemon=True).start()
+            print(f"Serving Prometheus metrics on http://{host}:{self.server.server_port}/metrics")
+        return self
+
+    def span(self, name, **attributes):
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, name, attributes)
+
+    @staticmethod
+    def key(name, labels):
+        return name, tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+    def count(self, name, value=1, **labels):
+        if not self.enabled or not value:
+            return
+        with self.lock:
+            self.counters[self.key(name, labels)] += value
+
+    def gauge(self, name, value, **labels):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.gauges[self.key(name, labels)] = value
+
+    def finish(self, span):
+        labels = {"span": span.name}
+        if "stage" in span.attributes:
+            labels["stage"] = span.attributes["stage"]
+        self.count("span_seconds_total", span.duration, **labels)
+        self.count("spans_total", **labels)
+        if span.status == "error":
+            self.count("span_errors_total", **labels)
+        if self.file is not None:
+            line = json.dumps(span.to_dict(), default=str) + "\n"
+            with self.lock:
+                self.file.write(line)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "counters": [{"name": name, "labels": dict(labels), "value": value}
+                             for (name, labels), value in sorted(self.counters.items())],
+                "gauges": [{"name": name, "labels": dict(labels), "value": value}
+                           for (name, labels), value in sorted(self.gauges.items())],
+            }
+
+    def prometheus_text(self):
+        lines = []
+        snapshot = self.snapshot()
+        for kind, metrics in (("counter", snapshot["counters"]), ("gauge", snapshot["gauges"])):
+            typed = set()
+            for metric in metrics:
+                name = PREFIX + metric["name"]
+                if name not in typed:
+                    lines.append(f"# TYPE {name} {kind}")
+                    typed.add(name)
+                labels = ",".join(f'{key}="{escape_label(value)}"' for key, value in metric["labels"].items())
+                lines.append(f"{name}{{{labels}}} {metric['value']:g}" if labels else f"{name} {metric['value']:g}")
+        return "\n".join(lines) + "\n"
+
+    def close(self):
+        if not self.enabled:
+            return
+        if self.file is not None:
+            self.file.write(json.dumps({"type": "metrics", "time": round(time.time(), 6), **self.snapshot()}) + "\n")
+            self.file.close()
+            self.file = None
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+        self.enabled = False
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+# Shared by every module of the pipeline
+telemetry = Telemetry()
+
+def summarize(path=TELEMETRY_FILE):
+    """Print where wall-clock time and tokens went, from a telemetry file"""
+    spans = defaultdict(lambda: {"count": 0, "seconds": 0.0, "input_tokens": 0, "output_tokens": 0, "errors": 0})
+    for line in open(path):
+        record = json.loads(line)
+        if record.get("type") != "span":
+            continue
+        attributes = record["attributes"]
+        row = spans[(record["name"], attributes.get("stage", ""), attributes.get("model", ""))]
+        row["count"] += 1
+        row["seconds"] += record["duration"]
+        row["input_tokens"] += attributes.get("input_tokens", 0)
+        row["output_tokens"] += attributes.get("output_tokens", 0)
+        row["errors"] += record["status"] == "error"
+
+    print(f"{'Span':<16} {'Stage':<30} {'Model':<30} {'count':>6} {'seconds':>9} {'in tok':>10} {'out tok':>9} {'errors':>6}")
+    for (name, stage, model), row in sorted(spans.items(), key=lambda item: -item[1]["seconds"]):
+        print(
+            f"{name:<16} {stage:<30} {model[:30]:<30} {row['count']:>6} {row['seconds']:>9.2f} "
+            f"{row['input_tokens']:>10} {row['output_tokens']:>9} {row['errors']:>6}"
+        )
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summarize a pipeline telemetry file")
+    parser.add_argument("file", nargs="?", default=TELEMETRY_FILE, help="Telemetry JSONL file")
+    args = parser.parse_args()
+
+    summarize(args.file)
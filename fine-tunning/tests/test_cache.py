@@ -0,0 +1,22 @@
+import sqlite3
+
+from cache import ResponseCache
+
+def committed(path):
+    with sqlite3.connect(path) as db:
+        return db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+def test_puts_are_committed_in_batches_and_on_close(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    cache = ResponseCache(path, commit_every=4)
+    for index in range(6):
+        cache.put(f"key{index}", "test", {"answer": index})
+    # The first four went out in one transaction, the last two are still pending
+    assert committed(path) == 4
+    assert cache.get("key5") == {"answer": 5}
+
+    cache.close()
+    assert committed(path) == 6
+    reopened = ResponseCache(path)
+    assert reopened.get("key5") == {"answer": 5}
+    reopened.close()
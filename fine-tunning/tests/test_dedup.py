@@ -0,0 +1,40 @@
+import json
+
+from dedup import Deduplicator
+
+BASE = "the quick brown fox jumps over the lazy dog near the quiet river bank at dawn"
+
+def test_clusters_refer_to_records_by_position_and_preview(tmp_path):
+    deduplicator = Deduplicator(["text"], threshold=0.8)
+    records = [{"text": BASE}, {"text": "something else entirely " * 10}, {"text": BASE + "!"}]
+    assert [deduplicator(record) for record in records] == [True, True, False]
+    assert not hasattr(deduplicator, "kept")
+
+    deduplicator.write_clusters(str(tmp_path / "clusters.jsonl"))
+    with open(tmp_path / "clusters.jsonl") as file:
+        clusters = [json.loads(line) for line in file]
+    assert clusters == [{
+        "kept": {"position": 0, "preview": BASE},
+        "removed": [{"position": 2, "similarity": 1.0, "preview": BASE + "!"}]
+    }]
+    assert len(deduplicator.previews[1]) == 80
+
+WORDS = "alpha beta gamma delta epsilon zeta eta theta iota kappa lambda mu nu xi omicron pi rho sigma tau upsilon".split()
+
+def variant(changed):
+    """WORDS with the last `changed` words replaced: 1 shares ~0.9 of its shingles, 6 ~0.5"""
+    return " ".join(WORDS[:len(WORDS) - changed] + [f"new{index}" for index in range(changed)])
+
+def test_threshold_decides_which_near_duplicates_are_dropped():
+    strict = Deduplicator(["text"], threshold=0.8)
+    assert [strict({"text": variant(changed)}) for changed in (0, 1, 6)] == [True, False, True]
+    assert strict.removed == 1
+
+    loose = Deduplicator(["text"], threshold=0.4)
+    assert [loose({"text": variant(changed)}) for changed in (0, 1, 6)] == [True, False, False]
+
+def test_only_the_given_fields_are_compared():
+    deduplicator = Deduplicator(["subject"])
+    assert deduplicator({"subject": "Tokyo", "description": variant(0)})
+    assert deduplicator({"subject": "Osaka", "description": variant(0)})
+    assert not deduplicator({"subject": "tokyo", "description": variant(6)})
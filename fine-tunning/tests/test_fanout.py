@@ -0,0 +1,30 @@
+import pytest
+
+from fanout import DEFAULT_FANOUT, FanoutPlan, parse_fanout
+
+def test_parse_fanout_overrides_the_defaults():
+    assert parse_fanout(None) == DEFAULT_FANOUT
+    assert parse_fanout("sub_categories=5, subjects=2") == {"sub_categories": 5, "subjects": 2, "contexts": 1}
+
+@pytest.mark.parametrize("text, message", [("topics=2", "Unknown fan-out level"), ("contexts=0", "at least 1")])
+def test_parse_fanout_rejects_bad_levels(text, message):
+    with pytest.raises(ValueError, match=message):
+        parse_fanout(text)
+
+def test_calls_multiply_down_the_tree():
+    plan = FanoutPlan(2, {"sub_categories": 3, "subjects": 2, "contexts": 2})
+    # Sub-categories and subjects come back as lists, each context is its own call
+    assert plan.calls() == {"sub_categories": 2, "subjects": 6, "contexts": 24, "extractions": 24, "validations": 24}
+    assert plan.total() == 80
+
+def test_budget_picks_the_fanout_with_the_most_contexts():
+    plan = FanoutPlan(1, {"sub_categories": 3, "subjects": 2, "contexts": 2}, budget=30)
+    assert plan.fanout == {"sub_categories": 2, "subjects": 2, "contexts": 2}
+    assert plan.total() <= 30
+
+def test_budget_below_a_fanout_of_one_drops_categories():
+    plan = FanoutPlan(3, budget=13)
+    assert plan.fanout == {"sub_categories": 1, "subjects": 1, "contexts": 1}
+    # Five calls per category with a fan-out of 1 everywhere
+    assert plan.roots == 2
+    assert plan.limits()["contexts"] == 2
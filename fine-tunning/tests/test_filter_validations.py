@@ -0,0 +1,64 @@
+import json
+
+import pytest
+
+from filter_validations import filter_validations
+from predicates import DEFAULT_WHERE
+
+def validation(subject, accurate=True, score=0.9):
+    result = {"is_complete": True, "is_accurate": accurate, "format_valid": True,
+              "missing_fields": [], "incorrect_fields": []}
+    return {"subject": subject, "validation_result": json.dumps(result), "quality_score": score}
+
+def prevalidated(subject, grounding=1.0):
+    return {"subject": subject, "prevalidation": {"verdict": "accept", "grounding": grounding,
+                                                  "key_coverage": 1.0, "null_ratio": 0.0}}
+
+def write_rows(path, rows):
+    with open(path, 'w') as file:
+        file.writelines(json.dumps(row) + "\n" for row in rows)
+
+def kept(tmp_path, rows, where=DEFAULT_WHERE, workers=1):
+    write_rows(tmp_path / "in.jsonl", rows)
+    filter_validations(str(tmp_path / "in.jsonl"), str(tmp_path / "out.jsonl"), workers, where)
+    with open(tmp_path / "out.jsonl") as file:
+        return [json.loads(line)["subject"] for line in file]
+
+def test_default_filter_keeps_prevalidated_rows(tmp_path):
+    rows = [validation("a"), validation("b", accurate=False), prevalidated("c")]
+    assert kept(tmp_path, rows) == ["a", "c"]
+
+def test_custom_filter_is_applied_to_prevalidated_rows(tmp_path):
+    rows = [validation("a", score=0.9), validation("b", score=0.5), prevalidated("c", 0.95), prevalidated("d", 0.6)]
+    # Pre-validated rows have no quality_score, and LLM-validated rows no grounding
+    assert kept(tmp_path, rows, "quality_score >= 0.7") == ["a"]
+    assert kept(tmp_path, rows, "grounding >= 0.9") == ["c"]
+
+def test_custom_filter_on_validation_fields_rejects_prevalidated_rows(tmp_path):
+    with pytest.raises(ValueError, match="is_accurate"):
+        kept(tmp_path, [validation("a"), prevalidated("b")], "is_accurate and quality_score >= 0.7")
+
+def test_byte_ranges_split_on_line_boundaries(tmp_path):
+    from parallel import byte_ranges
+
+    path = tmp_path / "in.jsonl"
+    path.write_text("".join(json.dumps({"n": n, "pad": "x" * (n % 7)}) + "\n" for n in range(50)))
+    ranges = byte_ranges(path, 8)
+    assert ranges[0][0] == 0 and ranges[-1][1] == path.stat().st_size
+    assert all(end == next_start for (_, end), (next_start, _) in zip(ranges, ranges[1:]))
+    data = path.read_bytes()
+    assert all(data[start - 1:start] == b"\n" for start, _ in ranges[1:])
+
+@pytest.mark.parametrize("where", [DEFAULT_WHERE, "quality_score >= 0.7"])
+def test_parallel_filter_matches_serial_byte_for_byte(tmp_path, where):
+    rows = [validation(f"s{n}", accurate=n % 3 != 0, score=(n % 10) / 10) for n in range(200)]
+    rows[7]["validation_result"] = "not json at all"
+    rows[11] = prevalidated("p11")
+    write_rows(tmp_path / "in.jsonl", rows)
+
+    serial = filter_validations(str(tmp_path / "in.jsonl"), str(tmp_path / "serial.jsonl"), 1, where)
+    parallel = filter_validations(str(tmp_path / "in.jsonl"), str(tmp_path / "parallel.jsonl"), 3, where)
+
+    assert (tmp_path / "parallel.jsonl").read_bytes() == (tmp_path / "serial.jsonl").read_bytes()
+    assert parallel == serial
+    assert 0 < serial["kept"] < 200
@@ -0,0 +1,164 @@
+import asyncio
+import json
+
+import pytest
+from pydantic import BaseModel
+
+pytest.importorskip("dria")
+
+import generation
+from checkpoint import CheckpointJournal
+
+class Output(BaseModel):
+    category: str
+    answer: str
+
+class FakePrompt:
+    def __init__(self, prompt, schema):
+        self.prompt = prompt
+        self.schema = schema
+
+class FakeDataset:
+    def __init__(self, name="fake", description="", schema=None):
+        self.entries = []
+
+    def reset(self):
+        self.entries = []
+        return self
+
+    def get_entries(self, data_only=False):
+        return list(self.entries)
+
+class FlakySDK:
+    """Answers each instruction like the SDK would, with some calls dropped or failing"""
+
+    def __init__(self, dropped=(), failing=(), delay=0.0):
+        self.dropped = set(dropped)
+        self.failing = set(failing)
+        self.delay = delay
+        self.calls = []
+        self.in_flight = 0
+        self.peak = 0
+
+    def generator(self, dataset):
+        sdk = self
+
+        class Generator:
+            async def generate(self, instructions, singletons, models):
+                sdk.in_flight += 1
+                sdk.peak = max(sdk.peak, sdk.in_flight)
+                await asyncio.sleep(sdk.delay)
+                sdk.in_flight -= 1
+                for instruction in instructions:
+                    sdk.calls.append(instruction["category"])
+                    if instruction["category"] in sdk.failing:
+                        raise RuntimeError("connection reset")
+                    if instruction["category"] in sdk.dropped:
+                        continue
+                    # Models re-type echoed fields, e.g. with different whitespace
+                    dataset.entries.append({"category": f" {instruction['category']}\n",
+                                            "answer": f"answer {instruction['category']}"})
+
+        return Generator()
+
+@pytest.fixture
+def sdk(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    sdk = FlakySDK()
+    monkeypatch.setattr(generation, "DatasetGenerator", lambda dataset: sdk.generator(dataset))
+    monkeypatch.setattr(generation, "DriaDataset", FakeDataset)
+    monkeypatch.setattr(generation, "Prompt", FakePrompt)
+    return sdk
+
+def run_stage(output_file, count=6, journal=True, **options):
+    generator = generation.StageGenerator(
+        stage="test", dataset=FakeDataset(), prompt_template="Answer {{category}}", schema=Output,
+        models=["model"], journal=CheckpointJournal("test") if journal else None
+    )
+    asyncio.run(generator.run(({"category": f"c{i}"} for i in range(count)), output_file, **options))
+
+def read_output(path):
+    with open(path) as file:
+        return [json.loads(line)["answer"] for line in file]
+
+def test_partial_failure_chunk_keeps_answered_records_and_retries_the_rest(sdk):
+    sdk.dropped = {"c1"}
+    sdk.failing = {"c4"}
+    run_stage("out.jsonl")
+    assert read_output("out.jsonl") == ["answer c0", "answer c2", "answer c3", "answer c5"]
+
+    sdk.dropped = sdk.failing = set()
+    sdk.calls = []
+    run_stage("out.jsonl")
+    assert sorted(sdk.calls) == ["c1", "c4"]
+    assert read_output("out.jsonl") == [f"answer c{i}" for i in range(6)]
+
+def test_every_call_failing_raises(sdk):
+    sdk.failing = {f"c{i}" for i in range(6)}
+    with pytest.raises(RuntimeError):
+        run_stage("out.jsonl")
+
+def test_chunks_overlap_and_complete_in_order(sdk):
+    sdk.delay = 0.02
+    run_stage("out.jsonl", count=20, journal=False, chunk_size=2, max_chunks=4)
+    # Four chunks of two calls each in flight at once
+    assert sdk.peak == 8
+    assert read_output("out.jsonl") == [f"answer c{i}" for i in range(20)]
+
+class FixedRouter:
+    def __init__(self, models):
+        self.models = models
+
+    def route(self, stage, models, input_tokens):
+        return self.models
+
+def test_cache_is_keyed_on_the_routed_models(sdk, tmp_path):
+    from cache import ResponseCache
+
+    def run_routed(models):
+        generator = generation.StageGenerator(
+            stage="test", dataset=FakeDataset(), prompt_template="Answer {{category}}", schema=Output,
+            models=["cheap", "strong"], cache=ResponseCache(str(tmp_path / "cache.sqlite")),
+            router=FixedRouter(models)
+        )
+        asyncio.run(generator.run([{"category": "c0"}], "out.jsonl"))
+
+    run_routed(["cheap"])
+    run_routed(["cheap"])
+    assert sdk.calls == ["c0"]
+    # A new routing table is a different request, not a cache hit
+    run_routed(["strong"])
+    assert sdk.calls == ["c0", "c0"]
+
+def test_each_call_is_traced_with_the_scheduled_model(sdk, monkeypatch, tmp_path):
+    from scheduler import ModelScheduler
+    from telemetry import Telemetry
+
+    tracer = Telemetry().enable(str(tmp_path / "telemetry.jsonl"))
+    monkeypatch.setattr(generation, "telemetry", tracer)
+    generator = generation.StageGenerator(
+        stage="test", dataset=FakeDataset(), prompt_template="Answer {{category}}", schema=Output,
+        models=["cheap", "strong"], scheduler=ModelScheduler(["cheap", "strong"], max_in_flight=2)
+    )
+    asyncio.run(generator.run(({"category": f"c{i}"} for i in range(6)), "out.jsonl"))
+    tracer.close()
+
+    with open(tmp_path / "telemetry.jsonl") as file:
+        spans = [line for line in map(json.loads, file) if line.get("name") == "llm.generate"]
+    assert len(spans) == 6
+    assert {span["attributes"]["model"] for span in spans} <= {"cheap", "strong"}
+    calls = {dict(labels)["model"]: value for (name, labels), value in tracer.counters.items() if name == "llm_calls_total"}
+    assert set(calls) <= {"cheap", "strong"}
+    assert sum(calls.values()) == 6
+
+def test_prepare_expands_variants_and_stops_at_the_limit(sdk):
+    generator = generation.StageGenerator(
+        stage="test", dataset=FakeDataset(), prompt_template="Answer {{category}}", schema=Output,
+        models=["model"], variants=2, limit=5
+    )
+    first = generator.prepare([{"category": "a"}, {"category": "b"}])
+    assert first == [{"category": "a", "variant": 1}, {"category": "a", "variant": 2},
+                     {"category": "b", "variant": 1}, {"category": "b", "variant": 2}]
+    # The limit spans calls, so only one more instruction is admitted
+    assert generator.prepare([{"category": "c"}]) == [{"category": "c", "variant": 1}]
+    assert generator.over_limit == 1
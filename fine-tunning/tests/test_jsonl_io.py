@@ -0,0 +1,60 @@
+import json
+
+import pytest
+
+from jsonl_io import JsonArrayWriter, JsonlWriter, array_element, read_jsonl
+
+def test_read_jsonl_skips_blank_lines_and_projects_fields(tmp_path):
+    path = tmp_path / "in.jsonl"
+    path.write_bytes(b'{"a": 1, "b": "x"}\n\n{"a": 2, "b": "y"}')
+
+    assert list(read_jsonl(path)) == [{"a": 1, "b": "x"}, {"a": 2, "b": "y"}]
+    assert list(read_jsonl(path, fields=["a"])) == [{"a": 1}, {"a": 2}]
+    # A last line without a newline gets one, so raw lines can be copied as they are
+    assert [line for line, _ in read_jsonl(path, raw=True)] == [b'{"a": 1, "b": "x"}\n', b'{"a": 2, "b": "y"}\n']
+
+def test_read_jsonl_byte_range_takes_the_lines_starting_in_it(tmp_path):
+    path = tmp_path / "in.jsonl"
+    lines = [json.dumps({"n": n}) + "\n" for n in range(4)]
+    path.write_text("".join(lines))
+    middle = len(lines[0]) + 1
+
+    first = [record["n"] for record in read_jsonl(path, start=0, end=middle)]
+    second = [record["n"] for record in read_jsonl(path, start=len(lines[0]), end=None)]
+    assert first == [0, 1]
+    assert second == [1, 2, 3]
+
+def test_writer_replaces_the_target_only_on_success(tmp_path):
+    path = tmp_path / "out.jsonl"
+    path.write_text("old\n")
+    with pytest.raises(RuntimeError):
+        with JsonlWriter(path) as writer:
+            writer.write({"n": 1})
+            raise RuntimeError("stage failed")
+    assert path.read_text() == "old\n"
+    assert not (tmp_path / ".out.jsonl.tmp").exists()
+
+    with JsonlWriter(path) as writer:
+        writer.write_all([{"n": 1}, {"n": 2}])
+    assert [json.loads(line) for line in path.read_text().splitlines()] == [{"n": 1}, {"n": 2}]
+    assert writer.count == 2
+
+@pytest.mark.parametrize("indent", [None, 2])
+def test_json_array_writer_matches_json_dump(tmp_path, indent):
+    items = [{"role": "user", "content": "hi"}, [1, 2], "text"]
+    with JsonArrayWriter(tmp_path / "direct.json", indent=indent) as writer:
+        for item in items:
+            writer.write(item)
+    assert (tmp_path / "direct.json").read_text() == json.dumps(items, indent=indent)
+
+    # Elements serialized by workers and copied in, as data_formatter.py does
+    part = tmp_path / "part"
+    part.write_text("".join(array_element(item, indent) for item in items))
+    with JsonArrayWriter(tmp_path / "copied.json", indent=indent) as writer:
+        writer.copy_from(part, len(items))
+    assert (tmp_path / "copied.json").read_text() == json.dumps(items, indent=indent)
+
+def test_empty_json_array(tmp_path):
+    with JsonArrayWriter(tmp_path / "empty.json", indent=2):
+        pass
+    assert json.loads((tmp_path / "empty.json").read_text()) == []
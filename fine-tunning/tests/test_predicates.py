@@ -0,0 +1,44 @@
+import pytest
+
+from predicates import DEFAULT_WHERE, Predicate, parse_json_lenient
+
+@pytest.mark.parametrize("expression, message", [
+    ("().__class__", "Unsupported syntax in predicate: Attribute"),
+    ("[x for x in missing_fields]", "Unsupported syntax in predicate: ListComp"),
+    ("lambda: True", "Unsupported syntax in predicate: Lambda"),
+    ("__import__('os')", "Only len, abs"),
+    ("open('validations.jsonl')", "Only len, abs"),
+])
+def test_unsafe_expressions_are_rejected(expression, message):
+    with pytest.raises(ValueError, match=message):
+        Predicate(expression)
+
+def test_invalid_syntax_is_rejected():
+    with pytest.raises(SyntaxError):
+        Predicate("quality_score >=")
+
+def test_symbol_operators_have_boolean_precedence():
+    predicate = Predicate("is_accurate & quality_score >= 0.7 | ~format_valid")
+    assert predicate.names == ["format_valid", "is_accurate", "quality_score"]
+    assert predicate({"is_accurate": True, "quality_score": 0.8, "format_valid": True})
+    assert not predicate({"is_accurate": True, "quality_score": 0.5, "format_valid": True})
+    assert predicate({"is_accurate": False, "quality_score": 0.5, "format_valid": False})
+
+def test_missing_fields_are_none_and_failed_evaluations_do_not_match():
+    assert Predicate("quality_score is None")({})
+    assert not Predicate("quality_score >= 0.7")({})
+    assert not Predicate(DEFAULT_WHERE)({"is_accurate": True, "format_valid": True})
+    assert Predicate(DEFAULT_WHERE)({"is_accurate": True, "format_valid": True,
+                                      "missing_fields": [], "incorrect_fields": []})
+
+@pytest.mark.parametrize("text, expected", [
+    ('{"is_accurate": true}', ({"is_accurate": True}, False)),
+    ('Here you go:\n```json\n{"is_accurate": true,}\n```', ({"is_accurate": True}, True)),
+    ("{'is_accurate': True, 'missing_fields': None}", ({"is_accurate": True, "missing_fields": None}, True)),
+    ('{"note": "True, not None,"}', ({"note": "True, not None,"}, False)),
+    # Repairs leave string contents alone
+    ('{"note": "None, ]", "ok": True,}', ({"note": "None, ]", "ok": True}, True)),
+    ("no json here", (None, False)),
+])
+def test_parse_json_lenient(text, expected):
+    assert parse_json_lenient(text) == expected
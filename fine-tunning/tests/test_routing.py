@@ -0,0 +1,19 @@
+import time
+
+from routing import UsageReport, estimate_cost
+
+def test_usage_is_costed_per_serving_model_and_latency_is_not_summed(monkeypatch):
+    clock = iter([10.0, 10.1, 10.2])
+    monkeypatch.setattr(time, "perf_counter", lambda: next(clock))
+    usage = UsageReport()
+    # Three overlapping 1s calls, two served by the strong model and one by the cheap one
+    usage.record("extractions", ["GPT4O"], 1, 1000, 100, 1.0)
+    usage.record("extractions", ["GPT4O_MINI"], 1, 1000, 100, 1.0)
+    usage.record("extractions", ["GPT4O"], 1, 1000, 100, 1.0)
+
+    strong, cheap = usage.rows[("extractions", "GPT4O")], usage.rows[("extractions", "GPT4O_MINI")]
+    assert strong["calls"] == 2 and cheap["calls"] == 1
+    assert strong["cost"] == 2 * estimate_cost("GPT4O", 1000, 100)
+    assert cheap["cost"] == estimate_cost("GPT4O_MINI", 1000, 100)
+    assert strong["max_latency"] == 1.0
+    assert round(UsageReport.wall(list(usage.rows.values())), 6) == 1.2
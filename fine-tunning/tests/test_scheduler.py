@@ -0,0 +1,55 @@
+import asyncio
+import random
+
+from scheduler import ModelScheduler, RateLimitError
+from stub_model_server import StubModelClient, StubModelServer
+
+PROFILES = {
+    "flaky": {"latency": 0.01, "rate_limit": 0.6, "error": 0.0, "max_concurrency": 100},
+    "steady": {"latency": 0.01, "rate_limit": 0.0, "error": 0.0, "max_concurrency": 100},
+}
+
+def sdk_like_call(client, batch, answered_by):
+    """Generate a batch the way the dria SDK does: items answering 429 are dropped, not raised"""
+    async def call(model):
+        outputs = []
+        for prompt in batch:
+            try:
+                outputs.append(await client.generate(model, prompt))
+            except RateLimitError:
+                continue
+            answered_by[model] += 1
+        return outputs
+    return call
+
+async def run_batches(profiles, batches=30, size=4):
+    random.seed(0)
+    answered_by = {model: 0 for model in profiles}
+    async with StubModelServer(profiles) as server:
+        client = StubModelClient(server.host, server.port)
+        scheduler = ModelScheduler(list(profiles), max_in_flight=8, backoff_base=0.05, backoff_max=0.2)
+        results = await asyncio.gather(*(
+            scheduler.submit(
+                sdk_like_call(client, [f"prompt {i}.{j}" for j in range(size)], answered_by),
+                size=size,
+                count=len
+            )
+            for i in range(batches)
+        ))
+    return scheduler, results, answered_by
+
+def test_short_results_back_off_and_demote_the_rate_limited_model():
+    scheduler, results, answered_by = asyncio.run(run_batches(PROFILES))
+    flaky, steady = scheduler.stats["flaky"], scheduler.stats["steady"]
+    assert flaky.short > 0 and steady.short == 0
+    assert flaky.error_rate > steady.error_rate
+    assert answered_by["steady"] > answered_by["flaky"]
+    assert all(results)
+
+def test_empty_results_are_retried_on_another_model():
+    profiles = {**PROFILES, "flaky": {**PROFILES["flaky"], "rate_limit": 1.0}}
+    scheduler, results, answered_by = asyncio.run(run_batches(profiles))
+    assert scheduler.stats["flaky"].short > 0
+    assert answered_by["flaky"] == 0
+    # Every batch the flaky model dropped entirely was answered in full elsewhere
+    assert all(len(result) == 4 for result in results)
@@ -0,0 +1,61 @@
+import json
+
+import pytest
+
+from sharding import SHARD_OUTPUT, ShardSet, shard_of, strip_options
+
+def conversation(user, answer="ok"):
+    return [{"role": "user", "content": user}, {"role": "assistant", "content": answer}]
+
+@pytest.fixture
+def shard_set(tmp_path):
+    categories = tmp_path / "categories.jsonl"
+    categories.write_text("".join(json.dumps({"main_category": f"Category {n}"}) + "\n" for n in range(12)))
+    shard_set = ShardSet(tmp_path / "shards")
+    shard_set.partition(str(categories), 3, ["--route", "--budget", "120", "--metrics-port", "9100"])
+    return shard_set
+
+def finish(shard_set, shard, conversations):
+    output = shard_set.path(shard) / SHARD_OUTPUT
+    output.mkdir(parents=True)
+    with open(output / "train-00000.jsonl", 'w') as file:
+        file.writelines(json.dumps({"conversations": item}) + "\n" for item in conversations)
+    (shard_set.path(shard) / ".done").write_text("{}")
+
+def test_partition_splits_categories_and_budget_by_hash(shard_set):
+    manifest = shard_set.manifest
+    assert sum(manifest["roots"]) == 12
+    assert manifest["pipeline_args"] == ["--route"]
+    assert sum(manifest["budgets"]) <= 120
+    for shard in range(3):
+        lines = (shard_set.path(shard) / "datasets/categories.jsonl").read_text().splitlines()
+        assert all(shard_of(json.loads(line), 3) == shard for line in lines)
+
+def test_strip_options_handles_both_spellings():
+    assert strip_options(["--budget=5", "--route", "--shards", "4", "-v"], {"--budget": True, "--shards": True}) == ["--route", "-v"]
+
+def test_merge_refuses_unfinished_shards(shard_set, tmp_path):
+    finish(shard_set, 0, [conversation("a")])
+    with pytest.raises(RuntimeError, match="Shards not done yet"):
+        shard_set.merge(str(tmp_path / "merged.json"))
+
+def test_merge_keeps_shard_order_and_drops_duplicates_across_shards(shard_set, tmp_path):
+    question = "What is the melting point of the alloy used in the turbine blades of this engine model"
+    finish(shard_set, 0, [conversation("first"), conversation(question)])
+    # An exact copy and a near-duplicate with the same user turn but another answer
+    finish(shard_set, 1, [conversation("first"), conversation(question + "?", "different")])
+    finish(shard_set, 2, [conversation("last")])
+
+    counts = shard_set.merge(str(tmp_path / "merged.json"), threshold=0.8)
+
+    merged = json.loads((tmp_path / "merged.json").read_text())
+    assert [item[0]["content"] for item in merged] == ["first", question, "last"]
+    assert counts == {"read": 5, "duplicates": 1, "near_duplicates": 1}
+
+def test_merge_into_jsonl_shards(shard_set, tmp_path):
+    for shard in range(3):
+        finish(shard_set, shard, [conversation(f"shard {shard}")])
+    shard_set.merge(str(tmp_path / "conversations"), threshold=0, format="jsonl")
+    rows = [json.loads(line) for path in sorted((tmp_path / "conversations").glob("*.jsonl"))
+            for line in path.read_text().splitlines()]
+    assert [row["conversations"][0]["content"] for row in rows] == ["shard 0", "shard 1", "shard 2"]
@@ -0,0 +1,77 @@
+import asyncio
+import sys
+import types
+
+import pytest
+
+from streaming import DONE, StreamingStage
+
+class SlowGenerator:
+    """Stands in for a StageGenerator: every batch takes delay seconds to generate"""
+
+    def __init__(self, delay=0.05, fail_on=None):
+        self.delay = delay
+        self.fail_on = fail_on
+        self.journal = None
+        self.prefilter = None
+        self.in_flight = 0
+        self.peak = 0
+
+    def prepare(self, instructions):
+        return instructions
+
+    async def generate(self, instructions):
+        self.in_flight += 1
+        self.peak = max(self.peak, self.in_flight)
+        try:
+            await asyncio.sleep(self.delay)
+            if any(instruction["n"] == self.fail_on for instruction in instructions):
+                raise RuntimeError("generation failed")
+            return [{"n": instruction["n"], "out": True} for instruction in instructions]
+        finally:
+            self.in_flight -= 1
+
+@pytest.fixture
+def stage_module(monkeypatch):
+    module = types.ModuleType("slow_stage")
+    module.to_instructions = lambda record: [{"n": record["n"]}]
+    monkeypatch.setitem(sys.modules, "slow_stage", module)
+    return module
+
+async def run_stage(stage, records):
+    inbox, outbox = asyncio.Queue(), asyncio.Queue()
+    for record in records:
+        inbox.put_nowait(record)
+    inbox.put_nowait(DONE)
+    error = None
+    try:
+        await stage.run(inbox, outbox)
+    except RuntimeError as e:
+        error = e
+    forwarded = []
+    while (record := outbox.get_nowait()) is not DONE:
+        forwarded.append(record)
+    return forwarded, error
+
+def test_batches_overlap_up_to_max_batches(stage_module, tmp_path):
+    generator = SlowGenerator()
+    stage_module.create_generator = lambda cache, **options: generator
+    stage = StreamingStage("slow", "slow_stage", tmp_path / "out.jsonl", batch_size=2, max_wait=0.01, max_batches=4)
+
+    forwarded, error = asyncio.run(run_stage(stage, [{"n": n} for n in range(32)]))
+
+    assert error is None
+    assert generator.peak == 4
+    assert sorted(record["n"] for record in forwarded) == list(range(32))
+    assert len((tmp_path / "out.jsonl").read_text().splitlines()) == 32
+    # 16 batches of 0.05s, 4 at a time
+    assert stage.active_time < 16 * 0.05 / 2
+
+def test_failed_batch_fails_the_stage_and_releases_downstream(stage_module, tmp_path):
+    stage_module.create_generator = lambda cache, **options: SlowGenerator(fail_on=3)
+    stage = StreamingStage("slow", "slow_stage", tmp_path / "out.jsonl", batch_size=2, max_wait=0.01, max_batches=4)
+
+    forwarded, error = asyncio.run(run_stage(stage, [{"n": n} for n in range(32)]))
+
+    assert str(error) == "generation failed"
+    assert all(record["n"] not in (2, 3) for record in forwarded)
@@ -1,8 +1,18 @@
+import argparse
 import asyncio
-import json
-from dria import Prompt, DatasetGenerator, DriaDataset, Model
+from dria import DriaDataset, Model
 from pydantic import BaseModel, Field
 
+from cache import ResponseCache
+from checkpoint import CheckpointJournal
+from generation import StageGenerator
+from jsonl_io import read_jsonl
+from prevalidate import Prevalidator
+
+INPUT_FILE = "datasets/extractions.jsonl"
+OUTPUT_FILE = "datasets/validations.jsonl"
+MODELS = [Model.GPT4O, Model.GPT4O_MINI, Model.ANTHROPIC_SONNET_3_5_OR]
+
 # Define output schema
 class ValidationOutput(BaseModel):
     subject: str = Field(..., description="Original subject name")
@@ -11,6 +21,10 @@ class ValidationOutput(BaseModel):
     extracted_info: str = Field(..., description="Original extracted information")
     validation_result: str = Field(..., description="Validation analysis and feedback")
 
+# Combined mode also scores the extraction, replacing the separate dataset_validator.py call
+class ScoredValidationOutput(ValidationOutput):
+    quality_score: float = Field(..., ge=0, le=1, description="Overall quality score (0-1)")
+
 # Define the prompt template
 PROMPT_TEMPLATE = """
 Validate the following extraction result:
@@ -36,38 +50,111 @@ Provide your validation analysis in a JSON format with the following structure:
 }
 """
 
-# Create dataset
-dataset = DriaDataset(
-    name="extraction_validations",
-    description="Validation results for extracted information",
-    schema=ValidationOutput
-).reset()
-
-# Read extractions from JSONL file
-instructions = []
-with open('datasets/extractions.jsonl', 'r') as file:
-    for line in file:
-        if line.strip():  # Skip empty lines
-            extraction = json.loads(line)
-            if all(key in extraction for key in ["subject", "description", "context", "extracted_info"]):
-                instructions.append(extraction)
-
-# Create prompt
-prompter = Prompt(prompt=PROMPT_TEMPLATE, schema=ValidationOutput)
-
-generator = DatasetGenerator(dataset=dataset)
-
-# Run generation
-asyncio.run(
-    generator.generate(
-        instructions=instructions,
-        singletons=prompter,
-        models=[Model.GPT4O,Model.GPT4O_MINI,Model.ANTHROPIC_SONNET_3_5_OR]
+# Define the combined validation and scoring prompt template
+COMBINED_PROMPT_TEMPLATE = """
+Validate and score the following extraction result:
+
+Subject: {{subject}}
+Description: {{description}}
+Context: {{context}}
+Extracted Information: {{extracted_info}}
+
+Your task is to validate the extraction by:
+1. Checking if the extracted information matches the requirements in the description
+2. Verifying if all required information was extracted from the context
+3. Validating the JSON format and structure
+4. Identifying any missing or incorrect information
+
+Provide your validation analysis in a JSON format with the following structure:
+{
+    "is_complete": true/false,
+    "is_accurate": true/false,
+    "format_valid": true/false,
+    "missing_fields": [],
+    "incorrect_fields": []
+}
+
+Then give a single quality score (0-1) as quality_score, based on:
+   - JSON formatting
+   - Data completeness
+   - Extraction accuracy
+   - Relevance to subject
+"""
+
+# "separate" only validates; "combined" validates and scores in the same call
+MODES = {
+    "separate": {
+        "name": "extraction_validations",
+        "description": "Validation results for extracted information",
+        "schema": ValidationOutput,
+        "prompt": PROMPT_TEMPLATE
+    },
+    "combined": {
+        "name": "scored_extraction_validations",
+        "description": "Validation results and quality scores for extracted information",
+        "schema": ScoredValidationOutput,
+        "prompt": COMBINED_PROMPT_TEMPLATE
+    }
+}
+
+def create_dataset(mode="separate"):
+    return DriaDataset(
+        name=MODES[mode]["name"],
+        description=MODES[mode]["description"],
+        schema=MODES[mode]["schema"]
     )
-)
 
-# Export results to JSONL file
-dataset.to_jsonl("datasets/validations.jsonl")
+def create_generator(cache=None, resume=True, scheduler=None, router=None, usage=None, mode="separate",
+                     prevalidate=False, limit=None):
+    return StageGenerator(
+        stage=MODES[mode]["name"],
+        dataset=create_dataset(mode),
+        prompt_template=MODES[mode]["prompt"],
+        schema=MODES[mode]["schema"],
+        models=MODELS,
+        cache=cache,
+        journal=CheckpointJournal(MODES[mode]["name"]) if resume else None,
+        scheduler=scheduler,
+        router=router,
+        usage=usage,
+        # Rows the local checks can decide never reach the LLM
+        prefilter=Prevalidator() if prevalidate else None,
+        limit=limit
+    )
+
+def to_instructions(extraction):
+    """Build the instructions for one ExtractionOutput record"""
+    if all(key in extraction for key in ["subject", "description", "context", "extracted_info"]):
+        return [extraction]
+    return []
+
+def load_instructions(input_file=INPUT_FILE):
+    """Lazily read extractions from JSONL file"""
+    for extraction in read_jsonl(input_file):
+        yield from to_instructions(extraction)
+
+async def run(input_file=INPUT_FILE, output_file=OUTPUT_FILE, use_cache=True, resume=True,
+              scheduler=None, router=None, usage=None, mode="separate", prevalidate=False,
+              limit=None):
+    # Create generator; journaled instructions are resumed and unchanged ones served from cache
+    generator = create_generator(
+        ResponseCache() if use_cache else None, resume, scheduler, router, usage, mode, prevalidate, limit
+    )
+
+    instructions = load_instructions(input_file)
+
+    # Run generation and export results to JSONL file
+    await generator.run(instructions, output_file)
+
+    # Print confirmation
+    print(f"Results have been exported to {output_file}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Validate extractions")
+    parser.add_argument("--mode", choices=list(MODES), default="separate",
+                        help="combined also returns the quality score in the same call")
+    parser.add_argument("--prevalidate", action="store_true",
+                        help="Decide clear-cut rows locally and only send ambiguous ones to the LLM")
+    args = parser.parse_args()
 
-# Print confirmation
-print("Results have been exported to datasets/validations.jsonl") 
\ No newline at end of file
+    asyncio.run(run(mode=args.mode, prevalidate=args.prevalidate))